@@ -0,0 +1,29 @@
+"""
+PEPYNA: Python-based Electrophysiology Neuron Yield & Analysis
+
+Python library (core functionalities).
+
+Modules:
+    hr_model: extended Hindmarsh-Rose model (parameters, regimes, vectorized right-hand side).
+    model_spec: declarative models compiled to NumPy/Numba right-hand sides and Jacobians (disk cache).
+    bifurcation_data: branch-aware loader of AUTO/XPP bifurcation files (cached).
+    hr_bifurcation: bifurcation diagram of the fast subsystem (pseudo-arclength continuation).
+    hr_averaged: slow-fast averaged reduced model of (z, b) (cached tables, validation).
+    hr_batch: batched deterministic integration of many HR systems (per-member parameters and events).
+    hr_sde:   ensemble (many-realization) simulation of the extended HR SDE.
+    hr_network: networks of coupled HR neurons (sparse connectivity, spike times).
+    particle_filter: particle filters of the hidden HR states from a recorded voltage trace.
+    pmmh:     particle marginal Metropolis-Hastings for the HR SDE parameters (resumable).
+    euler_likelihood: Euler pseudo-likelihood MLE of the drift parameters from fully observed paths.
+    rare_events: adaptive multilevel splitting for rare noise-induced transitions (probabilities, escape times).
+    hr_sweep: bursting regime map over a parameter sweep (parallel, resumable).
+    calibration: fit of HR parameters to the bursts of a recorded cell (ABC-SMC).
+    spikes:   spike and burst detection and classification (recordings and simulations).
+    sde:      general vectorized SDE engine (Euler-Maruyama, SRA1).
+    sde_adaptive: adaptive-step SRA1 for SDEs with additive noise.
+    variance_reduction: estimators of variance-reduced ensembles (antithetic, randomized QMC, common random numbers).
+    mlmc:     multilevel Monte Carlo estimates of HR SDE expectations with a target RMSE.
+    density:  time-resolved marginal densities of SDE ensembles (binned KDE, animations).
+    fokker_planck: deterministic (z, b) density of the averaged model (finite volumes, implicit steps).
+    recording: recording policies of the SDE integrators (strided, summaries, memmap, bursts).
+"""
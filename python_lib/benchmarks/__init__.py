@@ -0,0 +1,5 @@
+"""
+Benchmarks of the PEPYNA library, run from the repository root, e.g.:
+
+    python -m python_lib.benchmarks.hr_solvers
+"""
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark of deterministic solvers for the extended HR model
+
+For each regime (SW, PARB, TRIANG), a reference solution is computed with DOP853 at very
+tight tolerances. Each method is then run with decreasing tolerances until the maximal error
+on x at the output times falls below the target accuracy, and the wall time and number of
+right-hand side (and Jacobian) evaluations are reported at that accuracy.
+
+The baseline "notebook" is the setup of `notebooks/1_lhb.ipynb`: default RK45 with a
+non-vectorized right-hand side building a new array per call.
+
+Usage:
+    python -m python_lib.benchmarks.hr_solvers [--t-max 1000] [--target 1e-3]
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+from ..hr_model import REGIMES, HRModel, hr_initial_condition
+
+TOLERANCES = [10.0**(-k) for k in range(4, 13)]
+
+
+def notebook_rhs(params):
+    """
+    Right-hand side written as in the notebooks (scalar components, new array per call).
+    """
+    a, c, d, I, x1, eps = (params[key] for key in ("a", "c", "d", "I", "x1", "eps"))
+    s1, alpha, z0, b0 = (params[key] for key in ("s1", "alpha", "z0", "b0"))
+
+    def HRext(t, S):
+        x, y, z, b = S
+        dxdt = c * (x - x**3 / 3 - y + z + I)
+        dydt = (x**2 + d * x - b * y + a) / c
+        dzdt = eps * (-s1 * (x - x1) - (b - b0))
+        dbdt = eps * (z - z0 + alpha * x)
+        return np.array([dxdt, dydt, dzdt, dbdt])
+
+    return HRext
+
+
+def run(model, method, y0, t_span, t_eval, tol):
+    """
+    Runs one solver and returns (solution, wall time).
+    """
+    start = time.perf_counter()
+    with np.errstate(over="ignore", invalid="ignore"):   # loose tolerances may blow up
+        if method == "notebook":
+            sol = solve_ivp(notebook_rhs(model.params), t_span, y0, t_eval=t_eval, rtol=tol, atol=tol * 1e-2)
+        else:
+            sol = model.solve(t_span, y0, method=method, t_eval=t_eval, rtol=tol, atol=tol * 1e-2)
+    return sol, time.perf_counter() - start
+
+
+def benchmark(regime, t_max, target, methods):
+    """
+    Prints the cost of each method at the target accuracy for one regime.
+    """
+    model = HRModel(regime)
+    y0 = hr_initial_condition(regime)
+    t_span = (0, t_max)
+    t_eval = np.linspace(0, t_max, 20 * int(t_max) + 1)
+    reference = model.solve(t_span, y0, method="DOP853", t_eval=t_eval, rtol=1e-13, atol=1e-13)
+
+    print(f"\n📊 {regime} (t_max = {t_max}, target max |x - x_ref| = {target:g})")
+    print(f"  {'method':>10} {'rtol':>8} {'error':>10} {'time (s)':>9} {'nfev':>8} {'njev':>6}")
+    for method in methods:
+        for tol in TOLERANCES:
+            sol, wall = run(model, method, y0, t_span, t_eval, tol)
+            if not sol.success:
+                continue
+            error = np.max(np.abs(sol.y[0] - reference.y[0]))
+            if error <= target:
+                print(f"  {method:>10} {tol:8.0e} {error:10.2e} {wall:9.3f} {sol.nfev:8d} {sol.njev:6d}")
+                break
+        else:
+            print(f"  {method:>10} target accuracy not reached")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="📊 Compare deterministic solvers for the extended HR model.")
+    parser.add_argument("--t-max", type=float, default=1000.0, help="Integration horizon (default: 1000).")
+    parser.add_argument("--target", type=float, default=1e-3, help="Target accuracy on x (default: 1e-3).")
+    parser.add_argument("--methods", nargs="+", default=["notebook", "RK45", "DOP853", "LSODA", "Radau"],
+                        help="Methods to compare.")
+    args = parser.parse_args()
+
+    for regime in REGIMES:
+        benchmark(regime, args.t_max, args.target, args.methods)
+
+
+if __name__ == "__main__":
+    main()
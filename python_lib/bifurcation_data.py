@@ -0,0 +1,110 @@
+"""
+Loader of the bifurcation data files exported from AUTO/XPP
+
+The files (e.g. `notebooks/bifurcation_diagram.dat`) have 6 columns: 3 real values (the two
+continuation parameters and a value of the solution) followed by 3 integer codes (type and
+stability of the points of the curve). A file contains several branches one after the other, which
+`1_lhb.ipynb` separates with hard-coded row slices. Here the branches are split:
+
+    - where the codes change (another type of curve, another stability);
+    - where the continuation restarts: a jump much larger than the typical step between
+      consecutive rows (AUTO continues each curve in both directions from the same point);
+
+and repeated consecutive rows are dropped.
+
+Each branch is returned as a structured array (3 float fields, 3 small integer fields).
+The parsed branches are cached in a binary file next to the text file (`<file>.npz`),
+rebuilt whenever the text file changes (size or modification time).
+
+Usage (instead of the row slices of 1_lhb.ipynb):
+    for branch in load_bifurcation_data("bifurcation_diagram.dat"):
+        plt.plot(branch["par1"], branch["par2"], color="red" if branch["code1"][0] == 2 else "black")
+"""
+
+import os
+
+import numpy as np
+
+FIELDS = ("par1", "par2", "value")
+CODES = ("code1", "code2", "code3")
+
+DTYPE = np.dtype([(name, np.float64) for name in FIELDS] + [(name, np.int16) for name in CODES])
+
+
+def split_branches(data, jump_factor=20.0):
+    """
+    Splits the rows of a bifurcation data file into branches.
+
+    Parameters:
+        data: ndarray of shape (N, 6), rows of the file.
+        jump_factor: a new branch starts where the distance between consecutive points in the
+            (par1, par2) plane exceeds `jump_factor` times the median distance.
+
+    Returns:
+        list of structured arrays of dtype DTYPE.
+    """
+    data = np.asarray(data, dtype=float)
+    if data.ndim != 2 or data.shape[1] != 6:
+        raise ValueError(f"Bifurcation data must be an array of shape (N, 6), but got {data.shape}.")
+
+    # --- repeated consecutive rows
+    if len(data) > 1:
+        data = data[np.concatenate([[True], np.any(np.diff(data, axis=0) != 0, axis=1)])]
+
+    # --- branch boundaries: change of the codes or restart of the continuation
+    steps = np.hypot(*np.diff(data[:, :2], axis=0).T)
+    scale = np.median(steps) if len(steps) else 0.0
+    breaks = np.any(np.diff(data[:, 3:], axis=0) != 0, axis=1) | (steps > jump_factor * scale)
+    starts = np.concatenate([[0], np.flatnonzero(breaks) + 1, [len(data)]])
+
+    branches = []
+    for start, stop in zip(starts[:-1], starts[1:]):
+        branch = np.empty(stop - start, dtype=DTYPE)
+        for i, name in enumerate(FIELDS + CODES):
+            branch[name] = data[start:stop, i]
+        branches.append(branch)
+    return branches
+
+
+def _cache_path(path):
+    return path + ".npz"
+
+
+def _source_signature(path):
+    status = os.stat(path)
+    return np.array([status.st_size, status.st_mtime_ns], dtype=np.int64)
+
+
+def load_bifurcation_data(path, jump_factor=20.0, cache=True):
+    """
+    Loads the branches of a bifurcation data file (6 columns, see the module).
+
+    Parameters:
+        path: str, text file.
+        jump_factor: see split_branches.
+        cache: read/write the binary cache `<path>.npz` (ignored if it cannot be written).
+
+    Returns:
+        list of structured arrays of dtype DTYPE, one per branch, in the order of the file.
+    """
+    signature = _source_signature(path)
+    cache_path = _cache_path(path)
+    if cache and os.path.exists(cache_path):
+        with np.load(cache_path) as saved:
+            if (np.array_equal(saved["signature"], signature) and float(saved["jump_factor"]) == jump_factor
+                    and saved["dtype"] == str(DTYPE)):
+                return [saved[f"branch_{i}"] for i in range(int(saved["n_branches"]))]
+
+    branches = split_branches(np.loadtxt(path, ndmin=2), jump_factor)
+
+    if cache:
+        arrays = {f"branch_{i}": branch for i, branch in enumerate(branches)}
+        temporary = cache_path + ".tmp"
+        try:
+            with open(temporary, "wb") as file:
+                np.savez(file, signature=signature, jump_factor=jump_factor, dtype=str(DTYPE),
+                         n_branches=len(branches), **arrays)
+            os.replace(temporary, cache_path)
+        except OSError:   # read-only directory: no cache
+            pass
+    return branches
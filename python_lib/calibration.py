@@ -0,0 +1,264 @@
+"""
+Calibration of the HR parameters on the bursts of a recorded cell
+
+The parameters of the extended HR model are fitted to the spike and burst statistics of an
+ABF recording (`data/MD/cell_*.ipynb`) by approximate Bayesian computation with sequential
+Monte Carlo (ABC-SMC, population Monte Carlo of Beaumont et al., 2009):
+
+    1. generation 0: n_particles parameter sets drawn from the prior (uniform in a box);
+    2. generation g: the tolerance is a quantile of the distances of generation g-1, the
+       proposals are particles of generation g-1 (drawn according to their weights) moved by a
+       Gaussian kernel of twice their weighted covariance, and are accepted if their distance
+       to the recording is below the tolerance; the weights correct for the proposal.
+
+The model and the recording are compared through summaries that do not depend on the time
+and voltage units (SUMMARIES): spikes per burst, duty cycle (burst duration / burst period)
+and fractions of square-wave and parabolic bursts. The distance is the Euclidean distance
+between the summaries scaled by their median absolute deviation under the prior; the
+parameter sets without bursts are at an infinite distance.
+
+The proposals are simulated by batches of `batch_size`, as vectorized ensembles with one
+parameter set per realization (the simulation of hr_sweep.py), split in chunks possibly
+distributed over several processes. Each batch draws its noise from a stream spawned from
+`seed` and its summaries are cached in `cache_dir`, so a fit run again with the same seed
+(e.g. after an interruption, or with more generations) does not simulate again.
+
+Usage:
+    t, v = ...   # recording of a cell, in s and mV
+    observed = summary_vector(burst_statistics(t, v))
+    fit = abc_smc(observed, {"s1": (0.005, 0.15), "b0": (0.3, 1.6)}, n_jobs=8,
+                  cache_dir="calibration/cell_209", seed=1)
+    np.average(fit["particles"], axis=0, weights=fit["weights"])   # posterior mean
+"""
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .hr_model import hr_initial_condition, hr_parameters
+from .hr_sweep import FEATURES, check_names, save_npz, sweep_chunk
+
+SUMMARIES = ("spikes_per_burst", "duty_cycle", "square_wave", "parabolic")
+
+
+def summary_vector(stats):
+    """
+    Returns the unit-free summaries of spike and burst statistics.
+
+    Parameters:
+        stats: dict of statistics, floats or ndarrays of shape (R,) (see
+            spikes.burst_statistics and spikes.ensemble_burst_statistics).
+
+    Returns:
+        ndarray of shape (len(SUMMARIES),) or (R, len(SUMMARIES)), NaN when undefined.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        duty_cycle = np.asarray(stats["burst_duration"], dtype=float) / np.asarray(stats["burst_period"], dtype=float)
+    values = {"duty_cycle": duty_cycle, **{name: stats[name] for name in SUMMARIES if name != "duty_cycle"}}
+    return np.stack([np.asarray(values[name], dtype=float) for name in SUMMARIES], axis=-1)
+
+
+# ___ simulation of the proposals _________________________________________________________________
+
+class _Simulator:
+    """
+    Simulates batches of parameter sets and returns their summaries, with a cache on disk.
+    """
+
+    def __init__(self, names, params, X0, T, dt, record_every, t_transient, sigma_z, sigma_b, analysis,
+                 chunk_size, executor, cache_dir):
+        self.names = names
+        self.settings = (params, X0, T, dt, record_every, t_transient, sigma_z, sigma_b, 1)
+        self.analysis = analysis
+        self.chunk_size = chunk_size
+        self.executor = executor
+        self.cache_dir = cache_dir
+        self.key = repr((list(names), sorted(params.items()), X0.tolist(), T, dt, record_every, t_transient,
+                         sigma_z, sigma_b, sorted(analysis.items()), chunk_size))
+        self.n_simulations = 0
+
+    def _cache_path(self, thetas, seed_seq):
+        digest = hashlib.sha1(self.key.encode())
+        digest.update(thetas.tobytes())
+        digest.update(repr((seed_seq.entropy, seed_seq.spawn_key)).encode())
+        return os.path.join(self.cache_dir, f"batch_{digest.hexdigest()[:16]}.npz")
+
+    def __call__(self, thetas, seed_seq):
+        """
+        Parameters:
+            thetas: ndarray of shape (M, len(names)), parameter sets.
+            seed_seq: numpy.random.SeedSequence of the batch.
+
+        Returns:
+            ndarray of shape (M, len(SUMMARIES)).
+        """
+        thetas = np.ascontiguousarray(thetas, dtype=float)
+        path = None if self.cache_dir is None else self._cache_path(thetas, seed_seq)
+        if path is not None and os.path.exists(path):
+            with np.load(path) as saved:
+                return saved["summaries"]
+
+        bounds = list(range(0, len(thetas), self.chunk_size)) + [len(thetas)]
+        tasks = [
+            ({name: thetas[start:stop, i] for i, name in enumerate(self.names)}, *self.settings, chunk_seq,
+             self.analysis)
+            for start, stop, chunk_seq in zip(bounds[:-1], bounds[1:], seed_seq.spawn(len(bounds) - 1))
+        ]
+        if self.executor is None or len(tasks) == 1:
+            chunks = [sweep_chunk(*task) for task in tasks]
+        else:
+            chunks = list(self.executor.map(sweep_chunk, *zip(*tasks)))
+        features = np.concatenate([features for features, _ in chunks])
+        summaries = summary_vector({name: features[:, i] for i, name in enumerate(FEATURES)})
+        self.n_simulations += len(thetas)
+
+        if path is not None:
+            save_npz(path, thetas=thetas, summaries=summaries)
+        return summaries
+
+
+# ___ ABC-SMC _____________________________________________________________________________________
+
+def _distances(summaries, observed, scale):
+    """
+    Scaled Euclidean distances to the observed summaries (NaN summaries: infinite distance).
+    """
+    defined = ~np.isnan(observed)
+    d = np.sqrt(np.sum(((summaries[:, defined] - observed[defined]) / scale[defined]) ** 2, axis=1))
+    return np.where(np.isnan(d), np.inf, d)
+
+
+def _kernel_weights(proposals, particles, weights, covariance):
+    """
+    Importance weights of the proposals (uniform prior): 1 / sum_j w_j N(theta - theta_j; 0, covariance).
+    """
+    L = np.linalg.cholesky(covariance)
+    difference = np.linalg.solve(L, (proposals[:, None, :] - particles[None, :, :]).reshape(-1, len(L)).T)
+    log_kernel = -0.5 * np.sum(difference**2, axis=0).reshape(len(proposals), len(particles))
+    log_mixture = np.log(np.exp(log_kernel - log_kernel.max(axis=1, keepdims=True)) @ weights)
+    log_mixture += log_kernel.max(axis=1)
+    w = np.exp(-(log_mixture - log_mixture.min()))
+    return w / w.sum()
+
+
+def abc_smc(observed, bounds, regime="SW", params=None, X0=None, n_particles=500, n_generations=6, quantile=0.5,
+            min_acceptance=0.01, batch_size=None, T=2000.0, dt=0.01, record_every=10, t_transient=500.0,
+            sigma_z=0.0, sigma_b=0.0, height=0.0, isi_threshold=80.0, min_spikes=2, chunk_size=250, n_jobs=1,
+            cache_dir=None, seed=None):
+    """
+    Fits HR parameters to the observed burst summaries by ABC-SMC.
+
+    Parameters:
+        observed: ndarray of shape (len(SUMMARIES),), summaries of the recording (see
+            summary_vector), NaN entries are ignored.
+        bounds: dict mapping the fitted parameters to (low, high), support of the uniform prior.
+        regime, params, X0: values of the parameters that are not fitted and initial
+            condition (see hr_sweep.run_sweep).
+        n_particles: number of particles per generation.
+        n_generations: maximal number of generations (including generation 0).
+        quantile: the tolerance of a generation is this quantile of the previous distances.
+        min_acceptance: the fit stops when the acceptance rate of a generation falls below.
+        batch_size: number of proposals simulated together (None: n_particles).
+        T, dt, record_every, t_transient, sigma_z, sigma_b: simulation (see hr_sweep.run_sweep).
+        height, isi_threshold, min_spikes: spike and burst detection on x, in model units.
+        chunk_size: number of proposals per task (the vectorized simulation is cheaper per
+            proposal for large chunks).
+        n_jobs: number of worker processes (1: no multiprocessing).
+        cache_dir: directory of the simulation cache (None: no cache).
+        seed: seed of the root SeedSequence (None: fresh entropy, no reuse of the cache).
+
+    Returns:
+        dict with
+            "names": fitted parameters;
+            "particles": ndarray of shape (n_particles, d), last generation;
+            "weights", "distances": ndarrays of shape (n_particles,);
+            "summaries": ndarray of shape (n_particles, len(SUMMARIES));
+            "scale": ndarray of shape (len(SUMMARIES),), scale of the distance;
+            "epsilons", "acceptance_rates": ndarrays of shape (G,), per generation;
+            "n_simulations": int, number of simulated parameter sets (cache excluded).
+    """
+    check_names(bounds)
+    names = list(bounds)
+    low, high = np.array(list(bounds.values()), dtype=float).T
+    observed = np.asarray(observed, dtype=float)
+    if observed.shape != (len(SUMMARIES),):
+        raise ValueError(f"observed must be of shape ({len(SUMMARIES)},), but got {observed.shape}.")
+    if np.all(np.isnan(observed)):
+        raise ValueError("The observed summaries are all undefined (no bursts in the recording?).")
+    batch_size = n_particles if batch_size is None else batch_size
+
+    params = hr_parameters(regime, **(params or {}))
+    X0 = hr_initial_condition(regime) if X0 is None else np.asarray(X0, dtype=float)
+    analysis = {"height": height, "isi_threshold": isi_threshold, "min_spikes": min_spikes}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    generation_seqs = np.random.SeedSequence(seed).spawn(n_generations)
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    try:
+        simulate = _Simulator(names, params, X0, T, dt, record_every, t_transient, sigma_z, sigma_b, analysis,
+                              chunk_size, executor, cache_dir)
+
+        # --- generation 0: prior sample, scale of the summaries
+        rng = np.random.default_rng(generation_seqs[0])
+        particles = low + (high - low) * rng.random((n_particles, len(names)))
+        summaries = simulate(particles, generation_seqs[0].spawn(1)[0])
+        scale = np.nanmedian(np.abs(summaries - np.nanmedian(summaries, axis=0)), axis=0)
+        scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+        distances = _distances(summaries, observed, scale)
+        weights = np.full(n_particles, 1.0 / n_particles)
+        epsilons, acceptance_rates = [np.inf], [1.0]
+
+        for generation_seq in generation_seqs[1:]:
+            finite = np.isfinite(distances)
+            if not np.any(finite):
+                break
+            epsilon = np.quantile(distances[finite], quantile)
+            covariance = 2 * np.atleast_2d(np.cov(particles.T, aweights=weights)) + 1e-12 * np.diag((high - low) ** 2)
+
+            # --- proposals, by batches, until n_particles are accepted
+            rng = np.random.default_rng(generation_seq.spawn(1)[0])
+            accepted = {"particles": [], "summaries": [], "distances": []}
+            n_accepted = n_proposed = 0
+            while n_accepted < n_particles and n_proposed * min_acceptance <= n_particles:
+                proposals = particles[rng.choice(n_particles, size=batch_size, p=weights)]
+                proposals = proposals + rng.multivariate_normal(np.zeros(len(names)), covariance, size=batch_size)
+                proposals = proposals[np.all((proposals >= low) & (proposals <= high), axis=1)]
+                n_proposed += batch_size
+                if len(proposals) == 0:
+                    continue
+                batch_summaries = simulate(proposals, generation_seq.spawn(1)[0])
+                batch_distances = _distances(batch_summaries, observed, scale)
+                kept = batch_distances <= epsilon
+                accepted["particles"].append(proposals[kept])
+                accepted["summaries"].append(batch_summaries[kept])
+                accepted["distances"].append(batch_distances[kept])
+                n_accepted += np.count_nonzero(kept)
+
+            acceptance_rate = n_accepted / n_proposed
+            if n_accepted < n_particles or acceptance_rate < min_acceptance:
+                break
+            new_particles = np.concatenate(accepted["particles"])[:n_particles]
+            weights = _kernel_weights(new_particles, particles, weights, covariance)
+            particles = new_particles
+            summaries = np.concatenate(accepted["summaries"])[:n_particles]
+            distances = np.concatenate(accepted["distances"])[:n_particles]
+            epsilons.append(epsilon)
+            acceptance_rates.append(acceptance_rate)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return {
+        "names": names,
+        "particles": particles,
+        "weights": weights,
+        "distances": distances,
+        "summaries": summaries,
+        "scale": scale,
+        "epsilons": np.array(epsilons),
+        "acceptance_rates": np.array(acceptance_rates),
+        "n_simulations": simulate.n_simulations,
+    }
@@ -0,0 +1,245 @@
+"""
+Time-resolved marginal densities of SDE ensembles
+
+`sandbox/sde.ipynb` animates the density of an ensemble by fitting scipy.stats.gaussian_kde to
+each time slice in the animation update, which costs O(R x G) per frame (R realizations,
+G grid points). Here the densities of all the frames are computed at once:
+
+    1. linear binning: each sample splits its unit mass between the two neighbouring points
+       of a regular grid (one np.bincount over all the frames), O(R) per frame;
+    2. Gaussian smoothing of the binned counts by FFT convolution along the grid, with the
+       bandwidth of each frame (Scott's rule by default, as gaussian_kde), O(G log G) per frame.
+
+The binned estimate differs from the exact kernel estimate by O(dx^2) (dx grid step) and
+ignores the samples outside the grid. The counts can also be accumulated during the
+integration (DensityRecorder), so that neither the trajectories nor the time slices are
+stored: the memory is O(frames x G).
+
+The frames are drawn by updating one line and handed directly to a matplotlib animation
+writer (GIF with Pillow, MP4 with ffmpeg), without FuncAnimation and without redrawing the axes.
+
+Usage:
+    t_vals, paths = simulate_hr_ensemble(..., observables=("z",), record_every=100)
+    grid = np.linspace(-3, 3, 512)
+    densities = binned_kde(paths["z"], grid)          # (n_rec, 512)
+    write_density_animation("z_density.gif", grid, t_vals, densities, xlabel="z")
+"""
+
+import numpy as np
+
+from .recording import StridedRecorder
+
+
+def _grid_step(grid):
+    grid = np.asarray(grid, dtype=float)
+    step = (grid[-1] - grid[0]) / (len(grid) - 1) if len(grid) > 1 else 0.0
+    if step <= 0 or not np.allclose(np.diff(grid), step):
+        raise ValueError("The grid must be regular and increasing, with at least 2 points.")
+    return grid, step
+
+
+def linear_binning(samples, grid):
+    """
+    Linear binning of the samples of all the frames on a regular grid.
+
+    Parameters:
+        samples: ndarray of shape (R, F), R samples at each of the F frames (the layout of the
+            paths of hr_sde.simulate_hr_ensemble).
+        grid: ndarray of shape (G,), regular grid.
+
+    Returns:
+        ndarray of shape (F, G), binned counts (the samples outside the grid are ignored).
+    """
+    grid, step = _grid_step(grid)
+    samples = np.asarray(samples, dtype=float)
+    F, G = samples.shape[1], len(grid)
+
+    position = (samples.T - grid[0]) / step
+    inside = (position >= 0) & (position <= G - 1)
+    frame = np.broadcast_to(np.arange(F)[:, None], position.shape)[inside]
+    position = position[inside]
+    left = np.minimum(np.floor(position).astype(int), G - 2)
+    right_weight = position - left
+
+    index = frame * G + left
+    counts = np.bincount(index, weights=1 - right_weight, minlength=F * G)
+    counts += np.bincount(index + 1, weights=right_weight, minlength=F * G)
+    return counts.reshape(F, G)
+
+
+def scott_bandwidth(std, n):
+    """
+    Scott's rule for a 1D Gaussian kernel (the default of scipy.stats.gaussian_kde): std n^(-1/5).
+    """
+    return np.asarray(std, dtype=float) * np.asarray(n, dtype=float) ** (-1 / 5)
+
+
+def smooth_counts(counts, grid, bandwidth, n=None):
+    """
+    Gaussian kernel density estimates from binned counts, by FFT convolution.
+
+    Parameters:
+        counts: ndarray of shape (F, G), binned counts (see linear_binning).
+        grid: ndarray of shape (G,), regular grid.
+        bandwidth: float or ndarray of shape (F,), standard deviation of the kernel of each frame.
+        n: int or ndarray of shape (F,), number of samples of each frame, including those
+            outside the grid (None: the counts inside the grid).
+
+    Returns:
+        ndarray of shape (F, G), densities (with n, each frame integrates to about the fraction
+        of its samples inside the grid, as gaussian_kde; without n, to about 1).
+    """
+    grid, step = _grid_step(grid)
+    counts = np.atleast_2d(np.asarray(counts, dtype=float))
+    F, G = counts.shape
+    bandwidth = np.broadcast_to(np.asarray(bandwidth, dtype=float), (F,))
+
+    # --- zero padding of the length of the grid: no wrap-around of the kernel tails
+    L = 1 << int(np.ceil(np.log2(2 * G)))
+    offsets = np.minimum(np.arange(L), L - np.arange(L)) * step
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kernel = np.exp(-0.5 * (offsets / bandwidth[:, None]) ** 2)
+    kernel[~(bandwidth > 0)] = (offsets == 0)   # degenerate frames (a single value): no smoothing
+    kernel /= kernel.sum(axis=1, keepdims=True)
+
+    smoothed = np.fft.irfft(np.fft.rfft(counts, L, axis=1) * np.fft.rfft(kernel, axis=1), L, axis=1)[:, :G]
+    if n is None:
+        total = counts.sum(axis=1, keepdims=True)
+    else:
+        total = np.broadcast_to(np.asarray(n, dtype=float), (F,))[:, None]
+    np.maximum(smoothed, 0.0, out=smoothed)   # round-off
+    return smoothed / (np.where(total > 0, total, 1.0) * step)
+
+
+def binned_kde(samples, grid, bandwidth=None):
+    """
+    Gaussian kernel density estimates of the frames of an ensemble (linear binning + FFT).
+
+    Parameters:
+        samples: ndarray of shape (R, F), R samples at each of the F frames.
+        grid: ndarray of shape (G,), regular grid.
+        bandwidth: float or ndarray of shape (F,), None: Scott's rule for each frame.
+
+    Returns:
+        ndarray of shape (F, G), densities on the grid.
+    """
+    samples = np.asarray(samples, dtype=float)
+    if bandwidth is None:
+        bandwidth = scott_bandwidth(samples.std(axis=0, ddof=1), samples.shape[0])
+    return smooth_counts(linear_binning(samples, grid), grid, bandwidth, samples.shape[0])
+
+
+def histogram_density(samples, edges):
+    """
+    Normalized histograms of the frames of an ensemble, computed with a single np.bincount.
+
+    Parameters:
+        samples: ndarray of shape (R, F).
+        edges: ndarray of shape (B+1,), increasing bin edges.
+
+    Returns:
+        ndarray of shape (F, B), densities (the samples outside the edges are ignored).
+    """
+    samples = np.asarray(samples, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+    F, B = samples.shape[1], len(edges) - 1
+    bins = np.searchsorted(edges, samples.T, side="right") - 1
+    bins[samples.T == edges[-1]] = B - 1
+    inside = (bins >= 0) & (bins < B)
+    frame = np.broadcast_to(np.arange(F)[:, None], bins.shape)
+    counts = np.bincount(frame[inside] * B + bins[inside], minlength=F * B).reshape(F, B)
+    return counts / (samples.shape[0] * np.diff(edges))
+
+
+class DensityRecorder(StridedRecorder):
+    """
+    Accumulates the linear binning of one component at the time steps 0, every, 2*every, ...
+    during the integration (the recorder protocol of recording.py), without storing the states.
+
+    Parameters:
+        grid: ndarray of shape (G,), regular grid.
+        every: int, one frame every `every` time steps.
+        component: index of the component.
+
+    Result:
+        times: ndarray of shape (n_rec,), times of the frames.
+        frames: dict with "counts" (ndarray of shape (n_rec, G)), "mean" and "std" (ndarrays of
+            shape (n_rec,), ensemble statistics) and "n" (number of realizations); the
+            densities are smooth_counts(counts, grid, scott_bandwidth(std, n), n).
+    """
+
+    def __init__(self, grid, every=1, component=0):
+        super().__init__(every=every, components=[component])
+        self.grid, _ = _grid_step(grid)
+
+    def start(self, t_vals, X0):
+        self.times = t_vals[::self.every]
+        self.counts = np.zeros((len(self.times), len(self.grid)))
+        self.mean = np.empty(len(self.times))
+        self.std = np.empty(len(self.times))
+        self.n = X0.shape[0]
+        self.record(0, t_vals[0], X0)
+
+    def record(self, k, t, X):
+        if k % self.every == 0:
+            values = self._select(X)
+            j = k // self.every
+            self.counts[j] = linear_binning(values, self.grid)[0]
+            self.mean[j] = values.mean()
+            self.std[j] = values.std(ddof=1) if self.n > 1 else 0.0
+
+    def result(self):
+        return self.times, {"counts": self.counts, "mean": self.mean, "std": self.std, "n": self.n}
+
+    @staticmethod
+    def merge(results):
+        """
+        Combines the results of the recorders of several chunks of realizations (used by
+        hr_sde.simulate_hr_ensemble): the counts are added, the statistics pooled.
+        """
+        times, frames = results[0][0], [frame for _, frame in results]
+        n = np.array([frame["n"] for frame in frames], dtype=float)[:, None]
+        mean = np.array([frame["mean"] for frame in frames])
+        std = np.array([frame["std"] for frame in frames])
+        total = n.sum()
+        pooled_mean = np.sum(n * mean, axis=0) / total
+        squares = np.sum((n - 1) * std**2 + n * (mean - pooled_mean) ** 2, axis=0)
+        return times, {"counts": sum(frame["counts"] for frame in frames), "mean": pooled_mean,
+                       "std": np.sqrt(squares / max(total - 1, 1)), "n": int(total)}
+
+
+def write_density_animation(path, grid, times, densities, fps=10, dpi=100, ylim=None, xlabel="x", writer=None):
+    """
+    Writes the animation of the densities, one frame per time, to a GIF or MP4 file.
+
+    Parameters:
+        path: str, output file (.gif: Pillow writer, otherwise ffmpeg).
+        grid: ndarray of shape (G,).
+        times: ndarray of shape (F,).
+        densities: ndarray of shape (F, G) (see binned_kde).
+        fps, dpi: frame rate and resolution.
+        ylim: upper limit of the density axis (None: maximum of the densities).
+        xlabel: label of the grid axis.
+        writer: matplotlib.animation writer (None: chosen from the extension of `path`).
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FFMpegWriter, PillowWriter
+
+    if writer is None:
+        writer = PillowWriter(fps=fps) if path.lower().endswith(".gif") else FFMpegWriter(fps=fps)
+
+    fig, ax = plt.subplots()
+    line, = ax.plot(grid, densities[0], lw=2)
+    ax.set_xlim(grid[0], grid[-1])
+    ax.set_ylim(0, np.max(densities) * 1.05 if ylim is None else ylim)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("density")
+    title = ax.set_title("")
+    try:
+        with writer.saving(fig, path, dpi):
+            for time, density in zip(times, densities):
+                line.set_ydata(density)
+                title.set_text(f"t = {time:.2f}")
+                writer.grab_frame()
+    finally:
+        plt.close(fig)
@@ -0,0 +1,196 @@
+"""
+Euler pseudo-likelihood of fully observed paths of the extended HR SDE
+
+For paths observed at every time step dt (e.g. the paths of hr_sde.simulate_hr_ensemble, or
+`solution_sde_x/y/z/b` of the notebooks), the Euler-Maruyama transition density of the noisy
+components Y = (z, b) is Gaussian:
+
+    Y_{k+1} - Y_k ~ N(dt mu(X_k), dt Sigma),    Sigma = eps^2 L L^T  (L: hr_sde.noise_cholesky),
+
+and its drift is linear in the features phi = (1, x, z, b) of the current state,
+
+    mu(X) = eps A(theta) phi,    A = [[s1 x1 + b0, -s1, 0, -1],
+                                      [-z0,       alpha, 1,  0]].
+
+The log-likelihood of all the transitions is therefore a function of a few sums over the data
+(sufficient statistics: the number of transitions, sum dY dY^T, sum dY phi^T and
+sum phi phi^T), computed once in one vectorized pass (np.einsum, no loop over the time steps),
+batched over the trajectories. Each evaluation of the log-likelihood and of its analytic
+gradient in the drift parameters (s1, x1, b0, z0, alpha) then costs O(1), whatever the number
+of samples, and the maximum likelihood estimate is obtained by L-BFGS-B. The noise covariance is
+either given (sigma_z, sigma_b, rho) or profiled out (Sigma = empirical covariance of the
+residuals, the gradient is unchanged by the envelope theorem).
+
+The fast variables (x, y) have no noise and do not enter the pseudo-likelihood; eps is kept
+fixed (it scales the drift and the noise of (z, b) together), and x1 and b0 only enter through
+s1 x1 + b0, so at most one of them can be estimated.
+
+Usage:
+    t_vals, paths = simulate_hr_ensemble(params, X0, T=2000, N=200000, R=100, seed=1)
+    fit = fit_euler_mle(t_vals, paths, params=hr_parameters("SW", s1=0.05, b0=0.8))
+    fit["s1"], fit["b0"], fit["sigma_z"]
+"""
+
+import numpy as np
+from scipy.optimize import minimize
+
+from .hr_model import hr_parameters
+from .hr_sde import noise_cholesky
+
+DRIFT_PARAMETERS = ("s1", "x1", "b0", "z0", "alpha")
+ESTIMATED = ("s1", "b0", "z0", "alpha")
+
+
+def _components(paths):
+    """
+    Returns x, z, b of shape (R, n+1) from a dict of paths or an ndarray of shape (R, n+1, 4).
+    """
+    if isinstance(paths, dict):
+        x, z, b = (np.atleast_2d(np.asarray(paths[name], dtype=float)) for name in ("x", "z", "b"))
+    else:
+        X = np.asarray(paths, dtype=float)
+        X = X[None] if X.ndim == 2 else X
+        x, z, b = X[..., 0], X[..., 2], X[..., 3]
+    return x, z, b
+
+
+def sufficient_statistics(t_vals, paths, per_path=False):
+    """
+    Sufficient statistics of the Euler pseudo-likelihood, in one pass over the data.
+
+    Parameters:
+        t_vals: ndarray of shape (n+1,), regular observation times.
+        paths: dict with "x", "z", "b" of shape (R, n+1) (hr_sde.simulate_hr_ensemble), or
+            ndarray of shape (R, n+1, 4) or (n+1, 4) (sde.sde_vectorized).
+        per_path: keep the statistics of each trajectory (leading dimension R) instead of
+            their sums.
+
+    Returns:
+        dict with "dt", "n" (number of transitions), "DD" (2, 2), "DF" (2, 4) and "FF" (4, 4)
+        (sums of dY dY^T, dY phi^T and phi phi^T), with a leading dimension R if per_path.
+    """
+    t_vals = np.asarray(t_vals, dtype=float)
+    dt = (t_vals[-1] - t_vals[0]) / (len(t_vals) - 1)
+    if not np.allclose(np.diff(t_vals), dt, rtol=1e-6, atol=0):
+        raise ValueError("The observation times must be regular.")
+    x, z, b = _components(paths)
+    if x.shape[-1] != len(t_vals):
+        raise ValueError(f"The paths must have {len(t_vals)} time points, but got {x.shape[-1]}.")
+
+    F = np.stack([np.ones_like(x[:, :-1]), x[:, :-1], z[:, :-1], b[:, :-1]], axis=-1)   # (R, n, 4)
+    D = np.stack([np.diff(z, axis=1), np.diff(b, axis=1)], axis=-1)                    # (R, n, 2)
+    subscripts = "rki,rkj->rij" if per_path else "rki,rkj->ij"
+    return {
+        "dt": dt,
+        "n": np.full(len(x), x.shape[1] - 1) if per_path else x.size - len(x),
+        "DD": np.einsum(subscripts, D, D, optimize=True),
+        "DF": np.einsum(subscripts, D, F, optimize=True),
+        "FF": np.einsum(subscripts, F, F, optimize=True),
+    }
+
+
+def _drift_matrix(params):
+    """
+    Matrix A of the drift of (z, b) and its derivatives with respect to DRIFT_PARAMETERS.
+    """
+    s1, x1, b0, z0, alpha = (params[name] for name in DRIFT_PARAMETERS)
+    A = np.array([[s1 * x1 + b0, -s1, 0.0, -1.0],
+                  [-z0, alpha, 1.0, 0.0]])
+    dA = np.zeros((len(DRIFT_PARAMETERS), 2, 4))
+    dA[0, 0, :2] = x1, -1.0   # s1
+    dA[1, 0, 0] = s1          # x1
+    dA[2, 0, 0] = 1.0         # b0
+    dA[3, 1, 0] = -1.0        # z0
+    dA[4, 1, 1] = 1.0         # alpha
+    return A, dA
+
+
+def euler_log_likelihood(params, stats, sigma_z=None, sigma_b=None, rho=0.0):
+    """
+    Euler pseudo-log-likelihood of the transitions of (z, b) and its gradient.
+
+    Parameters:
+        params: dict of model parameters (see hr_model.hr_parameters).
+        stats: dict of summed sufficient statistics (see sufficient_statistics).
+        sigma_z, sigma_b, rho: noise of (z, b) (see hr_sde.simulate_hr_ensemble); None: the
+            noise covariance is profiled out.
+
+    Returns:
+        log_likelihood: float.
+        gradient: ndarray of shape (len(DRIFT_PARAMETERS),), derivatives with respect to
+            DRIFT_PARAMETERS.
+        Sigma: ndarray of shape (2, 2), noise covariance (given or profiled).
+    """
+    dt, n = stats["dt"], stats["n"]
+    A, dA = _drift_matrix(params)
+    c = dt * params["eps"]
+
+    # --- sum of the residuals r r^T, r = dY - c A phi
+    cross = stats["DF"] @ A.T
+    M = stats["DD"] - c * (cross + cross.T) + c**2 * A @ stats["FF"] @ A.T
+
+    if sigma_z is None or sigma_b is None:
+        Sigma = M / (n * dt)
+    else:
+        L = params["eps"] * noise_cholesky(sigma_z, sigma_b, rho)
+        Sigma = L @ L.T
+    W = np.linalg.inv(Sigma)
+    sign, log_det = np.linalg.slogdet(2 * np.pi * dt * Sigma)
+    if sign <= 0:
+        return -np.inf, np.zeros(len(DRIFT_PARAMETERS)), Sigma
+
+    log_likelihood = -0.5 * np.trace(W @ M) / dt - 0.5 * n * log_det
+    dL_dA = W @ (c * stats["DF"] - c**2 * A @ stats["FF"]) / dt
+    gradient = np.einsum("ij,pij->p", dL_dA, dA)
+    return log_likelihood, gradient, Sigma
+
+
+def fit_euler_mle(t_vals, paths, names=ESTIMATED, params=None, sigma_z=None, sigma_b=None, rho=0.0,
+                  bounds=None, per_path=False):
+    """
+    Maximum Euler pseudo-likelihood estimate of drift parameters of (z, b) (L-BFGS-B).
+
+    Parameters:
+        t_vals, paths: observed paths (see sufficient_statistics).
+        names: estimated parameters, subset of DRIFT_PARAMETERS (not both x1 and b0).
+        params: dict of parameters, initial values of the estimated ones and values of the
+            others (None: hr_parameters("SW")).
+        sigma_z, sigma_b, rho: known noise of (z, b); None: profiled out (and estimated).
+        bounds: dict mapping estimated parameters to (low, high) (None: unbounded).
+        per_path: estimate the parameters of each trajectory separately.
+
+    Returns:
+        dict with the estimates (floats, or ndarrays of shape (R,) if per_path), "sigma_z",
+        "sigma_b", "rho" (given or estimated), "log_likelihood" and "success".
+    """
+    unknown = [name for name in names if name not in DRIFT_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Unknown drift parameters {unknown}, expected a subset of {DRIFT_PARAMETERS}.")
+    if "x1" in names and "b0" in names:
+        raise ValueError("x1 and b0 only enter the drift through s1 x1 + b0, estimate at most one of them.")
+    params = hr_parameters("SW") if params is None else dict(params)
+    indices = [DRIFT_PARAMETERS.index(name) for name in names]
+    box = [(bounds or {}).get(name, (None, None)) for name in names]
+    all_stats = sufficient_statistics(t_vals, paths, per_path)
+
+    def fit(stats):
+        def objective(theta):
+            p = dict(params, **dict(zip(names, theta)))
+            value, gradient, _ = euler_log_likelihood(p, stats, sigma_z, sigma_b, rho)
+            return -value / stats["n"], -gradient[indices] / stats["n"]   # per transition: O(1) scale
+
+        theta0 = np.array([params[name] for name in names], dtype=float)
+        result = minimize(objective, theta0, jac=True, method="L-BFGS-B", bounds=box)
+        estimate = dict(params, **dict(zip(names, result.x)))
+        value, _, Sigma = euler_log_likelihood(estimate, stats, sigma_z, sigma_b, rho)
+        std = np.sqrt(np.diag(Sigma)) / params["eps"]
+        fitted = {name: estimate[name] for name in names}
+        fitted.update(sigma_z=std[0], sigma_b=std[1], rho=Sigma[0, 1] / np.sqrt(Sigma[0, 0] * Sigma[1, 1]),
+                      log_likelihood=value, success=result.success)
+        return fitted
+
+    if not per_path:
+        return fit(all_stats)
+    fits = [fit({"dt": all_stats["dt"], **{key: all_stats[key][r] for key in ("n", "DD", "DF", "FF")}})
+            for r in range(len(all_stats["n"]))]
+    return {key: np.array([fitted[key] for fitted in fits]) for key in fits[0]}
@@ -0,0 +1,340 @@
+"""
+Fokker-Planck equation of the slow variables (z, b) by finite volumes
+
+The density of the averaged slow SDE of hr_averaged.py (or of any 2D SDE with additive noise),
+
+    d(z, b) = f(z, b) dt + eps L dW,    D = eps^2 L L^T / 2  (L: hr_sde.noise_cholesky),
+
+solves dp/dt = -div(f p) + div(D grad p). Instead of simulating an ensemble and smoothing its
+time slices (density.py), the equation is discretized on a regular grid of cells of a (z, b)
+window and integrated deterministically:
+
+    - the fluxes through the faces of the cells are exponentially fitted (Scharfetter-Gummel:
+      the drift and the diagonal diffusion D_zz, D_bb are combined exactly in 1D, upwind when
+      the cell Peclet number is large), the cross diffusion D_zb (rho != 0) is centered; the
+      boundary of the window is closed (zero flux), so the mass is conserved;
+    - the generator is a scipy.sparse matrix A, and the implicit steps
+          BDF2    (3/2 I - dt A) p_{n+1} = 2 p_n - p_{n-1} / 2    (first step: implicit Euler)
+          Euler   (I - dt A) p_{n+1} = p_n
+      are solved with sparse LU factorizations computed once (scipy.sparse.linalg.splu) and
+      reused at every step. Implicit Euler keeps the density nonnegative (without cross
+      diffusion); BDF2 is second order in time but may undershoot slightly near sharp fronts.
+
+The averaged model has several branches (stable equilibria of the low and high branches and
+limit cycle of the fast subsystem, with hysteresis): its density is a stack of K = 3 densities
+on the grid, one per attractor, each transported by its own averaged drift. After each step,
+the mass of the cells where its attractor does not exist is moved to the attractor the
+realizations of hr_averaged.simulate_averaged jump to (the cycle, or the other equilibrium;
+from the cycle, the equilibrium closest to the minimum of x on the nearest cycle).
+
+The frames are densities on the cell centers, and their marginals have the layout of the
+Monte Carlo estimates of density.py, (n_rec, n_z) and (n_rec, n_b), for comparison
+(validate_fokker_planck).
+
+Numerical diffusion: the fluxes reduce to upwind when |f| h > 2 D (h: cell size), and add a
+diffusion of order |f| h / 2; with the SW parameters (eps = 0.01) the grid must be fine (the
+default 241 x 161 cells over the window of the tables) for the peaks to be resolved.
+
+Usage:
+    solver = averaged_fokker_planck(params, sigma_z=0.75, sigma_b=0.75, dt=0.5, tables=tables)
+    p0 = solver.initial_density(center=(-1.12, 0.33), std=0.02, attractor=LOW)
+    t_vals, frames = solver.solve(p0, T=2000, record_every=20)   # (n_rec, 3, n_z, n_b)
+    z_density, b_density = solver.marginals(frames)              # like density.binned_kde
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.ndimage import distance_transform_edt
+from scipy.sparse.linalg import splu
+
+from .density import binned_kde
+from .hr_averaged import CYCLE, HIGH, LOW, _interpolation, averaged_tables, simulate_averaged
+from .hr_sde import noise_cholesky
+
+SCHEMES = ("bdf2", "euler")
+
+
+def _bernoulli(x):
+    """
+    Bernoulli function x / (exp(x) - 1), 1 at x = 0.
+    """
+    x = np.asarray(x, dtype=float)
+    small = np.abs(x) < 1e-8
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        value = x / np.expm1(np.where(small, 1.0, x))
+    return np.where(small, 1.0 - x / 2, value)
+
+
+def _face_coefficients(f, D, h):
+    """
+    Coefficients (a, c) of the flux a p_left - c p_right through faces with drift f (exponential fitting).
+    """
+    if D <= 0:
+        return np.maximum(f, 0.0), np.maximum(-f, 0.0)
+    peclet = f * h / D
+    return D / h * _bernoulli(-peclet), D / h * _bernoulli(peclet)
+
+
+def fokker_planck_generator(fz, fb, D, dz, db):
+    """
+    Finite-volume generator of the Fokker-Planck equation of one 2D drift field, zero flux on
+    the boundary.
+
+    Parameters:
+        fz, fb: ndarrays of shape (n_z, n_b), drift at the cell centers.
+        D: ndarray of shape (2, 2), diffusion matrix (half the noise covariance).
+        dz, db: cell sizes.
+
+    Returns:
+        scipy.sparse.csr_matrix A of shape (n_z n_b, n_z n_b), dp/dt = A p, p flattened in C
+        order (index i n_b + j), with zero column sums (mass conservation).
+    """
+    n_z, n_b = fz.shape
+    index = np.arange(n_z * n_b).reshape(n_z, n_b)
+    rows, cols, values = [], [], []
+
+    def add_flux(left, right, terms, h):
+        # --- flux from `left` to `right` = sum of coefficient * p[cell], through faces of size h
+        for cell, coefficient in terms:
+            rows.extend([left.ravel(), right.ravel()])
+            cols.extend([cell.ravel(), cell.ravel()])
+            values.extend([-coefficient.ravel() / h, coefficient.ravel() / h])
+
+    # --- faces normal to z (between i and i+1), and normal to b (between j and j+1)
+    a, c = _face_coefficients(0.5 * (fz[1:] + fz[:-1]), D[0, 0], dz)
+    terms = [(index[:-1], a), (index[1:], -c)]
+    if D[0, 1] != 0:
+        up, down = np.minimum(np.arange(n_b) + 1, n_b - 1), np.maximum(np.arange(n_b) - 1, 0)
+        scale = -D[0, 1] / ((up - down) * db)[None, :] * np.full((n_z - 1, n_b), 0.5)
+        terms += [(index[:-1][:, up], scale), (index[1:][:, up], scale),
+                  (index[:-1][:, down], -scale), (index[1:][:, down], -scale)]
+    add_flux(index[:-1], index[1:], terms, dz)
+
+    a, c = _face_coefficients(0.5 * (fb[:, 1:] + fb[:, :-1]), D[1, 1], db)
+    terms = [(index[:, :-1], a), (index[:, 1:], -c)]
+    if D[0, 1] != 0:
+        up, down = np.minimum(np.arange(n_z) + 1, n_z - 1), np.maximum(np.arange(n_z) - 1, 0)
+        scale = -D[0, 1] / ((up - down) * dz)[:, None] * np.full((n_z, n_b - 1), 0.5)
+        terms += [(index[up, :-1], scale), (index[up, 1:], scale),
+                  (index[down, :-1], -scale), (index[down, 1:], -scale)]
+    add_flux(index[:, :-1], index[:, 1:], terms, db)
+
+    N = n_z * n_b
+    return sp.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(N, N))
+
+
+class FokkerPlanckSolver:
+    """
+    Implicit finite-volume solver of the Fokker-Planck equation of K stacked 2D drift fields
+    (branches) on a common grid, with an optional instantaneous transfer of mass between them.
+
+    Parameters:
+        drifts: ndarray of shape (K, 2, n_z, n_b), drift (f_z, f_b) of each branch at the cell
+            centers, or of shape (2, n_z, n_b) for a single branch.
+        Sigma: ndarray of shape (2, 2), noise covariance (diffusion D = Sigma / 2).
+        bounds: ((z_min, z_max), (b_min, b_max)), window (edges of the grid).
+        dt: time step.
+        transfer: scipy.sparse matrix of shape (K n, K n) applied after each step (None: none).
+        scheme: "bdf2" or "euler".
+
+    Attributes:
+        z, b: ndarrays of shape (n_z,) and (n_b,), cell centers.
+        dz, db: cell sizes.
+    """
+
+    def __init__(self, drifts, Sigma, bounds, dt, transfer=None, scheme="bdf2"):
+        if scheme not in SCHEMES:
+            raise ValueError(f"scheme must be one of {SCHEMES}, but got '{scheme}'.")
+        drifts = np.asarray(drifts, dtype=float)
+        drifts = drifts[None] if drifts.ndim == 3 else drifts
+        if not np.all(np.isfinite(drifts)):
+            raise ValueError("The drifts must be finite on the whole grid.")
+        self.K, _, n_z, n_b = drifts.shape
+        (z_min, z_max), (b_min, b_max) = bounds
+        self.dz, self.db = (z_max - z_min) / n_z, (b_max - b_min) / n_b
+        self.z = z_min + self.dz * (np.arange(n_z) + 0.5)
+        self.b = b_min + self.db * (np.arange(n_b) + 0.5)
+        self.shape, self.dt, self.scheme = (self.K, n_z, n_b), dt, scheme
+
+        D = 0.5 * np.asarray(Sigma, dtype=float)
+        self.A = sp.block_diag([fokker_planck_generator(f[0], f[1], D, self.dz, self.db) for f in drifts],
+                               format="csc")
+        self.transfer = transfer
+        identity = sp.identity(self.A.shape[0], format="csc")
+        # --- factorized once, reused at every step
+        self._euler = splu((identity - dt * self.A).tocsc())
+        self._bdf2 = splu((1.5 * identity - dt * self.A).tocsc()) if scheme == "bdf2" else None
+
+    def initial_density(self, center, std=None, attractor=0):
+        """
+        Gaussian initial density (or all the mass in the cell of `center` if std is None) on one branch.
+
+        Returns:
+            ndarray of shape (K, n_z, n_b), integrating to 1.
+        """
+        p = np.zeros(self.shape)
+        if std is None:
+            i = np.clip(int(np.floor((center[0] - self.z[0]) / self.dz + 0.5)), 0, self.shape[1] - 1)
+            j = np.clip(int(np.floor((center[1] - self.b[0]) / self.db + 0.5)), 0, self.shape[2] - 1)
+            p[attractor, i, j] = 1.0
+        else:
+            std = np.broadcast_to(np.asarray(std, dtype=float), (2,))
+            p[attractor] = np.exp(-0.5 * ((self.z[:, None] - center[0])**2 / std[0]**2
+                                          + (self.b[None, :] - center[1])**2 / std[1]**2))
+        return p / (p.sum() * self.dz * self.db)
+
+    def _transfer(self, p):
+        return p if self.transfer is None else self.transfer @ p
+
+    def solve(self, p0, T, record_every=1):
+        """
+        Integrates the density from p0 over [0, T] with round(T / dt) implicit steps.
+
+        Parameters:
+            p0: ndarray of shape (K, n_z, n_b) (or (n_z, n_b) for one branch), initial density.
+            T: final time.
+            record_every: int, keep one step out of `record_every`.
+
+        Returns:
+            t_vals: ndarray of shape (n_rec,).
+            frames: ndarray of shape (n_rec, K, n_z, n_b), densities (total integral 1).
+        """
+        N = int(round(T / self.dt))
+        p = self._transfer(np.asarray(p0, dtype=float).reshape(-1))
+        t_vals = self.dt * np.arange(N + 1)[::record_every]
+        frames = np.empty((len(t_vals),) + self.shape)
+        frames[0] = p.reshape(self.shape)
+        previous = None
+        for k in range(1, N + 1):
+            if previous is None or self.scheme == "euler":
+                p_new = self._euler.solve(p)
+            else:
+                p_new = self._bdf2.solve(2 * p - 0.5 * previous)
+            previous, p = p, self._transfer(p_new)
+            if k % record_every == 0:
+                frames[k // record_every] = p.reshape(self.shape)
+        return t_vals, frames
+
+    def marginals(self, frames):
+        """
+        Marginal densities of z and b of frames of shape (n_rec, K, n_z, n_b), summed over the branches.
+
+        Returns:
+            ndarrays of shape (n_rec, n_z) and (n_rec, n_b).
+        """
+        total = frames.sum(axis=1)
+        return total.sum(axis=2) * self.db, total.sum(axis=1) * self.dz
+
+
+# ___ averaged HR model ___________________________________________________________________________
+
+def _nearest_fill(table):
+    """
+    Replaces the NaN of a 2D table by the value of the nearest finite entry.
+    """
+    missing = np.isnan(table)
+    if not missing.any() or missing.all():
+        return table
+    nearest = distance_transform_edt(missing, return_distances=False, return_indices=True)
+    return table[tuple(nearest)]
+
+
+def averaged_fokker_planck(params, sigma_z=0.75, sigma_b=0.75, rho=0.0, dt=0.5, tables=None, bounds=None,
+                           shape=(241, 161), scheme="bdf2"):
+    """
+    Fokker-Planck solver of the averaged slow SDE of hr_averaged.py (three branches, with the
+    jumps of simulate_averaged as transfers).
+
+    Parameters:
+        params: dict of model parameters (see hr_model.hr_parameters).
+        sigma_z, sigma_b, rho: noise of (z, b) (see hr_sde.simulate_hr_ensemble).
+        dt: time step.
+        tables: tables of hr_averaged.averaged_tables (None: computed with the default settings).
+        bounds: window of the grid (None: that of the tables).
+        shape: (n_z, n_b), number of cells.
+        scheme: "bdf2" or "euler".
+
+    Returns:
+        FokkerPlanckSolver with K = 3 branches, in the order LOW, HIGH, CYCLE.
+    """
+    tables = averaged_tables(params) if tables is None else tables
+    bounds = ((tables["z"][0], tables["z"][-1]), (tables["b"][0], tables["b"][-1])) if bounds is None else bounds
+    (z_min, z_max), (b_min, b_max) = bounds
+    z = z_min + (z_max - z_min) / shape[0] * (np.arange(shape[0]) + 0.5)
+    b = b_min + (b_max - b_min) / shape[1] * (np.arange(shape[1]) + 0.5)
+    Z, B = np.meshgrid(z, b, indexing="ij")
+    interpolate = _interpolation(tables["z"], tables["b"], Z, B)
+    x = np.array([interpolate(tables[name]) for name in ("x_low", "x_high", "x_cycle")])   # (3, n_z, n_b)
+    exists = np.isfinite(x)
+
+    # --- drifts, with the averages extended by the nearest value where the attractor does not exist
+    eps = params["eps"]
+    drifts = np.empty((3, 2) + tuple(shape))
+    for k in (LOW, HIGH, CYCLE):
+        x_k = _nearest_fill(x[k]) if exists[k].any() else np.zeros(shape)
+        drifts[k, 0] = eps * (-params["s1"] * (x_k - params["x1"]) - (B - params["b0"]))
+        drifts[k, 1] = eps * (Z - params["z0"] + params["alpha"] * x_k)
+
+    # --- jumps of simulate_averaged, from the cells where an attractor does not exist
+    x_min = _nearest_fill(interpolate(tables["x_cycle_min"]))
+    closer = np.abs(x[LOW] - x_min) <= np.abs(x[HIGH] - x_min)
+    equilibrium = np.where(~exists[HIGH] | (exists[LOW] & closer), LOW, HIGH)
+    targets = np.array([np.where(exists[CYCLE], CYCLE, HIGH), np.where(exists[CYCLE], CYCLE, LOW), equilibrium])
+    n = shape[0] * shape[1]
+    cells = np.arange(n)
+    source = np.concatenate([k * n + cells for k in (LOW, HIGH, CYCLE)])
+    target = np.concatenate([targets[k].ravel() * n + cells for k in (LOW, HIGH, CYCLE)])
+    moved = (~exists.reshape(3, n)).ravel() & exists.reshape(3, n)[targets.reshape(3, n), cells].ravel()
+    destination = np.where(moved, target, source)
+    transfer = sp.csr_matrix((np.ones(3 * n), (destination, source)), shape=(3 * n, 3 * n))
+
+    Sigma = (eps * noise_cholesky(sigma_z, sigma_b, rho)) @ (eps * noise_cholesky(sigma_z, sigma_b, rho)).T
+    return FokkerPlanckSolver(drifts, Sigma, bounds, dt, transfer=transfer, scheme=scheme)
+
+
+def validate_fokker_planck(params, center, T, R=2000, sigma_z=0.75, sigma_b=0.75, rho=0.0, attractor=LOW,
+                           dt=0.5, N_averaged=None, tables=None, shape=(241, 161), record_every=20, seed=None):
+    """
+    Compares the marginal densities of the Fokker-Planck solution with the Monte Carlo estimates
+    of density.binned_kde on realizations of hr_averaged.simulate_averaged.
+
+    Parameters:
+        params: dict of model parameters.
+        center: (z, b), initial point (all the mass in its cell, and all the realizations on it).
+        T: final time.
+        R: number of Monte Carlo realizations.
+        sigma_z, sigma_b, rho: noise of (z, b).
+        attractor: initial attractor (LOW, HIGH or CYCLE).
+        dt: time step of the Fokker-Planck solver.
+        N_averaged: number of time steps of the Monte Carlo simulation (None: T / dt).
+        tables: tables of hr_averaged.averaged_tables (None: computed).
+        shape: number of cells of the solver.
+        record_every: number of solver steps between two frames.
+        seed: seed of the random generator.
+
+    Returns:
+        dict with "t" (n_rec,), "z" and "b" (cell centers), "fokker_planck" and "monte_carlo"
+        (dicts of marginal densities "z" (n_rec, n_z) and "b" (n_rec, n_b)), and "error"
+        (dict of ndarrays of shape (n_rec,), L1 distances between the marginals).
+    """
+    tables = averaged_tables(params) if tables is None else tables
+    solver = averaged_fokker_planck(params, sigma_z, sigma_b, rho, dt, tables, shape=shape)
+    t_vals, frames = solver.solve(solver.initial_density(center, attractor=attractor), T, record_every)
+    fp_z, fp_b = solver.marginals(frames)
+
+    N_fp = int(round(T / dt))
+    N_averaged = N_fp if N_averaged is None else N_averaged
+    if N_averaged % N_fp:
+        raise ValueError(f"N_averaged must be a multiple of the {N_fp} steps of the solver.")
+    _, paths = simulate_averaged(params, np.asarray(center, dtype=float), T, N_averaged, R, sigma_z, sigma_b, rho,
+                                 tables=tables, attractor=attractor,
+                                 record_every=record_every * N_averaged // N_fp, seed=seed)
+    mc_z, mc_b = binned_kde(paths["z"], solver.z), binned_kde(paths["b"], solver.b)
+    return {
+        "t": t_vals,
+        "z": solver.z,
+        "b": solver.b,
+        "fokker_planck": {"z": fp_z, "b": fp_b},
+        "monte_carlo": {"z": mc_z, "b": mc_b},
+        "error": {"z": np.abs(fp_z - mc_z).sum(axis=1) * solver.dz, "b": np.abs(fp_b - mc_b).sum(axis=1) * solver.db},
+    }
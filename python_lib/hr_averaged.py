@@ -0,0 +1,375 @@
+"""
+Slow-fast averaged reduction of the extended HR SDE
+
+With eps = 0.01 the slow variables (z, b) move by O(eps) during a spike, and their drift
+
+    dz = eps (-s1 (x - x1) - (b - b0)) dt + noise,    db = eps (z - z0 + alpha x) dt + noise
+
+is linear in the fast variable x. Averaging over the fast subsystem at frozen (z, b) (see
+hr_bifurcation.py) therefore only needs the mean of x on its attractor, <x>(z, b), and the
+reduced model is a 2D SDE integrated with steps of order 1 instead of 0.01.
+
+The fast subsystem may be bistable (square-wave bursting): a stable equilibrium (rest)
+coexists with a limit cycle (spiking). Its attractors are tabulated on a (z, b) grid, NaN
+where they do not exist:
+
+    x_low, x_high   stable equilibria on the low and high branches of G = 0 (the real roots
+                    of the cubic G of hr_bifurcation.py, the middle one is a saddle);
+    x_cycle         time average of x over whole periods of the limit cycle reached from the
+                    unstable equilibrium (fourth-order Runge-Kutta, all the grid points at
+                    once), with its minimum and its period.
+
+The reduced model carries the state (z, b, attractor) and follows the current attractor,
+bilinearly interpolated in the tables, until it disappears (fold of the rest state: burst
+onset, homoclinic end of the cycle: burst end), as in the hysteresis loop of a burst. Near
+these curves the switching is only resolved to a cell of the grid, and the slow passages near
+the saddle (the y-equation is only moderately fast, its rate b/c is about 0.15) are not
+resolved: validate_averaged measures the resulting bias against the full model (for the SW
+regime, the burst period is about a third too short with eps = 0.01 and within 3% with
+eps = 0.003, the tables do not depend on eps).
+
+The tables only depend on (a, c, d, I), the grid and the averaging settings, and are cached
+on disk (averaged_<hash>.npz in `cache_dir`), as bifurcation diagrams.
+
+Usage:
+    tables = averaged_tables(params, cache_dir="cache")
+    t_vals, paths = simulate_averaged(params, hr_initial_condition("SW"), T=200000, N=200000,
+                                      R=1000, tables=tables, record_every=10, seed=1)
+    report = validate_averaged(params, hr_initial_condition("SW"), T=4000, R=200, seed=1)
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from .hr_bifurcation import _fast_parameters, equilibrium_stability
+from .hr_sde import noise_cholesky, simulate_hr_ensemble
+from .spikes import simulation_statistics
+
+DEFAULT_BOUNDS = ((-3.0, 0.0), (0.05, 2.0))   # (z, b) window of the tables (b > 0)
+
+LOW, HIGH, CYCLE = 0, 1, 2   # attractors of the fast subsystem: stable equilibria of the low and
+                             # high branches of G = 0, limit cycle
+
+
+# ___ averaged fast subsystem _____________________________________________________________________
+
+def _branches(z, b, params):
+    """
+    Returns the equilibria x of the fast subsystem on the low and high branches of G = 0 at
+    each (z, b) (NaN: none), where G(x) = (b/3) x^3 + x^2 + (d - b) x + a - b (z + I) (b > 0).
+
+    G has a local maximum at x_- and a local minimum at x_+ > x_-: the low (resp. high) root
+    is below x_- (resp. above x_+), the middle one in between is a saddle.
+    """
+    a, c, d, I = _fast_parameters(params)
+    x_low, x_high = np.full(len(z), np.nan), np.full(len(z), np.nan)
+    for i, (zi, bi) in enumerate(zip(z, b)):
+        roots = np.roots([bi / 3, 1.0, d - bi, a - bi * (zi + I)])
+        roots = np.sort(roots[np.abs(roots.imag) < 1e-9].real)
+        critical = np.roots([bi, 2.0, d - bi])
+        inflection = -1 / bi
+        if len(roots) == 3:
+            x_low[i], x_high[i] = roots[0], roots[2]
+        elif len(roots) == 1:
+            split = critical.real.min() if np.all(np.abs(critical.imag) < 1e-12) else inflection
+            (x_low if roots[0] < split else x_high)[i] = roots[0]
+    return x_low, x_high
+
+
+def _fast_flow(x, y, z, b, level, params, dt, n_steps, window):
+    """
+    Fourth-order Runge-Kutta steps of the fast subsystems (one per entry, frozen z, b), with
+    the time average of x over the whole periods (upward crossings of `level`) of the last
+    `window` steps.
+
+    Returns:
+        x_mean (NaN if less than one period), period, x_min over the window, and the ratio of
+        the amplitudes of x over the second and the first half of the window (about 1 on a
+        limit cycle, smaller for a damped oscillation).
+    """
+    a, c, d, I = _fast_parameters(params)
+
+    def rhs(x, y):
+        return c * (x - x**3 / 3 - y + z + I), (x**2 + d * x - b * y + a) / c
+
+    def step(x, y):
+        k1x, k1y = rhs(x, y)
+        k2x, k2y = rhs(x + dt / 2 * k1x, y + dt / 2 * k1y)
+        k3x, k3y = rhs(x + dt / 2 * k2x, y + dt / 2 * k2y)
+        k4x, k4y = rhs(x + dt * k3x, y + dt * k3y)
+        return x + dt / 6 * (k1x + 2 * k2x + 2 * k3x + k4x), y + dt / 6 * (k1y + 2 * k2y + 2 * k3y + k4y)
+
+    with np.errstate(over="ignore", invalid="ignore"):   # unbounded orbits end as NaN
+        for _ in range(n_steps - window):
+            x, y = step(x, y)
+
+        # --- window: running integral of x and its values at the first and last crossings
+        x_min, x_max, integral = x.copy(), x.copy(), np.zeros_like(x)
+        halves = []
+        crossings = np.zeros(len(x), dtype=int)
+        first_t, first_integral = np.full(len(x), np.nan), np.full(len(x), np.nan)
+        last_t, last_integral = np.full(len(x), np.nan), np.full(len(x), np.nan)
+        for k in range(window):
+            x_new, y = step(x, y)
+            integral += dt / 2 * (x + x_new)
+            up = (x < level) & (x_new >= level)
+            if np.any(up):
+                first = up & (crossings == 0)
+                first_t[first], first_integral[first] = k, integral[first]
+                last_t[up], last_integral[up] = k, integral[up]
+                crossings += up
+            if k == window // 2:
+                halves.append(x_max - x_min)
+                x_min, x_max = x_new.copy(), x_new.copy()
+            np.fmin(x_min, x_new, out=x_min)
+            np.fmax(x_max, x_new, out=x_max)
+            x = x_new
+        ratio = (x_max - x_min) / halves[0]
+        span = np.where(crossings >= 2, (last_t - first_t) * dt, np.nan)
+        x_mean = (last_integral - first_integral) / span
+        period = span / np.maximum(crossings - 1, 1)
+    return x_mean, period, x_min, ratio
+
+
+def averaged_tables(params=None, bounds=DEFAULT_BOUNDS, shape=(241, 161), dt=0.05, t_transient=100.0,
+                    t_average=200.0, cache_dir=None):
+    """
+    Tabulates the attractors of the fast subsystem and the average of x on them.
+
+    Parameters:
+        params: dict of parameters (None: hr_model.HR_DEFAULTS), only (a, c, d, I) matter.
+        bounds: ((z_min, z_max), (b_min, b_max)), window of the grid (b > 0).
+        shape: (n_z, n_b), number of grid points along z and b.
+        dt: time step of the fast integration (RK4).
+        t_transient, t_average: convergence time and averaging window of the fast integration.
+        cache_dir: directory of the cache (None: no cache), keyed by a hash of the settings.
+
+    Returns:
+        dict with "z" (n_z,), "b" (n_b,), and tables of shape (n_z, n_b), NaN where the
+        attractor does not exist:
+            "x_low", "x_high": stable equilibria of the low and high branches;
+            "x_cycle", "x_cycle_min", "period": average and minimum of x and period of the
+                limit cycle around the unstable equilibrium.
+    """
+    settings = (_fast_parameters(params), tuple(map(tuple, bounds)), tuple(shape), dt, t_transient, t_average)
+    path = None
+    if cache_dir is not None:
+        key = hashlib.sha1(repr(settings).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"averaged_{key}.npz")
+        if os.path.exists(path):
+            with np.load(path) as saved:
+                return {name: saved[name] for name in saved.files}
+
+    z_grid, b_grid = np.linspace(*bounds[0], shape[0]), np.linspace(*bounds[1], shape[1])
+    if b_grid[0] <= 0:
+        raise ValueError(f"The grid of b must be positive, but got b_min = {b_grid[0]}.")
+    z, b = (values.ravel() for values in np.meshgrid(z_grid, b_grid, indexing="ij"))
+    x_low, x_high = _branches(z, b, params)
+    tables = {"z": z_grid, "b": b_grid}
+    for name, x_eq in (("x_low", x_low), ("x_high", x_high)):
+        trace, det = equilibrium_stability(x_eq, b, params)
+        tables[name] = np.where((trace < 0) & (det > 0), x_eq, np.nan)
+
+    # --- limit cycle: from a perturbation of the unstable focus or node (high branch first)
+    a, c, d, I = _fast_parameters(params)
+    source = np.full(len(z), np.nan)
+    for x_eq in (x_low, x_high):
+        trace, det = equilibrium_stability(x_eq, b, params)
+        source = np.where((trace > 0) & (det > 0), x_eq, source)
+    inside = np.flatnonzero(np.isfinite(source))
+    x_cycle, period, x_min = np.full(len(z), np.nan), np.full(len(z), np.nan), np.full(len(z), np.nan)
+    if len(inside):
+        x0 = source[inside]
+        y0 = x0 - x0**3 / 3 + z[inside] + I
+        n_steps, window = int(round((t_transient + t_average) / dt)), int(round(t_average / dt))
+        mean, cycle_period, low, ratio = _fast_flow(x0 + 0.01, y0, z[inside], b[inside], x0, params, dt, n_steps,
+                                                    window)
+        periodic = np.isfinite(mean) & (ratio > 0.9) & (cycle_period > 10 * dt)
+        x_cycle[inside] = np.where(periodic, mean, np.nan)
+        period[inside] = np.where(periodic, cycle_period, np.nan)
+        x_min[inside] = np.where(periodic, low, np.nan)
+    tables.update(x_low=tables["x_low"].reshape(shape), x_high=tables["x_high"].reshape(shape),
+                  x_cycle=x_cycle.reshape(shape), x_cycle_min=x_min.reshape(shape), period=period.reshape(shape))
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as file:
+            np.savez(file, **tables)
+        os.replace(temporary, path)
+    return tables
+
+
+def _interpolation(z_grid, b_grid, z, b):
+    """
+    Returns a function interpolating tables bilinearly at the points (z, b), clamped to the
+    grid (NaN if one of the four corners is NaN).
+    """
+    def cell(grid, values):
+        position = np.clip((values - grid[0]) / (grid[1] - grid[0]), 0, len(grid) - 1)
+        index = np.minimum(position.astype(int), len(grid) - 2)
+        return index, position - index
+
+    i, u = cell(z_grid, z)
+    j, v = cell(b_grid, b)
+
+    def interpolate(table):
+        return ((1 - u) * (1 - v) * table[i, j] + u * (1 - v) * table[i + 1, j]
+                + (1 - u) * v * table[i, j + 1] + u * v * table[i + 1, j + 1])
+    return interpolate
+
+
+# ___ reduced SDE _________________________________________________________________________________
+
+def simulate_averaged(params, X0, T, N, R, sigma_z=0.75, sigma_b=0.75, rho=0.0, tables=None, attractor=LOW,
+                      record_every=1, seed=None, ini_std=0.0):
+    """
+    Simulates R realizations of the averaged slow SDE of (z, b) (Euler-Maruyama).
+
+    The current attractor is followed until it disappears; the realization then jumps from an
+    equilibrium to the cycle (burst onset, or to the other equilibrium if there is no cycle),
+    and from the cycle to the stable equilibrium closest to its minimum (burst end).
+
+    Parameters:
+        params: dict of model parameters (see hr_model.hr_parameters).
+        X0: initial condition, ndarray of shape (4,) or (R, 4) (only z, b are used) or of
+            shape (2,) or (R, 2), (z, b).
+        T: final time.
+        N: number of time steps (T/N of order 1, instead of 0.01 for the full model).
+        R: number of realizations.
+        sigma_z, sigma_b, rho: noise of (z, b) (see hr_sde.simulate_hr_ensemble).
+        tables: tables of averaged_tables (None: computed with the default settings); the
+            grid must cover the trajectories, (z, b) are clamped to it.
+        attractor: LOW, HIGH or CYCLE, or int ndarray of shape (R,), initial attractor (if it
+            does not exist, the first step jumps as above).
+        record_every: int, keep one time step out of `record_every`.
+        seed: seed of the random generator.
+        ini_std: standard deviation of a Gaussian perturbation of the initial (z, b).
+
+    Returns:
+        t_vals: ndarray of shape (n_rec,).
+        paths: dict with "z", "b", "x" (average of x on the current attractor) and
+            "attractor" (LOW, HIGH or CYCLE), ndarrays of shape (R, n_rec).
+    """
+    tables = averaged_tables(params) if tables is None else tables
+    rng = np.random.default_rng(seed)
+
+    X0 = np.asarray(X0, dtype=float)
+    Y = np.array(np.broadcast_to(X0[..., 2:] if X0.shape[-1] == 4 else X0, (R, 2)))
+    if ini_std > 0:
+        Y += ini_std * rng.standard_normal(Y.shape)
+    label = np.array(np.broadcast_to(attractor, (R,)), dtype=int)
+    x_mean, x_last_min = np.full(R, np.nan), np.full(R, np.nan)
+
+    eps, h = params["eps"], T / N
+    L = eps * noise_cholesky(sigma_z, sigma_b, rho)
+    t_vals = np.linspace(0, T, N + 1)[::record_every]
+    paths = {name: np.empty((R, len(t_vals)), dtype=int if name == "attractor" else float)
+             for name in ("z", "b", "x", "attractor")}
+
+    for k in range(N + 1):
+        z, b = Y[:, 0], Y[:, 1]
+        interpolate = _interpolation(tables["z"], tables["b"], z, b)
+        x_low, x_high = interpolate(tables["x_low"]), interpolate(tables["x_high"])
+        x_cycle, x_cycle_min = interpolate(tables["x_cycle"]), interpolate(tables["x_cycle_min"])
+        exists = np.column_stack([np.isfinite(x_low), np.isfinite(x_high), np.isfinite(x_cycle)])
+
+        # --- jumps when the current attractor has disappeared
+        lost = ~exists[np.arange(R), label]
+        closer = np.isnan(x_last_min) | (np.abs(x_low - x_last_min) <= np.abs(x_high - x_last_min))
+        equilibrium = np.where(~exists[:, HIGH] | (exists[:, LOW] & closer), LOW, HIGH)
+        from_equilibrium = np.where(exists[:, CYCLE], CYCLE, np.where(label == LOW, HIGH, LOW))
+        target = np.where(label == CYCLE, equilibrium, from_equilibrium)
+        label = np.where(lost & exists[np.arange(R), target], target, label)
+
+        x_now = np.choose(label, [x_low, x_high, x_cycle])
+        x_mean = np.where(np.isnan(x_now), x_mean, x_now)   # no attractor: keep the last average
+        x_last_min = np.where(np.isfinite(x_cycle_min) & (label == CYCLE), x_cycle_min, x_last_min)
+
+        if k % record_every == 0:
+            j = k // record_every
+            paths["z"][:, j], paths["b"][:, j], paths["x"][:, j], paths["attractor"][:, j] = z, b, x_mean, label
+        if k == N:
+            break
+
+        drift = eps * np.column_stack([-params["s1"] * (x_mean - params["x1"]) - (b - params["b0"]),
+                                       z - params["z0"] + params["alpha"] * x_mean])
+        Y = Y + h * drift + np.sqrt(h) * rng.standard_normal((R, 2)) @ L.T
+
+    return t_vals, paths
+
+
+def burst_periods(t_vals, attractor):
+    """
+    Mean time between two successive burst onsets (jumps to the cycle) of each realization.
+
+    Parameters:
+        t_vals: ndarray of shape (n_rec,).
+        attractor: int ndarray of shape (R, n_rec) (see simulate_averaged).
+
+    Returns:
+        ndarray of shape (R,), NaN for the realizations with less than two onsets.
+    """
+    onset = (attractor[:, 1:] == CYCLE) & (attractor[:, :-1] != CYCLE)
+    periods = np.full(len(attractor), np.nan)
+    for r, row in enumerate(onset):
+        times = t_vals[1:][row]
+        if len(times) > 1:
+            periods[r] = np.mean(np.diff(times))
+    return periods
+
+
+def validate_averaged(params, X0, T, R, N_full=None, N_averaged=None, sigma_z=0.75, sigma_b=0.75, rho=0.0,
+                      tables=None, n_times=200, record_every_full=10, seed=None, n_jobs=1):
+    """
+    Compares the averaged and the full model: ensemble statistics of (z, b) and burst periods.
+
+    Parameters:
+        params, X0, T, R, sigma_z, sigma_b, rho, tables: see simulate_averaged.
+        N_full: number of time steps of the full model (None: T / 0.01).
+        N_averaged: number of time steps of the averaged model (None: T / 1).
+        n_times: number of comparison times of the statistics of (z, b).
+        record_every_full: recording stride of x in the full model, for the burst detection
+            (spikes.simulation_statistics).
+        seed: seed of the random generators (the two models use independent noises).
+        n_jobs: number of worker processes of the full simulation.
+
+    Returns:
+        dict with
+            "t": ndarray of shape (n_times+1,), comparison times;
+            "full", "averaged": dicts with the ensemble means and standard deviations of z and
+                b ("z_mean", "z_std", "b_mean", "b_std", ndarrays of shape (n_times+1,)) and
+                the mean burst period over the realizations ("burst_period");
+            "error": dict with, for z and b, the largest difference of the means in units of
+                the standard deviation of the full model (over the times and the realizations),
+                and the relative difference of the burst periods ("burst_period").
+    """
+    N_full = int(round(T / 0.01)) if N_full is None else N_full
+    N_averaged = int(round(T)) if N_averaged is None else N_averaged
+    if N_full % (record_every_full * n_times) or N_averaged % n_times:
+        raise ValueError(f"n_times = {n_times} must divide N_full / record_every_full = {N_full / record_every_full} "
+                         f"and N_averaged = {N_averaged}.")
+
+    t_full, full = simulate_hr_ensemble(params, X0, T, N_full, R, sigma_z, sigma_b, rho, observables=("x", "z", "b"),
+                                        record_every=record_every_full, n_jobs=n_jobs, seed=seed)
+    t_averaged, averaged = simulate_averaged(params, X0, T, N_averaged, R, sigma_z, sigma_b, rho, tables=tables,
+                                             seed=seed)
+
+    strides = {"full": N_full // (record_every_full * n_times), "averaged": N_averaged // n_times}
+    report = {"t": t_averaged[::strides["averaged"]], "full": {}, "averaged": {}, "error": {}}
+    for name in ("z", "b"):
+        for model, paths in (("full", full), ("averaged", averaged)):
+            values = paths[name][:, ::strides[model]]
+            report[model][f"{name}_mean"] = values.mean(axis=0)
+            report[model][f"{name}_std"] = values.std(axis=0)
+            if model == "full":
+                scale = values.std()
+        difference = np.abs(report["full"][f"{name}_mean"] - report["averaged"][f"{name}_mean"])
+        report["error"][name] = difference.max() / scale if scale > 0 else difference.max()
+
+    report["full"]["burst_period"] = np.nanmean(simulation_statistics(t_full, full)["burst_period"])
+    report["averaged"]["burst_period"] = np.nanmean(burst_periods(t_averaged, averaged["attractor"]))
+    report["error"]["burst_period"] = abs(report["averaged"]["burst_period"] / report["full"]["burst_period"] - 1)
+    return report
@@ -0,0 +1,356 @@
+"""
+Batched deterministic integration of the extended Hindmarsh-Rose model
+
+A batch of B HR systems, with one initial condition and one parameter set per member, is
+advanced at once with the embedded Runge-Kutta scheme of Dormand & Prince (order 5(4), the
+DOPRI5 / RK45 tableau of `solve_ivp`). Each member has its own step size, controlled by its
+own local error estimate, so that a spiking member does not slow down the quiet ones.
+
+Events: the upward crossings of a threshold by one component (the spikes of x, by default)
+are detected after each accepted step, their times are interpolated linearly, and a member
+is stopped as soon as it has produced `max_crossings` crossings. Finished members are removed
+from the working arrays, so the cost of a step decreases as the batch empties.
+
+Backends:
+    "numpy"   all active members are advanced together, one vectorized step at a time; the
+              batch may be split in chunks distributed over several processes (n_jobs).
+    "numba"   each member is integrated by a compiled scalar loop, members in parallel
+              threads (numba.prange); needs the optional package numba.
+
+Usage:
+    params = hr_parameters("SW", s1=np.linspace(0.01, 0.1, 1000))
+    result = integrate_hr_batch(params, hr_initial_condition("SW"), T=2000, max_crossings=50)
+    result["crossings"].shape   # (1000, 50), spike times (NaN-padded)
+
+Reference:
+    Dormand, J. R., & Prince, P. J. A family of embedded Runge-Kutta formulae.
+    J. Comput. Appl. Math. 6(1): 19-26, 1980.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .hr_model import COMPONENTS, PARAMETERS, hr_drift
+
+try:
+    import numba
+except ImportError:   # optional, only needed by backend="numba"
+    numba = None
+
+BACKENDS = ("numpy", "numba")
+
+# ___ status of the members at the end of the integration _________________________________________
+
+REACHED_T = 0           # integrated up to T
+REACHED_CROSSINGS = 1   # stopped after max_crossings crossings
+FAILED = -1             # step size below h_min (e.g. blow-up) or max_steps reached
+
+# ___ Dormand-Prince 5(4) tableau (autonomous system, the nodes c_i are not needed) _______________
+
+A21 = 1 / 5
+A31, A32 = 3 / 40, 9 / 40
+A41, A42, A43 = 44 / 45, -56 / 15, 32 / 9
+A51, A52, A53, A54 = 19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729
+A61, A62, A63, A64, A65 = 9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656
+B1, B3, B4, B5, B6 = 35 / 384, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84
+E1, E3, E4, E5, E6, E7 = 71 / 57600, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40
+
+SAFETY, FAC_MIN, FAC_MAX = 0.9, 0.2, 10.0
+
+
+def batch_parameters(params, X0):
+    """
+    Broadcasts the parameters and the initial conditions to a batch.
+
+    Parameters:
+        params: dict of parameters (see hr_model.hr_parameters), values may be scalars or
+            ndarrays of shape (B,), one value per member.
+        X0: initial condition, ndarray of shape (4,) or (B, 4).
+        (B = 1 when all of them are scalars, resp. of shape (4,).)
+
+    Returns:
+        P: ndarray of shape (B, 10), parameters in the order of hr_model.PARAMETERS.
+        X0: ndarray of shape (B, 4).
+    """
+    X0 = np.asarray(X0, dtype=float)
+    if X0.ndim not in (1, 2) or X0.shape[-1] != 4:
+        raise ValueError(f"X0 must be of shape (4,) or (B, 4), but got {X0.shape}.")
+    values = [np.asarray(params[name], dtype=float) for name in PARAMETERS]
+    shape = np.broadcast_shapes((1,), X0.shape[:-1], *(value.shape for value in values))
+    if len(shape) != 1:
+        raise ValueError(f"The parameters and X0 should define a batch of shape (B,), but got {shape}.")
+    P = np.column_stack([np.broadcast_to(value, shape) for value in values])
+    return P, np.array(np.broadcast_to(X0, shape + (4,)))
+
+
+# ___ NumPy backend _______________________________________________________________________________
+
+def _integrate_numpy(P, X0, T, rtol, atol, h0, h_min, h_max, index, threshold, t_transient,
+                     max_crossings, max_steps):
+    """
+    Integrates a batch with vectorized Dormand-Prince steps, see integrate_hr_batch.
+    """
+    B = X0.shape[0]
+    M = 0 if max_crossings is None else max_crossings
+    X_final = X0.copy()
+    t_final = np.zeros(B)
+    crossings = np.full((B, M), np.nan)
+    n_crossings = np.zeros(B, dtype=int)
+    n_steps = np.zeros(B, dtype=int)
+    status = np.full(B, REACHED_T)
+
+    # --- working arrays of the active members (compacted as members finish)
+    active = np.arange(B)
+    p = {name: P[:, i].copy() for i, name in enumerate(PARAMETERS)}
+    X = X0.copy()
+    t = np.zeros(B)
+    h = np.full(B, h0)
+    K1 = hr_drift(X, p)
+
+    while active.size:
+        h = np.minimum(np.minimum(h, h_max), T - t)
+        hh = h[:, None]
+        K2 = hr_drift(X + hh * (A21 * K1), p)
+        K3 = hr_drift(X + hh * (A31 * K1 + A32 * K2), p)
+        K4 = hr_drift(X + hh * (A41 * K1 + A42 * K2 + A43 * K3), p)
+        K5 = hr_drift(X + hh * (A51 * K1 + A52 * K2 + A53 * K3 + A54 * K4), p)
+        K6 = hr_drift(X + hh * (A61 * K1 + A62 * K2 + A63 * K3 + A64 * K4 + A65 * K5), p)
+        X_new = X + hh * (B1 * K1 + B3 * K3 + B4 * K4 + B5 * K5 + B6 * K6)
+        K7 = hr_drift(X_new, p)
+
+        # --- local error estimate and step acceptance
+        E = hh * (E1 * K1 + E3 * K3 + E4 * K4 + E5 * K5 + E6 * K6 + E7 * K7)
+        scale = atol + rtol * np.maximum(np.abs(X), np.abs(X_new))
+        err = np.sqrt(np.mean((E / scale) ** 2, axis=1))
+        accept = err <= 1
+
+        # --- upward threshold crossings during the accepted steps
+        x_old, x_new = X[:, index], X_new[:, index]
+        rows = np.flatnonzero(accept & (x_old < threshold) & (x_new >= threshold))
+        if rows.size:
+            t_cross = t[rows] + h[rows] * (threshold - x_old[rows]) / (x_new[rows] - x_old[rows])
+            rows, t_cross = rows[t_cross >= t_transient], t_cross[t_cross >= t_transient]
+            members = active[rows]
+            slots = n_crossings[members]
+            stored = slots < M
+            crossings[members[stored], slots[stored]] = t_cross[stored]
+            n_crossings[members] += 1
+
+        # --- advance the accepted members, new step sizes
+        X[accept] = X_new[accept]
+        K1[accept] = K7[accept]
+        t[accept] += h[accept]
+        n_steps[active[accept]] += 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            factor = np.clip(SAFETY * err ** -0.2, FAC_MIN, FAC_MAX)
+        factor[err == 0] = FAC_MAX
+        factor[~accept] = np.minimum(factor[~accept], 1.0)
+        factor[np.isnan(err)] = FAC_MIN
+        h = h * factor
+
+        # --- finished members
+        reached_T = T - t <= 1e-12 * max(1.0, T)
+        reached_crossings = n_crossings[active] >= (np.inf if max_crossings is None else max_crossings)
+        failed = (h < h_min) & ~reached_T | (n_steps[active] >= max_steps)
+        done = reached_T | reached_crossings | failed
+        if done.any():
+            members = active[done]
+            X_final[members] = X[done]
+            t_final[members] = np.where(reached_T[done], T, t[done])
+            status[members] = np.select([reached_crossings[done], failed[done]], [REACHED_CROSSINGS, FAILED],
+                                        REACHED_T)
+            keep = ~done
+            active, X, t, h, K1 = active[keep], X[keep], t[keep], h[keep], K1[keep]
+            p = {name: value[keep] for name, value in p.items()}
+
+    return X_final, t_final, crossings, n_crossings, n_steps, status
+
+
+# ___ Numba backend _______________________________________________________________________________
+
+if numba is not None:
+    _jit = numba.njit(cache=True)
+    _jit_parallel = numba.njit(parallel=True, cache=True)
+    _prange = numba.prange
+else:
+    def _jit(function):
+        return function
+    _jit_parallel = _jit
+    _prange = range
+
+
+@_jit
+def _hr_rhs(p, y, out):
+    """
+    Right-hand side of one member, p of shape (10,) (order of PARAMETERS), y and out of shape (4,).
+    """
+    a, c, d, I, x1, eps, s1, alpha, z0, b0 = p[0], p[1], p[2], p[3], p[4], p[5], p[6], p[7], p[8], p[9]
+    x, y_, z, b = y[0], y[1], y[2], y[3]
+    out[0] = c * (x - x**3 / 3 - y_ + z + I)
+    out[1] = (x**2 + d * x - b * y_ + a) / c
+    out[2] = eps * (-s1 * (x - x1) - (b - b0))
+    out[3] = eps * (z - z0 + alpha * x)
+
+
+@_jit
+def _integrate_member(p, y0, T, rtol, atol, h0, h_min, h_max, index, threshold, t_transient,
+                      max_crossings, max_steps, crossings):
+    """
+    Integrates one member with Dormand-Prince steps, the crossing times are written in `crossings`.
+
+    Returns:
+        y (final state), t, n_crossings, n_steps, status.
+    """
+    M = crossings.shape[0]
+    y = y0.copy()
+    y_new = np.empty(4)
+    stage = np.empty(4)
+    K1, K2, K3, K4 = np.empty(4), np.empty(4), np.empty(4), np.empty(4)
+    K5, K6, K7 = np.empty(4), np.empty(4), np.empty(4)
+    _hr_rhs(p, y, K1)
+
+    t, h = 0.0, h0
+    n_crossings, n_steps = 0, 0
+    while True:
+        if T - t <= 1e-12 * max(1.0, T):
+            return y, T, n_crossings, n_steps, REACHED_T
+        if max_crossings >= 0 and n_crossings >= max_crossings:
+            return y, t, n_crossings, n_steps, REACHED_CROSSINGS
+        if h < h_min or n_steps >= max_steps:
+            return y, t, n_crossings, n_steps, FAILED
+
+        h = min(h, h_max, T - t)
+        for i in range(4):
+            stage[i] = y[i] + h * A21 * K1[i]
+        _hr_rhs(p, stage, K2)
+        for i in range(4):
+            stage[i] = y[i] + h * (A31 * K1[i] + A32 * K2[i])
+        _hr_rhs(p, stage, K3)
+        for i in range(4):
+            stage[i] = y[i] + h * (A41 * K1[i] + A42 * K2[i] + A43 * K3[i])
+        _hr_rhs(p, stage, K4)
+        for i in range(4):
+            stage[i] = y[i] + h * (A51 * K1[i] + A52 * K2[i] + A53 * K3[i] + A54 * K4[i])
+        _hr_rhs(p, stage, K5)
+        for i in range(4):
+            stage[i] = y[i] + h * (A61 * K1[i] + A62 * K2[i] + A63 * K3[i] + A64 * K4[i] + A65 * K5[i])
+        _hr_rhs(p, stage, K6)
+        for i in range(4):
+            y_new[i] = y[i] + h * (B1 * K1[i] + B3 * K3[i] + B4 * K4[i] + B5 * K5[i] + B6 * K6[i])
+        _hr_rhs(p, y_new, K7)
+
+        # --- local error estimate
+        err = 0.0
+        for i in range(4):
+            e = h * (E1 * K1[i] + E3 * K3[i] + E4 * K4[i] + E5 * K5[i] + E6 * K6[i] + E7 * K7[i])
+            scale = atol + rtol * max(abs(y[i]), abs(y_new[i]))
+            err += (e / scale) ** 2
+        err = np.sqrt(err / 4)
+
+        if err <= 1:
+            # --- upward threshold crossing during the step
+            if y[index] < threshold <= y_new[index]:
+                t_cross = t + h * (threshold - y[index]) / (y_new[index] - y[index])
+                if t_cross >= t_transient:
+                    if n_crossings < M:
+                        crossings[n_crossings] = t_cross
+                    n_crossings += 1
+            t += h
+            n_steps += 1
+            for i in range(4):
+                y[i] = y_new[i]
+                K1[i] = K7[i]
+            h *= FAC_MAX if err == 0 else min(FAC_MAX, max(FAC_MIN, SAFETY * err ** -0.2))
+        elif np.isnan(err):
+            h *= FAC_MIN
+        else:
+            h *= min(1.0, max(FAC_MIN, SAFETY * err ** -0.2))
+
+
+@_jit_parallel
+def _integrate_numba(P, X0, T, rtol, atol, h0, h_min, h_max, index, threshold, t_transient,
+                     max_crossings, max_steps, X_final, t_final, crossings, n_crossings, n_steps, status):
+    """
+    Integrates the members in parallel threads, the results are written in the output arrays.
+    """
+    for m in _prange(X0.shape[0]):
+        y, t, count, steps, state = _integrate_member(P[m], X0[m], T, rtol, atol, h0, h_min, h_max, index,
+                                                      threshold, t_transient, max_crossings, max_steps,
+                                                      crossings[m])
+        X_final[m] = y
+        t_final[m] = t
+        n_crossings[m] = count
+        n_steps[m] = steps
+        status[m] = state
+
+
+# ___ driver ______________________________________________________________________________________
+
+def integrate_hr_batch(params, X0, T, rtol=1e-6, atol=1e-9, h0=1e-3, h_min=1e-10, h_max=np.inf,
+                       component="x", threshold=0.0, t_transient=0.0, max_crossings=None, max_steps=10**7,
+                       backend="numpy", chunk_size=1000, n_jobs=1):
+    """
+    Integrates a batch of extended HR systems with per-member parameters, step sizes and events.
+
+    Parameters:
+        params: dict of parameters (see hr_model.hr_parameters), values may be scalars or
+            ndarrays of shape (B,), one value per member.
+        X0: initial condition, ndarray of shape (4,) or (B, 4).
+        T: final time.
+        rtol, atol: relative and absolute tolerances on the local error.
+        h0: initial step size.
+        h_min: minimal step size, a member whose step falls below it is stopped (FAILED).
+        h_max: maximal step size.
+        component: component whose threshold crossings are detected, one of ("x", "y", "z", "b").
+        threshold: crossing level (x = 0 is crossed once per spike in all regimes).
+        t_transient: crossings before this time are ignored.
+        max_crossings: stop a member after this number of upward crossings, and store their
+            times (None: integrate every member up to T, only count the crossings).
+        max_steps: maximal number of accepted steps per member.
+        backend: "numpy" or "numba".
+        chunk_size: maximal number of members per chunk (numpy backend).
+        n_jobs: number of worker processes over the chunks (numpy backend, 1: no multiprocessing);
+            the numba backend uses the numba threads (see numba.set_num_threads).
+
+    Returns:
+        dict with
+            "X": ndarray of shape (B, 4), final states;
+            "t": ndarray of shape (B,), final times (T, or the time of the last crossing step);
+            "crossings": ndarray of shape (B, max_crossings), crossing times, NaN-padded;
+            "n_crossings": ndarray of shape (B,), numbers of crossings;
+            "n_steps": ndarray of shape (B,), numbers of accepted steps;
+            "status": ndarray of shape (B,), REACHED_T, REACHED_CROSSINGS or FAILED.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, but got '{backend}'.")
+    if component not in COMPONENTS:
+        raise ValueError(f"component must be one of {COMPONENTS}, but got '{component}'.")
+    if max_crossings is not None and max_crossings < 1:
+        raise ValueError(f"max_crossings must be a positive integer or None, but got {max_crossings}.")
+    P, X0 = batch_parameters(params, X0)
+    index = COMPONENTS.index(component)
+    options = (T, rtol, atol, h0, h_min, h_max, index, threshold, t_transient, max_crossings, max_steps)
+
+    if backend == "numba":
+        if numba is None:
+            raise ImportError("backend='numba' needs the package numba (pip install numba).")
+        B, M = X0.shape[0], 0 if max_crossings is None else max_crossings
+        X_final, t_final = np.empty((B, 4)), np.empty(B)
+        crossings = np.full((B, M), np.nan)
+        n_crossings, n_steps, status = np.empty(B, dtype=np.int64), np.empty(B, dtype=np.int64), np.empty(B, dtype=np.int64)
+        _integrate_numba(P, X0, *options[:-2], -1 if max_crossings is None else max_crossings, max_steps,
+                         X_final, t_final, crossings, n_crossings, n_steps, status)
+        results = X_final, t_final, crossings, n_crossings, n_steps, status
+    else:
+        bounds = list(range(0, X0.shape[0], chunk_size)) + [X0.shape[0]]
+        tasks = [(P[start:stop], X0[start:stop]) + options for start, stop in zip(bounds[:-1], bounds[1:])]
+        if n_jobs == 1 or len(tasks) == 1:
+            chunks = [_integrate_numpy(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                chunks = list(executor.map(_integrate_numpy, *zip(*tasks)))
+        results = [np.concatenate(arrays) for arrays in zip(*chunks)]
+
+    names = ("X", "t", "crossings", "n_crossings", "n_steps", "status")
+    return dict(zip(names, results))
@@ -0,0 +1,410 @@
+"""
+Bifurcation diagram of the fast subsystem of the extended HR model
+
+With eps = 0.01, the slow variables (z, b) act as parameters of the fast (x, y) subsystem
+
+    dx/dt = c (x - x^3/3 - y + z + I)
+    dy/dt = (x^2 + d x - b y + a) / c
+
+whose equilibria satisfy y = x - x^3/3 + z + I and G(x; z, b) = 0, with
+
+    G(x; z, b) = x^2 + d x + a - b (x - x^3/3 + z + I).
+
+The determinant of the Jacobian matrix at an equilibrium is G_x = 2x + d - b (1 - x^2), and its
+trace is c (1 - x^2) - b/c, so that in the (z, b) plane:
+
+    fold (saddle-node) curves:   G = 0, G_x = 0                    (red curves of 1_lhb.ipynb)
+    Hopf curves:                 G = 0, c (1 - x^2) - b/c = 0, G_x > 0
+
+These curves, and the branches of equilibria for a fixed b, are computed by pseudo-arclength
+continuation (continue_curve) in the space (x, z, b), each point being corrected by a
+warm-started Newton solve (scipy.optimize.fsolve). The limit cycles of the fast subsystem
+(spiking) are continued in z by shooting on a Poincare section, which gives their x extrema
+and period; the period blows up at the homoclinic bifurcation ending the branch.
+
+The homoclinic curves of the AUTO/XPP file `notebooks/bifurcation_diagram.dat` (black curves)
+are not continued here, but the ends of the branches of cycles lie on them (for b = 0.5, the
+branch ends at z = -1.533 and the AUTO curve passes at z = -1.535).
+
+The diagram only depends on (a, c, d, I) and on the settings; bifurcation_diagram caches it
+on disk, keyed by a hash of these values.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+from scipy.integrate import solve_ivp
+from scipy.optimize import fsolve
+
+from .hr_model import HR_DEFAULTS
+
+FAST_PARAMETERS = ("a", "c", "d", "I")
+
+DEFAULT_BOUNDS = ((-3.0, 0.0), (0.0, 2.0))   # (z, b) window of the figures of 1_lhb.ipynb
+
+
+def _fast_parameters(params):
+    params = HR_DEFAULTS if params is None else params
+    return tuple(float(params[key]) for key in FAST_PARAMETERS)
+
+
+# ___ equilibria of the fast subsystem ____________________________________________________________
+
+def equilibrium_residual(x, z, b, params=None):
+    """
+    Returns G(x; z, b), which vanishes at the equilibria of the fast subsystem.
+    """
+    a, c, d, I = _fast_parameters(params)
+    return x**2 + d * x + a - b * (x - x**3 / 3 + z + I)
+
+
+def equilibrium_stability(x, b, params=None):
+    """
+    Returns the trace and the determinant of the Jacobian matrix of the fast subsystem at the
+    equilibrium of abscissa x (stable: trace < 0 and det > 0, saddle: det < 0).
+    """
+    a, c, d, I = _fast_parameters(params)
+    return c * (1 - x**2) - b / c, 2 * x + d - b * (1 - x**2)
+
+
+# ___ pseudo-arclength continuation _______________________________________________________________
+
+def numerical_jacobian(F, u, h=1e-7):
+    """
+    Jacobian matrix of F: R^(n+1) -> R^n at u, of shape (n, n+1), by central differences.
+    """
+    columns = []
+    for i in range(len(u)):
+        step = np.zeros_like(u)
+        step[i] = h * max(1.0, abs(u[i]))
+        columns.append((np.asarray(F(u + step)) - np.asarray(F(u - step))) / (2 * step[i]))
+    return np.column_stack(columns)
+
+
+def _tangent(F, u, previous=None, h=1e-7):
+    """
+    Unit tangent of the curve F = 0 at u, oriented as `previous` (a vector) when given,
+    None when F is not defined around u.
+    """
+    J = np.atleast_2d(numerical_jacobian(F, u, h))
+    if not np.all(np.isfinite(J)):
+        return None
+    tangent = np.linalg.svd(J)[2][-1]   # right singular vector of the zero singular value
+    if previous is not None and tangent @ previous < 0:
+        tangent = -tangent
+    return tangent
+
+
+def _inside(u, bounds):
+    return bounds is None or all(low <= value <= high for value, (low, high) in zip(u, bounds)
+                                 if low is not None)
+
+
+def continue_curve(F, u0, direction=None, ds=1e-2, ds_min=1e-6, ds_max=5e-2, n_max=10000, bounds=None,
+                   xtol=1e-10, fd_step=1e-7, stop=None):
+    """
+    Pseudo-arclength continuation of a curve F(u) = 0, F: R^(n+1) -> R^n.
+
+    Each step predicts u_p = u + ds t along the unit tangent t, and corrects it by solving
+        F(v) = 0,   t . (v - u_p) = 0
+    with fsolve, warm-started at u_p. The step length is halved when the correction fails and
+    increased after easy corrections.
+
+    Parameters:
+        F: function of an ndarray of shape (n+1,), returns an ndarray of shape (n,).
+        u0: ndarray of shape (n+1,), starting point, close to the curve.
+        direction: ndarray of shape (n+1,), initial direction (None: arbitrary).
+        ds, ds_min, ds_max: initial, minimal and maximal step lengths.
+        n_max: maximal number of steps.
+        bounds: sequence of (low, high) per coordinate ((None, None): unbounded), the
+            continuation stops when the curve leaves the box.
+        xtol: tolerance of fsolve.
+        fd_step: relative step of the finite differences (larger when F is computed by a
+            numerical integration).
+        stop: optional function stop(u) -> bool, the continuation stops when it returns True.
+
+    Returns:
+        ndarray of shape (m, n+1), points of the curve.
+    """
+    u = np.asarray(u0, dtype=float)
+    tangent = _tangent(F, u, direction, fd_step)
+    if tangent is None:
+        raise ValueError(f"F is not defined around the starting point {u0}.")
+
+    def corrector(v_start, t):
+        solution, _, ier, _ = fsolve(lambda v: np.append(F(v), t @ (v - v_start)), v_start,
+                                     full_output=True, xtol=xtol, epsfcn=fd_step**2)
+        return solution, ier == 1
+
+    u, converged = corrector(u, tangent)
+    if not converged:
+        raise ValueError(f"The starting point {u0} could not be corrected onto the curve.")
+    points = [u]
+    while len(points) < n_max and _inside(u, bounds) and (stop is None or not stop(u)):
+        v, converged = corrector(u + ds * tangent, tangent)
+        if not converged or np.linalg.norm(v - u) > 2 * ds:
+            ds /= 2
+            if ds < ds_min:
+                break
+            continue
+        tangent = _tangent(F, v, v - u, fd_step)
+        u = v
+        points.append(u)
+        if tangent is None:
+            break
+        ds = min(1.2 * ds, ds_max)
+    return np.array(points)
+
+
+def continue_both_ways(F, u0, **kwargs):
+    """
+    Continues the curve F = 0 on both sides of u0, returns the points in order (see continue_curve).
+    """
+    tangent = _tangent(F, np.asarray(u0, dtype=float), h=kwargs.get("fd_step", 1e-7))
+    forward = continue_curve(F, u0, direction=tangent, **kwargs)
+    backward = continue_curve(F, u0, direction=-tangent, **kwargs)
+    return np.concatenate([backward[::-1], forward[1:]])
+
+
+# ___ branches of equilibria and bifurcation curves _______________________________________________
+
+def equilibrium_branch(b, params=None, x_bounds=(-5.0, 3.0), **kwargs):
+    """
+    Branch of equilibria of the fast subsystem for a fixed b, as a function of z.
+
+    Parameters:
+        b: value of the slow variable b.
+        params: dict of parameters (None: hr_model.HR_DEFAULTS).
+        x_bounds: range of x covered by the branch.
+        kwargs: options of continue_curve.
+
+    Returns:
+        dict of ndarrays of shape (m,): "x", "y", "z", "stable" (both eigenvalues with
+        negative real parts) and "saddle".
+    """
+    a, c, d, I = _fast_parameters(params)
+
+    def F(u):
+        return [equilibrium_residual(u[0], u[1], b, params)]
+
+    # --- seed: the equilibrium at x = mean(x_bounds), z from G = 0
+    x0 = np.mean(x_bounds)
+    z0 = (x0**2 + d * x0 + a) / b - x0 + x0**3 / 3 - I
+    points = continue_both_ways(F, [x0, z0], bounds=[x_bounds, (None, None)], **kwargs)
+    x, z = points[:, 0], points[:, 1]
+    trace, det = equilibrium_stability(x, b, params)
+    return {"x": x, "y": x - x**3 / 3 + z + I, "z": z, "stable": (trace < 0) & (det > 0), "saddle": det < 0}
+
+
+def _seeds(x_grid, z, b, bounds):
+    """
+    One seed (x, z, b) in the middle of each run of consecutive points of a parameterized
+    curve lying inside the (z, b) window.
+    """
+    inside = (z >= bounds[0][0]) & (z <= bounds[0][1]) & (b >= bounds[1][0]) & (b <= bounds[1][1])
+    runs = np.split(np.flatnonzero(inside), np.flatnonzero(np.diff(np.flatnonzero(inside)) > 1) + 1)
+    return [np.array([x_grid[run[len(run) // 2]], z[run[len(run) // 2]], b[run[len(run) // 2]]])
+            for run in runs if len(run)]
+
+
+def _curves(F, x_grid, b_of_x, params, bounds, **kwargs):
+    """
+    Continues the curves G = 0, F2 = 0 in (x, z, b) crossing the (z, b) window, seeded by a
+    parameterization b(x) of the curve (z follows from G = 0).
+    """
+    a, c, d, I = _fast_parameters(params)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        b = b_of_x(x_grid)
+        z = (x_grid**2 + d * x_grid + a) / b - x_grid + x_grid**3 / 3 - I
+    box = [(None, None)] + [(low - 1e-3, high + 1e-3) for low, high in bounds]
+    return [continue_both_ways(F, seed, bounds=box, **kwargs) for seed in _seeds(x_grid, z, b, bounds)]
+
+
+def fold_curves(params=None, bounds=DEFAULT_BOUNDS, **kwargs):
+    """
+    Fold (saddle-node) curves of the fast subsystem in the (z, b) plane.
+
+    Parameters:
+        params: dict of parameters (None: hr_model.HR_DEFAULTS).
+        bounds: ((z_min, z_max), (b_min, b_max)), window of the diagram.
+        kwargs: options of continue_curve.
+
+    Returns:
+        list of ndarrays of shape (m, 3), points (x, z, b) of each curve crossing the window.
+    """
+    a, c, d, I = _fast_parameters(params)
+
+    def F(u):
+        x, z, b = u
+        return [equilibrium_residual(x, z, b, params), 2 * x + d - b * (1 - x**2)]
+
+    x_grid = np.linspace(-4, 4, 8001)
+    return _curves(F, x_grid, lambda x: (2 * x + d) / (1 - x**2), params, bounds, **kwargs)
+
+
+def hopf_curves(params=None, bounds=DEFAULT_BOUNDS, **kwargs):
+    """
+    Hopf curves of the fast subsystem in the (z, b) plane (see fold_curves).
+
+    Returns:
+        list of ndarrays of shape (m, 4), points (x, z, b, is_hopf); along the curves, the
+        trace vanishes and the points with a negative determinant (is_hopf = 0) are neutral
+        saddles, not Hopf points.
+    """
+    a, c, d, I = _fast_parameters(params)
+
+    def F(u):
+        x, z, b = u
+        return [equilibrium_residual(x, z, b, params), c * (1 - x**2) - b / c]
+
+    x_grid = np.linspace(-1, 1, 8001)
+    curves = _curves(F, x_grid, lambda x: c**2 * (1 - x**2), params, bounds, **kwargs)
+    return [np.column_stack([curve, equilibrium_stability(curve[:, 0], curve[:, 2], params)[1] > 0])
+            for curve in curves]
+
+
+# ___ limit cycles (shooting on a Poincare section) ________________________________________________
+
+def _fast_rhs(params, z, b):
+    a, c, d, I = _fast_parameters(params)
+
+    def rhs(t, u):
+        x, y = u
+        return [c * (x - x**3 / 3 - y + z + I), (x**2 + d * x - b * y + a) / c]
+    return rhs
+
+
+def _crossing(direction, x_section):
+    def event(t, u):
+        return u[0] - x_section
+    event.terminal = True
+    event.direction = direction
+    return event
+
+
+def _shoot(y, z, b, x_section, params, t_max, rtol, extrema=False):
+    """
+    Follows the orbit starting on the section x = x_section (with dx/dt > 0) until it comes back.
+
+    Returns:
+        y_return: y at the return on the section (NaN if no return before t_max),
+        period: return time,
+        x_min, x_max: extrema of x along the orbit (NaN unless `extrema` is True).
+    """
+    if not np.isfinite(y + z):
+        return np.nan, np.inf, np.nan, np.nan
+    rhs = _fast_rhs(params, z, b)
+    t, x_min, x_max, state = 0.0, np.inf, -np.inf, [x_section, y]
+    for direction in (-1, 1):   # down then up through the section
+        sol = solve_ivp(rhs, (0, t_max - t), state, method="DOP853", events=_crossing(direction, x_section),
+                        rtol=rtol, atol=rtol, dense_output=extrema)
+        if sol.status != 1:
+            return np.nan, np.inf, np.nan, np.nan
+        if extrema:
+            x_fine = sol.sol(np.linspace(0, sol.t[-1], 2000))[0]
+            x_min, x_max = min(x_min, x_fine.min()), max(x_max, x_fine.max())
+        t += sol.t[-1]
+        state = sol.y_events[0][0]
+    return state[1], t, (x_min if extrema else np.nan), (x_max if extrema else np.nan)
+
+
+def limit_cycle_branch(b, z0, params=None, z_bounds=DEFAULT_BOUNDS[0], period_max=200.0, rtol=1e-10,
+                       fd_step=1e-6, **kwargs):
+    """
+    Branch of limit cycles of the fast subsystem for a fixed b, continued in z from z0.
+
+    A cycle is a fixed point of the return map P(y; z) on the section x = x_section (crossed
+    with dx/dt > 0), x_section being the mean of x over the cycle found at z0 by forward
+    integration. The curve P(y; z) - y = 0 is continued in (y, z) on both sides of z0, which
+    also follows the unstable cycles; it stops when the period exceeds `period_max`
+    (homoclinic bifurcation) or when the cycle does not cross the section anymore.
+
+    Parameters:
+        b: value of the slow variable b.
+        z0: value of z at which the fast subsystem has a stable limit cycle.
+        params: dict of parameters (None: hr_model.HR_DEFAULTS).
+        z_bounds: window of the branch.
+        period_max: maximal period.
+        rtol: tolerance of the integrations.
+        fd_step, kwargs: options of continue_curve.
+
+    Each point costs a few tens of integrations of the fast subsystem, a branch takes tens of
+    seconds (bifurcation_diagram caches it).
+
+    Returns:
+        dict of ndarrays of shape (m,): "z", "x_min", "x_max", "period".
+    """
+    kwargs.setdefault("ds", 5e-2)
+    kwargs.setdefault("ds_max", 0.2)
+
+    # --- stable cycle at z0, by forward integration
+    rhs = _fast_rhs(params, z0, b)
+    sol = solve_ivp(rhs, (0, 500), [0.0, 0.0], method="DOP853", rtol=1e-9, atol=1e-9, dense_output=True)
+    x_late = sol.sol(np.linspace(400, 500, 5000))[0]
+    if np.ptp(x_late) < 1e-3:
+        raise ValueError(f"The fast subsystem has no stable limit cycle at z = {z0}, b = {b}.")
+    x_section = np.mean(x_late)
+    sol = solve_ivp(rhs, (0, 500), sol.y[:, -1], method="DOP853", events=_crossing(1, x_section),
+                    rtol=1e-9, atol=1e-9)
+    y0 = sol.y_events[0][-1][1]
+
+    def F(u):
+        return [_shoot(u[0], u[1], b, x_section, params, period_max, rtol)[0] - u[0]]
+
+    def stop(u):
+        return not np.isfinite(F(u)[0])
+
+    points = continue_both_ways(F, [y0, z0], bounds=[(None, None), z_bounds], stop=stop, fd_step=fd_step,
+                                **kwargs)
+    shots = np.array([_shoot(y, z, b, x_section, params, period_max, rtol, extrema=True)[1:] for y, z in points])
+    kept = np.isfinite(shots[:, 0])
+    return {"z": points[kept, 1], "x_min": shots[kept, 1], "x_max": shots[kept, 2], "period": shots[kept, 0]}
+
+
+# ___ cached diagram ______________________________________________________________________________
+
+def _cache_key(params, bounds, cycles):
+    text = repr((_fast_parameters(params), tuple(map(tuple, bounds)), tuple(map(tuple, cycles))))
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def bifurcation_diagram(params=None, bounds=DEFAULT_BOUNDS, cycles=(), cache_dir=None):
+    """
+    Fold and Hopf curves in the (z, b) plane and, optionally, branches of limit cycles.
+
+    Parameters:
+        params: dict of parameters (None: hr_model.HR_DEFAULTS), only (a, c, d, I) matter.
+        bounds: ((z_min, z_max), (b_min, b_max)), window of the diagram.
+        cycles: sequence of pairs (b, z0) (see limit_cycle_branch).
+        cache_dir: directory of the cache (None: no cache); the diagram is stored in a file
+            named after a hash of the parameters and settings, and reloaded when it exists.
+
+    Returns:
+        dict with
+            "fold": list of ndarrays of shape (m, 3), (x, z, b) along each fold curve;
+            "hopf": list of ndarrays of shape (m, 4), (x, z, b, is_hopf) along each Hopf curve;
+            "cycles": list of ndarrays of shape (m, 4), (z, x_min, x_max, period) along each
+                branch of limit cycles, in the order of `cycles`.
+    """
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, f"bifurcation_{_cache_key(params, bounds, cycles)}.npz")
+        if os.path.exists(path):
+            with np.load(path) as saved:
+                return {kind: [saved[name] for name in sorted(saved.files, key=lambda name: int(name.split("_")[1]))
+                               if name.startswith(kind + "_")] for kind in ("fold", "hopf", "cycles")}
+
+    diagram = {"fold": fold_curves(params, bounds), "hopf": hopf_curves(params, bounds), "cycles": []}
+    for b, z0 in cycles:
+        branch = limit_cycle_branch(b, z0, params, z_bounds=bounds[0])
+        diagram["cycles"].append(np.column_stack([branch[key] for key in ("z", "x_min", "x_max", "period")]))
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        arrays = {f"{kind}_{i}": curve for kind, curves in diagram.items() for i, curve in enumerate(curves)}
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temporary, path)
+    return diagram
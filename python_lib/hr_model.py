@@ -0,0 +1,191 @@
+"""
+Extended Hindmarsh-Rose (HR) bursting model
+
+Reference:
+    Hindmarsh, J. L., & Rose, R. M. A model of neuronal bursting using three coupled
+    first order differential equations. Proc. R. Soc. Lond. B 221(1222): 87-102, 1984.
+
+The 4D model used in `notebooks/1_lhb.ipynb`:
+
+    dx/dt = c (x - x^3/3 - y + z + I)
+    dy/dt = (x^2 + d x - b y + a) / c
+    dz/dt = eps (-s1 (x - x1) - (b - b0))
+    db/dt = eps (z - z0 + alpha x)
+
+The state is stored in the last axis, in the order (x, y, z, b), so that an ensemble
+of R realizations is an array of shape (R, 4).
+"""
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+# ___ state components ____________________________________________________________________________
+
+COMPONENTS = ("x", "y", "z", "b")
+
+# ___ parameter names, in the order used by the array-based integrators _____________________________
+
+PARAMETERS = ("a", "c", "d", "I", "x1", "eps", "s1", "alpha", "z0", "b0")
+
+# ___ system parameters ___________________________________________________________________________
+
+HR_DEFAULTS = {
+    "a": 0.08, "c": 3.0, "d": 1.8, "I": 2.0,   # parameters controlling the (x,y)-equation
+    "x1": -3.0,                                # one parameter of the z-component of the slow forcing
+    "eps": 0.01,                               # speed of the slow forcing
+}
+
+# ___ bursting regimes (parameters of the slow forcing and initial conditions) ____________________
+
+REGIMES = {
+    # --- square-wave bursting (SW, 13 spikes)
+    "SW": {
+        "params": {"s1": 0.1, "alpha": -0.1, "z0": -0.7533, "b0": 0.57},
+        "ini_cond": (-3.71, 14.27, -1.12, 0.33),
+    },
+    # --- parabolic bursting (PARB, 2 spikes)
+    "PARB": {
+        "params": {"s1": 0.01, "alpha": -0.1, "z0": -1.7737, "b0": 1.5},
+        "ini_cond": (-1.81, 0.07, -1.97, 1.369),
+    },
+    # --- triangular bursting (TRIANG, 5 spikes)
+    "TRIANG": {
+        "params": {"s1": 0.01, "alpha": -0.003, "z0": -1.9, "b0": 0.7},
+        "ini_cond": (-1.97, 0.49, -2.089, 0.715),
+    },
+}
+
+
+def hr_parameters(regime=None, **overrides):
+    """
+    Returns a complete parameter dictionary of the extended HR model.
+
+    Parameters:
+        regime: str, optional, one of the keys of REGIMES ("SW", "PARB", "TRIANG").
+        overrides: parameter values replacing the defaults (e.g. s1=0.05).
+
+    Returns:
+        dict with keys a, c, d, I, x1, eps, s1, alpha, z0, b0.
+    """
+    params = dict(HR_DEFAULTS)
+    if regime is not None:
+        if regime not in REGIMES:
+            raise ValueError(f"Unknown regime '{regime}', expected one of {list(REGIMES)}.")
+        params.update(REGIMES[regime]["params"])
+    params.update(overrides)
+
+    missing = [key for key in ("s1", "alpha", "z0", "b0") if key not in params]
+    if missing:
+        raise ValueError(f"Missing slow forcing parameters: {missing}.")
+    return params
+
+
+def hr_initial_condition(regime):
+    """
+    Returns the deterministic initial condition (x, y, z, b) of a regime as an array of shape (4,).
+    """
+    if regime not in REGIMES:
+        raise ValueError(f"Unknown regime '{regime}', expected one of {list(REGIMES)}.")
+    return np.array(REGIMES[regime]["ini_cond"], dtype=float)
+
+
+def hr_drift(X, p, out=None):
+    """
+    Vectorized right-hand side of the extended HR model.
+
+    Parameters:
+        X: ndarray of shape (..., 4), states (x, y, z, b) along the last axis.
+        p: dict of parameters (see hr_parameters); values may be scalars or arrays
+           broadcastable to X[..., 0] (one parameter set per realization).
+        out: optional ndarray of shape X.shape receiving the result.
+
+    Returns:
+        ndarray of shape X.shape.
+    """
+    x, y, z, b = X[..., 0], X[..., 1], X[..., 2], X[..., 3]
+    if out is None:
+        shape = np.broadcast_shapes(X.shape[:-1], *(np.shape(value) for value in p.values()))
+        out = np.empty(shape + (4,))
+
+    c, eps = p["c"], p["eps"]
+    out[..., 0] = c * (x - x**3 / 3 - y + z + p["I"])
+    out[..., 1] = (x**2 + p["d"] * x - b * y + p["a"]) / c
+    out[..., 2] = eps * (-p["s1"] * (x - p["x1"]) - (b - p["b0"]))
+    out[..., 3] = eps * (z - p["z0"] + p["alpha"] * x)
+    return out
+
+
+class HRModel:
+    """
+    Extended HR model for deterministic integration with `scipy.integrate.solve_ivp`.
+
+    The right-hand side accepts states of shape (4,) or (4, k) (as expected by solve_ivp with
+    vectorized=True) and the Jacobian is analytic, so that the implicit solvers (LSODA, Radau,
+    BDF) do not need finite differences. With eps = 0.01 the system is slow-fast
+    and an implicit or stiffness-switching solver is usually much cheaper than the default RK45.
+
+    Parameters:
+        regime: str, optional, one of the keys of REGIMES.
+        params: parameter values replacing the defaults (see hr_parameters).
+
+    Usage:
+        model = HRModel("SW")
+        sol = model.solve((0, 2000), hr_initial_condition("SW"), method="LSODA",
+                          t_eval=np.linspace(0, 2000, 100000))
+    """
+
+    METHODS = ("LSODA", "Radau", "BDF", "DOP853", "RK45")
+
+    def __init__(self, regime=None, **params):
+        self.params = hr_parameters(regime, **params)
+        self._coefficients = tuple(float(self.params[key]) for key in PARAMETERS)
+
+    def rhs(self, t, S):
+        """
+        Right-hand side, S of shape (4,) or (4, k).
+
+        A single state is unpacked into Python floats, which is much cheaper than NumPy
+        scalar arithmetic for the many small calls made by the solvers.
+        """
+        a, c, d, I, x1, eps, s1, alpha, z0, b0 = self._coefficients
+        x, y, z, b = S.tolist() if S.ndim == 1 else S
+        return np.array([
+            c * (x - x**3 / 3 - y + z + I),
+            (x**2 + d * x - b * y + a) / c,
+            eps * (-s1 * (x - x1) - (b - b0)),
+            eps * (z - z0 + alpha * x),
+        ])
+
+    def jacobian(self, t, S):
+        """
+        Analytic Jacobian matrix of the right-hand side, of shape (4, 4), at S of shape (4,).
+        """
+        _, c, d, _, _, eps, s1, alpha, _, _ = self._coefficients
+        x, y, _, b = S.tolist()
+        return np.array([
+            [c * (1 - x**2),    -c,     c,    0.0],
+            [(2 * x + d) / c,   -b / c, 0.0,  -y / c],
+            [-eps * s1,         0.0,    0.0,  -eps],
+            [eps * alpha,       0.0,    eps,  0.0],
+        ])
+
+    def solve(self, t_span, y0, method="LSODA", t_eval=None, rtol=1e-8, atol=1e-10, **kwargs):
+        """
+        Integrates the model with `scipy.integrate.solve_ivp`.
+
+        Parameters:
+            t_span: (t0, tf).
+            y0: initial condition, ndarray of shape (4,).
+            method: one of HRModel.METHODS; the analytic Jacobian is passed to the implicit ones.
+            t_eval: times at which the solution is stored (None: solver steps).
+            rtol, atol: tolerances.
+            kwargs: other arguments of solve_ivp (events, dense_output, ...).
+
+        Returns:
+            the OdeResult of solve_ivp (fields t, y, nfev, njev, nlu, ...).
+        """
+        if method not in self.METHODS:
+            raise ValueError(f"method must be one of {self.METHODS}, but got '{method}'.")
+        if method in ("LSODA", "Radau", "BDF"):
+            kwargs.setdefault("jac", self.jacobian)
+        return solve_ivp(self.rhs, t_span, y0, method=method, t_eval=t_eval, rtol=rtol, atol=atol, **kwargs)
@@ -0,0 +1,243 @@
+"""
+Networks of coupled extended Hindmarsh-Rose neurons
+
+Each neuron i follows the extended HR SDE of hr_sde.py, with a coupling current added to the
+input current I of its fast variable (Belykh, de Lange and Hasler, 2005):
+
+    dx_i/dt = c (x_i - x_i^3/3 - y_i + z_i + I + I_gap,i + I_syn,i)
+
+    I_gap,i = g_gap sum_j A_ij (x_j - x_i)                                  (electrical)
+    I_syn,i = g_syn (E_syn - x_i) sum_j W_ij Gamma(x_j),
+              Gamma(x) = 1 / (1 + exp(-lambda_syn (x - theta_syn)))         (chemical, fast threshold)
+
+with A (symmetric) and W (W_ij: synapse from j to i) scipy.sparse matrices. The noise on
+(z_i, b_i) is eps L dW_i (L: hr_sde.noise_cholesky), where W_i mixes an independent and a
+common Brownian motion,
+
+    W_i = sqrt(1 - shared) B_i + sqrt(shared) B_0,
+
+so that `shared` is the correlation between the noises of two neurons (0: independent).
+
+The network is advanced by Euler-Maruyama steps vectorized over the neurons, with one sparse
+matrix-vector product per coupling and per step. The noise is drawn and the spikes (upward
+crossings of `threshold` by x, linearly interpolated) are extracted by blocks of
+`block_steps` steps, and only the spike times are kept: the memory does not depend on T.
+
+Backends:
+    "numpy"   NumPy arrays of shape (n_neurons,) per component, scipy.sparse products.
+    "numba"   compiled loop over the neurons in parallel threads (numba.prange), with the CSR
+              products computed row by row; needs the optional package numba.
+
+Usage:
+    W = random_network(10000, k=20, seed=1)
+    spikes = simulate_hr_network(hr_parameters("SW"), hr_initial_condition("SW"), T=2000,
+                                 N=200000, synapses=W, g_syn=0.01, shared=0.1, ini_std=0.05,
+                                 backend="numba", seed=1)
+    spikes["neuron"], spikes["time"]
+
+Reference:
+    Belykh, I., de Lange, E., & Hasler, M. Synchronization of bursting neurons: what matters
+    in the network topology. Phys. Rev. Lett. 94(18): 188101, 2005.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+from .hr_batch import BACKENDS, _jit_parallel, _prange, batch_parameters, numba
+from .hr_sde import noise_cholesky
+
+
+def random_network(n_neurons, k, weight=1.0, symmetric=False, seed=None):
+    """
+    Sparse random connectivity: each neuron receives k inputs from other neurons drawn
+    uniformly (with replacement, duplicates merged, no self-connection).
+
+    Parameters:
+        n_neurons: number of neurons.
+        k: number of inputs per neuron.
+        weight: weight of each connection.
+        symmetric: make the matrix symmetric (gap junctions), the degrees are then about 2k.
+        seed: seed of the random generator.
+
+    Returns:
+        scipy.sparse.csr_matrix of shape (n_neurons, n_neurons), entry (i, j): connection from j to i.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(n_neurons), k)
+    cols = rng.integers(0, n_neurons - 1, size=n_neurons * k)
+    cols += cols >= rows   # --- skip the neuron itself
+    M = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_neurons, n_neurons))
+    if symmetric:
+        M = (M + M.T).tocsr()
+    M.sum_duplicates()
+    M.data[:] = weight
+    return M
+
+
+def _connectivity(matrix, n_neurons, name):
+    """
+    Returns a matrix as a float CSR matrix of shape (n_neurons, n_neurons) (None: no connection).
+    """
+    if matrix is None:
+        return sp.csr_matrix((n_neurons, n_neurons))
+    matrix = sp.csr_matrix(matrix, dtype=float)
+    if matrix.shape != (n_neurons, n_neurons):
+        raise ValueError(f"{name} must be of shape ({n_neurons}, {n_neurons}), but got {matrix.shape}.")
+    matrix.sum_duplicates()
+    return matrix
+
+
+# ___ NumPy backend _______________________________________________________________________________
+
+def _steps_numpy(P, S, dZ, h, gap, degree, synapses, coupling, threshold, crossing):
+    """
+    Euler-Maruyama steps of the network, S of shape (4, n) updated in place; crossing[k, i]:
+    fraction of step k at which x_i crosses the threshold upwards (0: no crossing).
+    """
+    a, c, d, I, x1, eps, s1, alpha, z0, b0 = P.T
+    g_gap, g_syn, E_syn, theta_syn, lambda_syn = coupling
+    x, y, z, b = S
+    for k in range(dZ.shape[0]):
+        current = I.copy()
+        if g_gap != 0:
+            current += g_gap * (gap @ x - degree * x)
+        if g_syn != 0:
+            current += g_syn * (E_syn - x) * (synapses @ (1 / (1 + np.exp(-lambda_syn * (x - theta_syn)))))
+        dx = c * (x - x**3 / 3 - y + z + current)
+        dy = (x**2 + d * x - b * y + a) / c
+        dz = eps * (-s1 * (x - x1) - (b - b0))
+        db = eps * (z - z0 + alpha * x)
+        x_new = x + h * dx
+        up = (x < threshold) & (x_new >= threshold)
+        crossing[k, up] = (threshold - x[up]) / (x_new[up] - x[up])
+        x[:] = x_new
+        y += h * dy
+        z += h * dz + dZ[k, :, 0]
+        b += h * db + dZ[k, :, 1]
+
+
+# ___ Numba backend _______________________________________________________________________________
+
+@_jit_parallel
+def _steps_numba(P, S, dZ, h, gap_ptr, gap_idx, gap_val, syn_ptr, syn_idx, syn_val, coupling, threshold,
+                 crossing):
+    """
+    Same as _steps_numpy, the CSR products being computed row by row (S_new: double buffer).
+    """
+    g_gap, g_syn, E_syn, theta_syn, lambda_syn = coupling
+    n = S.shape[1]
+    gate = np.empty(n)
+    S_new = np.empty_like(S)
+    for k in range(dZ.shape[0]):
+        if g_syn != 0:
+            for j in _prange(n):
+                gate[j] = 1 / (1 + np.exp(-lambda_syn * (S[0, j] - theta_syn)))
+        for i in _prange(n):
+            a, c, d, I, x1, eps, s1, alpha, z0, b0 = (P[i, 0], P[i, 1], P[i, 2], P[i, 3], P[i, 4],
+                                                      P[i, 5], P[i, 6], P[i, 7], P[i, 8], P[i, 9])
+            x, y, z, b = S[0, i], S[1, i], S[2, i], S[3, i]
+            current = I
+            if g_gap != 0:
+                total = 0.0
+                for q in range(gap_ptr[i], gap_ptr[i + 1]):
+                    total += gap_val[q] * (S[0, gap_idx[q]] - x)
+                current += g_gap * total
+            if g_syn != 0:
+                total = 0.0
+                for q in range(syn_ptr[i], syn_ptr[i + 1]):
+                    total += syn_val[q] * gate[syn_idx[q]]
+                current += g_syn * (E_syn - x) * total
+            x_new = x + h * c * (x - x * x * x / 3 - y + z + current)
+            S_new[0, i] = x_new
+            S_new[1, i] = y + h * (x * x + d * x - b * y + a) / c
+            S_new[2, i] = z + h * eps * (-s1 * (x - x1) - (b - b0)) + dZ[k, i, 0]
+            S_new[3, i] = b + h * eps * (z - z0 + alpha * x) + dZ[k, i, 1]
+            if x < threshold <= x_new:
+                crossing[k, i] = (threshold - x) / (x_new - x)
+        S[:, :] = S_new
+
+
+# ___ simulation __________________________________________________________________________________
+
+def simulate_hr_network(params, X0, T, N, gap=None, synapses=None, g_gap=0.0, g_syn=0.0, E_syn=2.0,
+                        theta_syn=-0.25, lambda_syn=10.0, sigma_z=0.75, sigma_b=0.75, rho=0.0, shared=0.0,
+                        threshold=0.0, t_transient=0.0, block_steps=100, ini_std=0.0, backend="numpy",
+                        seed=None):
+    """
+    Simulates a network of coupled extended HR neurons and records their spike times.
+
+    Parameters:
+        params: dict of parameters (see hr_model.hr_parameters), values may be scalars or
+            ndarrays of shape (n_neurons,), one value per neuron.
+        X0: initial condition, ndarray of shape (4,) or (n_neurons, 4).
+        T: final time.
+        N: number of time steps.
+        gap: sparse matrix of shape (n_neurons, n_neurons), gap-junction weights A (None: none).
+        synapses: sparse matrix of shape (n_neurons, n_neurons), synaptic weights W, entry
+            (i, j) from j to i (None: none). The number of neurons is given by gap, synapses
+            or X0.
+        g_gap, g_syn: electrical and chemical coupling strengths.
+        E_syn, theta_syn, lambda_syn: reversal potential, threshold and slope of the synapses.
+        sigma_z, sigma_b, rho: noise of (z, b) of each neuron (see hr_sde.simulate_hr_ensemble).
+        shared: correlation in [0, 1] between the noises of two neurons.
+        threshold: spike threshold of x.
+        t_transient: spikes before t_transient are not recorded.
+        block_steps: number of steps per block of noise and of spike extraction.
+        ini_std: standard deviation of a Gaussian perturbation of the initial conditions.
+        backend: "numpy" or "numba" (numba threads, see numba.set_num_threads).
+        seed: seed of the random generator.
+
+    Returns:
+        dict with
+            "neuron": int ndarray of shape (n_spikes,), index of the spiking neuron;
+            "time": ndarray of shape (n_spikes,), spike times (increasing);
+            "X": ndarray of shape (n_neurons, 4), final states.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, but got '{backend}'.")
+    if backend == "numba" and numba is None:
+        raise ImportError("backend='numba' needs the package numba (pip install numba).")
+    if not 0 <= shared <= 1:
+        raise ValueError(f"shared must be in [0, 1], but got {shared}.")
+
+    X0 = np.asarray(X0, dtype=float)
+    matrix = gap if gap is not None else synapses
+    n_neurons = matrix.shape[0] if matrix is not None else (X0.shape[0] if X0.ndim == 2 else 1)
+    P, X0 = batch_parameters(params, np.broadcast_to(X0, (n_neurons, 4)))
+    if P.shape[0] != n_neurons:
+        raise ValueError(f"The parameters must be scalars or of shape ({n_neurons},), but define {P.shape[0]} neurons.")
+    gap, synapses = _connectivity(gap, n_neurons, "gap"), _connectivity(synapses, n_neurons, "synapses")
+    coupling = np.array([g_gap, g_syn, E_syn, theta_syn, lambda_syn], dtype=float)
+
+    rng = np.random.default_rng(seed)
+    S = np.array(X0.T, order="C")
+    if ini_std > 0:
+        S += ini_std * rng.standard_normal(S.shape)
+    h = T / N
+    degree = np.asarray(gap.sum(axis=1)).ravel()
+    # --- noise increments of (z, b): eps L dW, dW = sqrt(h) (sqrt(1 - shared) xi_i + sqrt(shared) xi_0)
+    L = noise_cholesky(sigma_z, sigma_b, rho)
+    scale = np.sqrt(h) * P[:, 5, None]   # (n, 1)
+
+    neurons, times = [], []
+    for start in range(0, N, block_steps):
+        n_steps = min(block_steps, N - start)
+        xi = np.sqrt(1 - shared) * rng.standard_normal((n_steps, n_neurons, 2))
+        if shared > 0:
+            xi += np.sqrt(shared) * rng.standard_normal((n_steps, 1, 2))
+        dZ = scale * (xi @ L.T)
+        crossing = np.zeros((n_steps, n_neurons))
+        if backend == "numba":
+            _steps_numba(P, S, dZ, h, gap.indptr, gap.indices, gap.data, synapses.indptr, synapses.indices,
+                         synapses.data, coupling, threshold, crossing)
+        else:
+            _steps_numpy(P, S, dZ, h, gap, degree, synapses, coupling, threshold, crossing)
+
+        # --- spikes of the block, in time order
+        k, i = np.nonzero(crossing)
+        time = (start + k + crossing[k, i]) * h
+        keep = time >= t_transient
+        neurons.append(i[keep])
+        times.append(time[keep])
+
+    return {"neuron": np.concatenate(neurons), "time": np.concatenate(times), "X": S.T.copy()}
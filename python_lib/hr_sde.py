@@ -0,0 +1,256 @@
+"""
+Ensemble simulation of the extended Hindmarsh-Rose SDE
+
+The noise acts additively on the slow variables, as in `notebooks/1_lhb.ipynb` and
+`notebooks/1_lhb_correlated.ipynb`:
+
+    d(z, b) = f_(z,b)(X) dt + eps L dW,    L L^T = [[sigma_z^2,              rho sigma_z sigma_b],
+                                                    [rho sigma_z sigma_b,   sigma_b^2          ]]
+
+with W a standard 2D Brownian motion and rho the correlation coefficient between the noises
+on z and b (rho = 0: independent noises). The Cholesky factor L is computed once, and applied
+to whole blocks of standard normal variables.
+
+All R realizations are advanced together, one Euler-Maruyama step at a time, as arrays of
+shape (R, 4). Realizations are processed in chunks of at most `chunk_size` paths to bound the
+working memory, and chunks may be distributed over several processes. Each chunk draws its
+noise from its own stream spawned from a single `numpy.random.SeedSequence`, so the result
+only depends on `seed` and `chunk_size`, not on the number of processes.
+
+Instead of the recorded paths, simulate_hr_ensemble can return the result of a recorder
+(see recording.py) able to merge the results of several chunks, e.g. the spike and burst statistics of a BurstRecorder for ensembles
+too large to store.
+
+Variance reduction (see variance_reduction.py for the estimators):
+    - sampling="antithetic" or "sobol" (see sde.py) is applied within each chunk: with
+      "antithetic", realizations r and r + chunk/2 of a chunk are paired; with "sobol", each
+      chunk is an independent scrambling (randomized QMC), chunk_size should be a power of 2.
+    - common random numbers: simulate_hr_rho_sweep and simulate_hr_parameter_sweep drive
+      several systems (values of rho, parameter sets) by the same Brownian paths, so that
+      their differences are not blurred by independent noises. Separate calls with the same
+      seed, R, N and chunk_size also share their noise.
+"""
+
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .hr_model import COMPONENTS, hr_drift
+from .recording import StridedRecorder
+from .sde import sde_vectorized
+
+
+def noise_cholesky(sigma_z, sigma_b, rho=0.0):
+    """
+    Returns the lower Cholesky factor L, of shape (2, 2), of the covariance matrix
+    diag(sigma_z, sigma_b) @ [[1, rho], [rho, 1]] @ diag(sigma_z, sigma_b).
+
+    The closed form is also valid for fully correlated noises (|rho| = 1).
+    """
+    if not -1 <= rho <= 1:
+        raise ValueError(f"rho must be in [-1, 1], but got {rho}.")
+    return np.array([[sigma_z, 0.0],
+                     [rho * sigma_b, np.sqrt(1 - rho**2) * sigma_b]])
+
+
+def hr_diffusion_matrix(params, sigma_z, sigma_b, rho=0.0):
+    """
+    Returns the constant (additive) diffusion matrix of the HR SDE, of shape (4, 2).
+    """
+    G = np.zeros((4, 2))
+    G[2:, :] = params["eps"] * noise_cholesky(sigma_z, sigma_b, rho)
+    return G
+
+
+def _simulate_chunk(params, X0, T, N, G, indices, seed_seq, ini_std, record_every, recorder=None, sampling="mc"):
+    """
+    Euler-Maruyama integration of one chunk of realizations of K stacked HR systems
+    driven by the same Brownian motion.
+
+    Parameters:
+        X0: ndarray of shape (r, 4), initial conditions of the chunk.
+        G: ndarray of shape (4K, 2), diffusion matrices of the K systems, stacked.
+        indices: list of state indices to record.
+        seed_seq: numpy.random.SeedSequence of the chunk.
+        recorder: recorder of the K = 1 system (a copy is used), None: the components `indices`
+            are recorded every `record_every` steps.
+        sampling: sampling of the Brownian increments (see sde.sde_vectorized).
+
+    Returns:
+        ndarray of shape (len(indices), K, r, n_rec), recorded components, or the pair
+        (times, data) of the recorder.
+    """
+    rng = np.random.default_rng(seed_seq)
+    if ini_std > 0:
+        X0 = X0 + ini_std * rng.standard_normal(X0.shape)
+
+    r, K = X0.shape[0], G.shape[0] // 4
+    drift = np.empty((r, K, 4))
+
+    def f(t, X):
+        return hr_drift(X.reshape(r, K, 4), params, out=drift).reshape(r, 4 * K)
+
+    if recorder is not None:
+        return sde_vectorized(f, G, X0, T, N, noise="additive", rng=rng, record=copy.deepcopy(recorder),
+                              sampling=sampling)
+
+    components = [4 * k + i for k in range(K) for i in indices]
+    _, recorded = sde_vectorized(f, G, np.tile(X0, (1, K)), T, N, noise="additive", rng=rng,
+                                 record=StridedRecorder(every=record_every, components=components),
+                                 sampling=sampling)
+    recorded = recorded.reshape(r, -1, K, len(indices))
+    return np.transpose(recorded, (3, 2, 0, 1))
+
+
+def _simulate(params, X0, T, N, R, G, observables, record_every, chunk_size, n_jobs, seed, ini_std, recorder=None,
+              sampling="mc"):
+    """
+    Splits the R realizations in chunks, simulates them and gathers the recorded observables.
+
+    Returns:
+        t_vals: ndarray of shape (n_rec,).
+        paths: dict mapping each observable to an ndarray of shape (K, R, n_rec).
+    or, with a recorder, its times and its data combined over the chunks by recorder.merge
+    (the recorder of each chunk is prepared by recorder.split if it has one).
+    """
+    X0 = np.asarray(X0, dtype=float)
+    if X0.shape == (4,):
+        X0 = np.tile(X0, (R, 1))
+    if X0.shape != (R, 4):
+        raise ValueError(f"X0 must be of shape (4,) or ({R}, 4), but got {X0.shape}.")
+
+    unknown = [name for name in observables if name not in COMPONENTS]
+    if unknown:
+        raise ValueError(f"Unknown observables {unknown}, expected a subset of {COMPONENTS}.")
+    indices = [COMPONENTS.index(name) for name in observables]
+    if sampling == "antithetic" and (R % 2 or (R > chunk_size and chunk_size % 2)):
+        raise ValueError(f"Antithetic sampling needs even R and chunk_size, but got {R} and {chunk_size}.")
+
+    # --- one independent random stream per chunk
+    bounds = list(range(0, R, chunk_size)) + [R]
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(bounds) - 1)
+    if recorder is not None and len(bounds) > 2 and not hasattr(recorder, "merge"):
+        raise ValueError(f"The recorder {type(recorder).__name__} has no merge method, "
+                         f"but R = {R} is split in {len(bounds) - 1} chunks of {chunk_size}.")
+    if hasattr(recorder, "split"):
+        recorders = recorder.split(np.linspace(0, T, N + 1), X0, bounds)
+    else:
+        recorders = [recorder] * (len(bounds) - 1)
+    tasks = [
+        (params, X0[start:stop], T, N, G, indices, seed_seq, ini_std, record_every, chunk_recorder, sampling)
+        for start, stop, seed_seq, chunk_recorder in zip(bounds[:-1], bounds[1:], seed_seqs, recorders)
+    ]
+
+    if n_jobs == 1 or len(tasks) == 1:
+        chunks = [_simulate_chunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            chunks = list(executor.map(_simulate_chunk, *zip(*tasks)))
+
+    if recorder is not None:
+        return recorder.merge(chunks) if hasattr(recorder, "merge") else chunks[0]
+
+    recorded = np.concatenate(chunks, axis=2)
+    t_vals = np.linspace(0, T, N + 1)[::record_every]
+    paths = {name: recorded[i] for i, name in enumerate(observables)}
+    return t_vals, paths
+
+
+def simulate_hr_ensemble(params, X0, T, N, R, sigma_z=0.75, sigma_b=0.75, rho=0.0,
+                         observables=COMPONENTS, record_every=1, chunk_size=1000, n_jobs=1, seed=None,
+                         ini_std=0.0, recorder=None, sampling="mc"):
+    """
+    Simulates R independent realizations of the extended HR SDE (Euler-Maruyama scheme).
+
+    Parameters:
+        params: dict of model parameters (see hr_model.hr_parameters).
+        X0: initial condition, ndarray of shape (4,) or (R, 4).
+        T: final time.
+        N: number of time steps (N+1 time instants).
+        R: number of independent realizations.
+        sigma_z, sigma_b: noise intensities on the z and b components.
+        rho: correlation coefficient between the noises on z and b.
+        observables: components to return, subset of ("x", "y", "z", "b").
+        record_every: int, keep one time step out of `record_every` (the integration
+            still uses the time step T/N, memory scales with N/record_every).
+        chunk_size: maximal number of realizations advanced together.
+        n_jobs: number of worker processes (1: no multiprocessing).
+        seed: seed of the root SeedSequence (None: fresh entropy).
+        ini_std: standard deviation of a Gaussian perturbation of the initial condition.
+        recorder: recorder applied to the states of shape (chunk, 4) (see recording.py), e.g.
+            recording.BurstRecorder; it must have a `merge` method when R > chunk_size (all
+            the recorders of recording.py and density.py do); None: the observables are
+            recorded every `record_every` steps.
+        sampling: "mc", "antithetic" or "sobol", sampling of the Brownian increments in each
+            chunk (see the module documentation).
+
+    Returns:
+        t_vals: ndarray of shape (n_rec,), recorded time points (every `record_every` steps).
+        paths: dict mapping each observable to an ndarray of shape (R, n_rec).
+    or, with a recorder, the pair (times, data) of the recorder, the results of the chunks
+    being combined by recorder.merge (concatenated along the realizations, pooled for
+    recording.SummaryRecorder and density.DensityRecorder, written to a single file for
+    recording.MemmapRecorder).
+    """
+    G = hr_diffusion_matrix(params, sigma_z, sigma_b, rho)
+    if recorder is not None:
+        return _simulate(params, X0, T, N, R, G, observables, record_every,
+                         chunk_size, n_jobs, seed, ini_std, recorder, sampling)
+    t_vals, paths = _simulate(params, X0, T, N, R, G, observables, record_every,
+                              chunk_size, n_jobs, seed, ini_std, sampling=sampling)
+    return t_vals, {name: values[0] for name, values in paths.items()}
+
+
+def simulate_hr_rho_sweep(params, X0, T, N, R, rhos, sigma_z=0.75, sigma_b=0.75,
+                          observables=COMPONENTS, record_every=1, chunk_size=1000, n_jobs=1, seed=None,
+                          ini_std=0.0, sampling="mc"):
+    """
+    Simulates the extended HR SDE for several correlation coefficients rho at once.
+
+    The K = len(rhos) systems are stacked into a single state of dimension 4K driven by the
+    same 2D Brownian motion: the standard normal variables are drawn once per time step and
+    shared by all the values of rho (common random numbers), and the K Cholesky factors are
+    computed once and applied together in one matrix product per block of time steps.
+    Differences between the values of rho are therefore not blurred by independent noises.
+
+    Parameters:
+        rhos: sequence of correlation coefficients.
+        other parameters: see simulate_hr_ensemble.
+
+    Returns:
+        t_vals: ndarray of shape (n_rec,), recorded time points.
+        paths: dict mapping each observable to an ndarray of shape (len(rhos), R, n_rec).
+    """
+    G = np.concatenate([hr_diffusion_matrix(params, sigma_z, sigma_b, rho) for rho in rhos])
+    return _simulate(params, X0, T, N, R, G, observables, record_every,
+                     chunk_size, n_jobs, seed, ini_std, sampling=sampling)
+
+
+def simulate_hr_parameter_sweep(param_sets, X0, T, N, R, sigma_z=0.75, sigma_b=0.75, rho=0.0,
+                                observables=COMPONENTS, record_every=1, chunk_size=1000, n_jobs=1, seed=None,
+                                ini_std=0.0, sampling="mc"):
+    """
+    Simulates the extended HR SDE for several parameter sets with common random numbers.
+
+    As in simulate_hr_rho_sweep, the K = len(param_sets) systems are stacked and driven by the
+    same Brownian paths (and the same perturbed initial conditions), the parameters being
+    arrays of shape (K,) broadcast by hr_model.hr_drift.
+
+    Parameters:
+        param_sets: sequence of dicts of model parameters (see hr_model.hr_parameters), with
+            the same keys.
+        sigma_z, sigma_b, rho: scalars or sequences of length K, noise of each system.
+        other parameters: see simulate_hr_ensemble.
+
+    Returns:
+        t_vals: ndarray of shape (n_rec,), recorded time points.
+        paths: dict mapping each observable to an ndarray of shape (len(param_sets), R, n_rec).
+    """
+    K = len(param_sets)
+    params = {name: np.array([p[name] for p in param_sets], dtype=float) for name in param_sets[0]}
+    sigma_z, sigma_b, rho = (np.broadcast_to(np.asarray(value, dtype=float), (K,)) for value in (sigma_z, sigma_b, rho))
+    G = np.concatenate([hr_diffusion_matrix(dict(eps=params["eps"][k]), sigma_z[k], sigma_b[k], rho[k])
+                        for k in range(K)])
+    return _simulate(params, X0, T, N, R, G, observables, record_every,
+                     chunk_size, n_jobs, seed, ini_std, sampling=sampling)
@@ -0,0 +1,304 @@
+"""
+Bursting regime map of the extended HR model over a sweep of parameters
+
+Each point of the sweep (a set of values of s1, alpha, z0, b0, or of any other HR parameter)
+is simulated, deterministically or with the noise of hr_sde.py, and the x trace is analysed
+with the burst classifier of the ABF recordings (see spikes.py). Each point is labelled with
+a regime:
+
+    QUIESCENT      no spike
+    SPIKING        spikes but fewer than two bursts (tonic spiking)
+    SQUARE_WAVE    bursting, at least half of the bursts classified square-wave
+    PARABOLIC      bursting, at least half of the bursts classified parabolic
+    MIXED          bursting, neither type dominates
+    DIVERGED       the numerical solution blew up (time step too large for the parameters)
+
+The ABF classifier only separates square-wave and parabolic bursts: triangular bursting
+(TRIANG) is labelled square-wave or mixed, and should be told apart by the features
+(e.g. the number of spikes per burst).
+
+The points are processed in chunks, simulated together as one vectorized ensemble (one
+parameter set per realization) and possibly distributed over several processes. The result
+of each chunk is saved in the sweep directory as soon as it is available, so that an
+interrupted sweep is resumed by calling run_sweep again with the same arguments: only the
+missing chunks are computed. Each chunk has its own random stream spawned from `seed`, so a
+resumed sweep gives the same map as an uninterrupted one.
+
+Usage:
+    points = latin_hypercube_points({"s1": (0.005, 0.15), "b0": (0.3, 1.6)}, 10000, seed=1)
+    regime_map = run_sweep(points, "sweeps/s1_b0", regime="SW", n_jobs=8, seed=1)
+    regime_map["regime"].shape   # (10000,)
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy.stats import qmc
+
+from .hr_model import PARAMETERS, hr_drift, hr_initial_condition, hr_parameters
+from .recording import StridedRecorder
+from .sde import sde_vectorized
+from .spikes import ensemble_burst_statistics
+
+# ___ regimes _____________________________________________________________________________________
+
+QUIESCENT = 0
+SPIKING = 1
+SQUARE_WAVE = 2
+PARABOLIC = 3
+MIXED = 4
+DIVERGED = -1
+
+REGIME_NAMES = {QUIESCENT: "quiescent", SPIKING: "spiking", SQUARE_WAVE: "square wave",
+                PARABOLIC: "parabolic", MIXED: "mixed", DIVERGED: "diverged"}
+
+FEATURES = ("n_spikes", "n_bursts", "spikes_per_burst", "burst_duration", "burst_period",
+            "square_wave", "parabolic")
+
+# ___ sweep points ________________________________________________________________________________
+
+
+def check_names(names):
+    """
+    Checks that the swept parameters are HR parameters (see hr_model.PARAMETERS).
+
+    Parameters:
+        names: iterable of parameter names (e.g. the keys of the bounds).
+    """
+    unknown = [name for name in names if name not in PARAMETERS]
+    if unknown:
+        raise ValueError(f"Unknown parameters {unknown}, expected a subset of {PARAMETERS}.")
+
+
+def grid_points(bounds, n):
+    """
+    Regular grid of parameter values.
+
+    Parameters:
+        bounds: dict mapping parameter names to (low, high).
+        n: number of values per parameter, int or dict mapping the names to ints.
+
+    Returns:
+        dict mapping each parameter name to an ndarray of shape (P,), P = product of the n's.
+    """
+    check_names(bounds)
+    axes = [np.linspace(low, high, n[name] if isinstance(n, dict) else n) for name, (low, high) in bounds.items()]
+    mesh = np.meshgrid(*axes, indexing="ij")
+    return {name: values.ravel() for name, values in zip(bounds, mesh)}
+
+
+def latin_hypercube_points(bounds, n, seed=None):
+    """
+    Latin hypercube sample of parameter values (scipy.stats.qmc).
+
+    Parameters:
+        bounds: dict mapping parameter names to (low, high).
+        n: number of points.
+        seed: seed of the sampler.
+
+    Returns:
+        dict mapping each parameter name to an ndarray of shape (n,).
+    """
+    check_names(bounds)
+    sample = qmc.LatinHypercube(d=len(bounds), seed=seed).random(n)
+    low, high = np.array(list(bounds.values()), dtype=float).T
+    sample = qmc.scale(sample, low, high)
+    return {name: sample[:, i] for i, name in enumerate(bounds)}
+
+
+# ___ classification ______________________________________________________________________________
+
+def classify_regime(stats):
+    """
+    Returns the regime of a trace from its statistics (see spikes.burst_statistics), or the
+    ndarray of the regimes of R traces from their statistics (see spikes.ensemble_burst_statistics).
+    """
+    regimes = np.select([np.asarray(stats["n_spikes"]) == 0, np.asarray(stats["n_bursts"]) < 2,
+                         np.asarray(stats["square_wave"]) >= 0.5, np.asarray(stats["parabolic"]) >= 0.5],
+                        [QUIESCENT, SPIKING, SQUARE_WAVE, PARABOLIC], MIXED)
+    return int(regimes) if regimes.ndim == 0 else regimes
+
+
+# ___ simulation of a chunk _______________________________________________________________________
+
+def sweep_chunk(points, params, X0, T, dt, record_every, t_transient, sigma_z, sigma_b, n_realizations,
+                 seed_seq, analysis):
+    """
+    Simulates and classifies the points of one chunk (also used by calibration.py to simulate
+    the summaries of candidate parameters).
+
+    Parameters:
+        points: dict mapping the swept parameters to ndarrays of shape (P,).
+        other parameters: see run_sweep.
+
+    Returns:
+        features: ndarray of shape (P, len(FEATURES)), averaged over the realizations.
+        regimes: ndarray of shape (P,), most frequent regime among the realizations.
+    """
+    P = len(next(iter(points.values())))
+    R = P * n_realizations
+    p = dict(params)
+    p.update({name: np.repeat(values, n_realizations) for name, values in points.items()})
+    p = {name: np.broadcast_to(value, (R,)) for name, value in p.items()}
+
+    def f(t, X):
+        return hr_drift(X, p)
+
+    N = int(round(T / dt))
+    recorder = StridedRecorder(every=record_every, components=[0])
+    rng = np.random.default_rng(seed_seq)
+    with np.errstate(over="ignore", invalid="ignore"):   # diverging points are flagged below
+        if sigma_z == 0 and sigma_b == 0:
+            # --- deterministic: with a zero diffusion, SRA1 is Ralston's 2nd order Runge-Kutta scheme
+            t_vals, x = sde_vectorized(f, np.zeros((4, 1)), X0, T, N, R=R, noise="additive", rng=rng,
+                                       record=recorder, scheme="sra1")
+        else:
+            # --- independent noises on z and b, per-realization eps
+            D = np.zeros((R, 4))
+            D[:, 2], D[:, 3] = p["eps"] * sigma_z, p["eps"] * sigma_b
+            t_vals, x = sde_vectorized(f, lambda t, X: D, X0, T, N, R=R, noise="diagonal", rng=rng,
+                                       record=recorder)
+
+    kept = t_vals >= t_transient
+    t_vals, x = t_vals[kept], x[:, kept, 0]
+    finite = np.all(np.isfinite(x), axis=1)
+    stats = ensemble_burst_statistics(t_vals, np.where(finite[:, None], x, 0.0), **analysis)
+    features = np.column_stack([stats[name] for name in FEATURES])
+    features[~finite] = np.nan
+    regimes = np.where(finite, classify_regime(stats), DIVERGED)
+
+    # --- gathering of the realizations of each point
+    features = features.reshape(P, n_realizations, len(FEATURES))
+    codes = np.array(sorted(REGIME_NAMES))
+    counts = np.sum(regimes.reshape(P, n_realizations, 1) == codes, axis=1)
+    defined = np.sum(~np.isnan(features), axis=1)
+    mean_features = np.where(defined > 0, np.nansum(features, axis=1) / np.maximum(defined, 1), np.nan)
+    return mean_features, codes[np.argmax(counts, axis=1)]
+
+
+# ___ checkpointed sweep __________________________________________________________________________
+
+def save_npz(path, **arrays):
+    """
+    Writes a .npz file atomically (an interrupted write does not leave a truncated file).
+
+    Parameters:
+        path: str, output .npz file (replaced if it exists).
+        arrays: arrays saved under their keyword names (see numpy.savez).
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(temporary, path)
+
+
+def _check_sweep(directory, points, settings):
+    """
+    Saves the definition of the sweep, or checks that it matches the one found in `directory`.
+    """
+    path = os.path.join(directory, "sweep.npz")
+    names = np.array(list(points))
+    values = np.array(list(points.values()))
+    if os.path.exists(path):
+        with np.load(path) as saved:
+            if (list(saved["names"]) != list(names) or saved["values"].shape != values.shape
+                    or not np.array_equal(saved["values"], values) or str(saved["settings"]) != settings):
+                raise ValueError(f"{directory} contains a different sweep, use another directory.")
+    else:
+        save_npz(path, names=names, values=values, settings=np.array(settings))
+
+
+def run_sweep(points, directory, regime="SW", params=None, X0=None, T=3000.0, dt=0.01, record_every=10,
+              t_transient=500.0, sigma_z=0.0, sigma_b=0.0, n_realizations=1, height=0.0, isi_threshold=80.0,
+              min_spikes=2, chunk_size=100, n_jobs=1, seed=None):
+    """
+    Computes (or resumes) the regime map of a parameter sweep.
+
+    Parameters:
+        points: dict mapping the swept parameters to ndarrays of shape (P,)
+            (see grid_points and latin_hypercube_points).
+        directory: str, sweep directory (checkpoints and result), created if needed.
+        regime: base regime, gives the values of the parameters that are not swept
+            and the default initial condition (see hr_model.REGIMES).
+        params: dict of parameter values replacing those of the base regime.
+        X0: initial condition, ndarray of shape (4,) (None: that of the base regime).
+        T: final time.
+        dt: time step.
+        record_every: int, the trace is analysed every `record_every` time steps.
+        t_transient: the trace is analysed after this time.
+        sigma_z, sigma_b: noise intensities on z and b (both 0: deterministic simulation).
+        n_realizations: number of realizations per point (stochastic simulations).
+        height: spike detection threshold on x.
+        isi_threshold: maximal ISI within a burst (the intra-burst ISIs are below 60 and the
+            inter-burst intervals above 150 in the three reference regimes).
+        min_spikes: minimal number of spikes of a burst.
+        chunk_size: number of points simulated together.
+        n_jobs: number of worker processes (1: no multiprocessing).
+        seed: seed of the root SeedSequence (None: fresh entropy, the sweep cannot be resumed
+            reproducibly).
+
+    Returns:
+        dict with the swept parameters (ndarrays of shape (P,)), the FEATURES (ndarrays of
+        shape (P,), NaN when undefined) and "regime" (ndarray of shape (P,)); also saved in
+        `directory`/regime_map.npz.
+    """
+    check_names(points)
+    points = {name: np.asarray(values, dtype=float) for name, values in points.items()}
+    P = len(next(iter(points.values())))
+    if any(values.shape != (P,) for values in points.values()):
+        raise ValueError("All the swept parameters must be ndarrays of the same shape (P,).")
+    if n_realizations > 1 and sigma_z == 0 and sigma_b == 0:
+        raise ValueError("Several realizations per point need a stochastic simulation (sigma_z or sigma_b > 0).")
+
+    params = hr_parameters(regime, **(params or {}))
+    X0 = hr_initial_condition(regime) if X0 is None else np.asarray(X0, dtype=float)
+    analysis = {"height": height, "isi_threshold": isi_threshold, "min_spikes": min_spikes}
+    settings = repr((regime, sorted(params.items()), X0.tolist(), T, dt, record_every, t_transient,
+                     sigma_z, sigma_b, n_realizations, sorted(analysis.items()), chunk_size, seed))
+
+    os.makedirs(directory, exist_ok=True)
+    _check_sweep(directory, points, settings)
+
+    # --- chunks still to be computed
+    bounds = list(range(0, P, chunk_size)) + [P]
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(bounds) - 1)
+    chunk_paths = [os.path.join(directory, f"chunk_{i:06d}.npz") for i in range(len(bounds) - 1)]
+    tasks = {
+        i: ({name: values[start:stop] for name, values in points.items()}, params, X0, T, dt, record_every,
+            t_transient, sigma_z, sigma_b, n_realizations, seed_seqs[i], analysis)
+        for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))
+        if not os.path.exists(chunk_paths[i])
+    }
+
+    if n_jobs == 1 or len(tasks) <= 1:
+        for i, task in tasks.items():
+            features, regimes = sweep_chunk(*task)
+            save_npz(chunk_paths[i], features=features, regimes=regimes)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {executor.submit(sweep_chunk, *task): i for i, task in tasks.items()}
+            for future in as_completed(futures):
+                features, regimes = future.result()
+                save_npz(chunk_paths[futures[future]], features=features, regimes=regimes)
+
+    # --- regime map
+    features, regimes = [], []
+    for path in chunk_paths:
+        with np.load(path) as chunk:
+            features.append(chunk["features"])
+            regimes.append(chunk["regimes"])
+    features = np.concatenate(features)
+    regime_map = dict(points)
+    regime_map.update({name: features[:, i] for i, name in enumerate(FEATURES)})
+    regime_map["regime"] = np.concatenate(regimes)
+    save_npz(os.path.join(directory, "regime_map.npz"), **regime_map)
+    return regime_map
+
+
+def load_regime_map(directory):
+    """
+    Loads the regime map saved by run_sweep, as a dict of ndarrays.
+    """
+    with np.load(os.path.join(directory, "regime_map.npz")) as saved:
+        return {name: saved[name] for name in saved.files}
@@ -0,0 +1,276 @@
+"""
+Multilevel Monte Carlo estimation of expectations of the extended HR SDE
+
+E[P], with P a functional of a path (e.g. the number of bursts, the time spent in a region of
+the (z, b) plane), is written as a telescoping sum over Euler-Maruyama discretizations with
+time steps dt_l = dt0 / 2^l,
+
+    E[P_L] = E[P_0] + sum_{l=1}^L E[P_l - P_{l-1}],
+
+and each term is estimated with its own number of samples N_l (Giles, 2008). The fine path
+(dt_l) and the coarse path (dt_{l-1}) of a sample of level l are driven by the same Brownian
+path, each coarse increment being the sum of two fine ones, so that Var(P_l - P_{l-1}) decays
+with l and most samples are taken on the cheap coarse levels.
+
+mlmc_estimate follows the adaptive algorithm of Giles (2015): starting from levels 0..L_min
+with n_initial samples each, the sample numbers minimizing the cost for a variance rmse^2 / 2,
+
+    N_l = ceil(2 / rmse^2 sqrt(V_l / C_l) sum_k sqrt(V_k C_k)),
+
+are updated from the estimated variances V_l and costs C_l (time steps per sample), and a
+level is added until the estimated bias |E[P_L - P_{L-1}]| / (2^alpha - 1) is below
+rmse / sqrt(2) (alpha, beta: weak and variance rates fitted on the levels >= 1).
+
+The paths are recorded at the same times on all the levels (every `record_every` steps of
+level 0) and the functional is evaluated on these records, as dicts of arrays of shape
+(r, n_rec) like the output of hr_sde.simulate_hr_ensemble (BurstCount and OccupationTime, or
+any picklable callable payoff(t_rec, paths) -> (r,)). The samples of all the levels requested
+in a round are simulated in chunks of at most `chunk_size` coupled paths, distributed over
+n_jobs worker processes, each chunk with its own SeedSequence stream.
+
+Usage:
+    params = hr_parameters("SW")
+    result = mlmc_estimate(params, hr_initial_condition("SW"), T=500.0, payoff=BurstCount(),
+                           rmse=0.02, n_jobs=4, seed=1)
+    result["mean"], result["dt"], result["cost"] / result["single_level_cost"]
+
+Reference:
+    Giles, M. B. Multilevel Monte Carlo path simulation. Oper. Res. 56(3): 607-617, 2008.
+    Giles, M. B. Multilevel Monte Carlo methods. Acta Numer. 24: 259-328, 2015.
+"""
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .hr_model import COMPONENTS, hr_drift
+from .hr_sde import noise_cholesky
+from .spikes import simulation_statistics
+
+
+# ___ functionals of a path _______________________________________________________________________
+
+class BurstCount:
+    """
+    Number of bursts of x (see spikes.simulation_statistics, model units).
+    """
+
+    def __init__(self, height=0.0, isi_threshold=80.0, min_spikes=2):
+        self.height, self.isi_threshold, self.min_spikes = height, isi_threshold, min_spikes
+
+    def __call__(self, t_rec, paths):
+        return simulation_statistics(t_rec, paths, height=self.height, isi_threshold=self.isi_threshold,
+                                     min_spikes=self.min_spikes)["n_bursts"]
+
+
+class OccupationTime:
+    """
+    Time spent by (z, b) in the box z_range x b_range (None: no bound), from the records.
+    """
+
+    def __init__(self, z_range=None, b_range=None):
+        self.z_range = (-np.inf, np.inf) if z_range is None else z_range
+        self.b_range = (-np.inf, np.inf) if b_range is None else b_range
+
+    def __call__(self, t_rec, paths):
+        z, b = paths["z"][:, :-1], paths["b"][:, :-1]
+        inside = ((z >= self.z_range[0]) & (z <= self.z_range[1]) &
+                  (b >= self.b_range[0]) & (b <= self.b_range[1]))
+        return inside @ np.diff(t_rec)
+
+
+# ___ coupled paths _______________________________________________________________________________
+
+def _coupled_samples(params, X0, T, N0, level, n_samples, L, record_every, payoff, ini_std, seed_seq):
+    """
+    Simulates n_samples pairs of fine (T / (N0 2^level)) and coarse (twice larger) Euler paths
+    driven by the same Brownian increments.
+
+    Returns:
+        P_fine, P_coarse: ndarrays of shape (n_samples,), functional of the fine and coarse
+            paths (P_coarse = 0 on level 0).
+    """
+    rng = np.random.default_rng(seed_seq)
+    N = N0 * 2**level
+    h = T / N
+    every = record_every * 2**level   # --- in fine steps, the same record times on both paths
+    n_rec = N // every + 1
+    X_fine = np.tile(X0, (n_samples, 1))
+    if ini_std > 0:
+        X_fine += ini_std * rng.standard_normal(X_fine.shape)
+    X_coarse = X_fine.copy()
+    rec_fine = np.empty((n_samples, n_rec, 4))
+    rec_coarse = np.empty((n_samples, n_rec, 4)) if level > 0 else None
+    rec_fine[:, 0] = X_fine
+    if level > 0:
+        rec_coarse[:, 0] = X_coarse
+
+    block = max(2, (2**18 // (2 * n_samples)) // 2 * 2)   # --- even number of fine steps per block
+    k = 0
+    while k < N:
+        dW = np.sqrt(h) * rng.standard_normal((min(block, N - k), n_samples, 2)) @ L.T
+        for j in range(len(dW)):
+            X_fine = X_fine + h * hr_drift(X_fine, params)
+            X_fine[:, 2:] += dW[j]
+            if level > 0 and j % 2 == 1:
+                X_coarse = X_coarse + 2 * h * hr_drift(X_coarse, params)
+                X_coarse[:, 2:] += dW[j - 1] + dW[j]
+            k += 1
+            if k % every == 0:
+                rec_fine[:, k // every] = X_fine
+                if level > 0:
+                    rec_coarse[:, k // every] = X_coarse
+
+    if not (np.isfinite(X_fine).all() and np.isfinite(X_coarse).all()):
+        raise ValueError(f"Euler-Maruyama blow-up at time step {2 * h if level > 0 else h}, decrease dt0.")
+
+    t_rec = np.linspace(0, T, n_rec)
+
+    def evaluate(records):
+        return np.asarray(payoff(t_rec, {name: records[:, :, i] for i, name in enumerate(COMPONENTS)}), dtype=float)
+
+    return evaluate(rec_fine), evaluate(rec_coarse) if level > 0 else np.zeros(n_samples)
+
+
+# ___ estimator ___________________________________________________________________________________
+
+def _rate(values):
+    """
+    Decay rate r of values_l ~ 2^(-r l), fitted on the levels >= 1 (nan if fewer than two).
+    """
+    levels = np.arange(1, len(values))
+    values = np.abs(values[1:])
+    keep = values > 0
+    if keep.sum() < 2:
+        return np.nan
+    return -np.polyfit(levels[keep], np.log2(values[keep]), 1)[0]
+
+
+def mlmc_estimate(params, X0, T, payoff, rmse, dt0=0.008, sigma_z=0.75, sigma_b=0.75, rho=0.0, record_every=1,
+                  L_min=2, L_max=8, n_initial=100, alpha=None, beta=None, ini_std=0.0, chunk_size=100, n_jobs=1,
+                  seed=None):
+    """
+    Adaptive multilevel Monte Carlo estimate of E[payoff(path)] with a target root mean square error.
+
+    Parameters:
+        params: dict of model parameters (see hr_model.hr_parameters).
+        X0: ndarray of shape (4,), initial condition.
+        T: final time.
+        payoff: functional of the recorded paths, payoff(t_rec, paths) -> ndarray of shape (r,),
+            paths: dict mapping "x", "y", "z", "b" to ndarrays of shape (r, n_rec) (e.g.
+            BurstCount, OccupationTime; picklable if n_jobs > 1).
+        rmse: target root mean square error.
+        dt0: time step of level 0 (rounded so that T / dt0 is an integer), small enough for
+            the Euler-Maruyama scheme to be stable (the SW paths blow up at 0.016).
+        sigma_z, sigma_b, rho: noise of (z, b) (see hr_sde.simulate_hr_ensemble).
+        record_every: number of level-0 steps between two records.
+        L_min, L_max: minimal and maximal finest level.
+        n_initial: minimal number of samples of a new level.
+        alpha, beta: weak and variance convergence rates (None: fitted, at least 0.5).
+        ini_std: standard deviation of a Gaussian perturbation of the initial condition.
+        chunk_size: maximal number of coupled paths simulated together.
+        n_jobs: number of worker processes (1: no multiprocessing).
+        seed: seed of the root SeedSequence.
+
+    Returns:
+        dict with
+            "mean": estimate of E[P_L];
+            "dt": time step of the finest level L;
+            "n_samples", "means", "variances": ndarrays of shape (L+1,), per level, of
+                P_l - P_{l-1} (P_0 on level 0);
+            "costs": ndarray of shape (L+1,), time steps per sample of each level;
+            "cost": total number of time steps;
+            "single_level_cost": number of time steps of plain Monte Carlo at dt_L for the
+                same rmse (variance of P_L times its cost per sample, divided by rmse^2 / 2);
+            "alpha", "beta": convergence rates used;
+            "converged": False if L_max was reached before the bias test was satisfied, or if
+                a level has no samples.
+    """
+    N0 = max(1, int(round(T / dt0)))
+    if N0 % record_every:
+        raise ValueError(f"record_every = {record_every} must divide the {N0} steps of level 0.")
+    if not 0 <= L_min <= L_max:
+        raise ValueError(f"Expected 0 <= L_min <= L_max, but got L_min = {L_min} and L_max = {L_max}.")
+    X0 = np.asarray(X0, dtype=float)
+    L_noise = params["eps"] * noise_cholesky(sigma_z, sigma_b, rho)
+    root = np.random.SeedSequence(seed)
+
+    L = L_min
+    n_samples, sums = np.zeros(L + 1, dtype=int), np.zeros((L + 1, 4))   # sums of Y, Y^2, P_fine, P_fine^2
+    costs = N0 * 2.0**np.arange(L_max + 1) * np.r_[1.0, np.full(L_max, 1.5)]
+    todo = np.full(L + 1, n_initial)
+    converged = True
+
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    try:
+        while todo.sum() > 0:
+            # --- all the levels of the round together, in chunks
+            tasks = []
+            for level in np.flatnonzero(todo):
+                for start in range(0, todo[level], chunk_size):
+                    tasks.append((params, X0, T, N0, int(level), int(min(chunk_size, todo[level] - start)), L_noise,
+                                  record_every, payoff, ini_std, root.spawn(1)[0]))
+            if executor is None:
+                results = [_coupled_samples(*task) for task in tasks]
+            else:
+                results = list(executor.map(_coupled_samples, *zip(*tasks)))
+            for task, (P_fine, P_coarse) in zip(tasks, results):
+                level, Y = task[4], P_fine - P_coarse
+                n_samples[level] += len(Y)
+                sums[level] += Y.sum(), (Y**2).sum(), P_fine.sum(), (P_fine**2).sum()
+
+            means = sums[:, 0] / n_samples
+            variances = np.maximum(sums[:, 1] / n_samples - means**2, 0.0)
+            a = max(0.5, _rate(means)) if alpha is None else alpha
+            b = max(0.5, _rate(variances)) if beta is None else beta
+            a, b = (0.5 if np.isnan(a) else a), (0.5 if np.isnan(b) else b)
+            # --- variances of the deepest levels are noisy: not below the extrapolation
+            for level in range(2, L + 1):
+                variances[level] = max(variances[level], 0.5 * variances[level - 1] / 2**b)
+
+            C = costs[:L + 1]
+            optimal = np.ceil(2 / rmse**2 * np.sqrt(variances / C) * np.sum(np.sqrt(variances * C))).astype(int)
+            todo = np.maximum(0, optimal - n_samples)
+
+            # --- bias test once the sample numbers are (almost) reached
+            if np.all(todo <= 0.01 * n_samples):
+                tail = np.abs(means[-3:]) / 2.0**(a * np.arange(min(3, L + 1) - 1, -1, -1))
+                if tail.max() / (2**a - 1) > rmse / np.sqrt(2):
+                    if L == L_max:
+                        converged = False
+                        warnings.warn(f"MLMC: the bias test failed at L_max = {L_max}, the rmse may be above target.")
+                    else:
+                        L += 1
+                        variances = np.append(variances, variances[-1] / 2**b)
+                        n_samples, sums = np.append(n_samples, 0), np.vstack([sums, np.zeros(4)])
+                        C = costs[:L + 1]
+                        optimal = np.ceil(2 / rmse**2 * np.sqrt(variances / C)
+                                          * np.sum(np.sqrt(variances * C))).astype(int)
+                        todo = np.maximum(0, optimal - n_samples)
+                        # --- the extrapolated variance is 0 below levels of zero variance (integer payoffs)
+                        todo[L] = max(todo[L], n_initial)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if np.any(n_samples == 0):
+        converged = False
+        warnings.warn(f"MLMC: the levels {np.flatnonzero(n_samples == 0).tolist()} have no samples.")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums[:, 0] / n_samples
+        variances = np.maximum(sums[:, 1] / n_samples - means**2, 0.0)
+        fine_variance = max(sums[L, 3] / n_samples[L] - (sums[L, 2] / n_samples[L])**2, 0.0)
+    return {
+        "mean": means.sum(),
+        "dt": T / (N0 * 2**L),
+        "n_samples": n_samples,
+        "means": means,
+        "variances": variances,
+        "costs": costs[:L + 1],
+        "cost": float(n_samples @ costs[:L + 1]),
+        "single_level_cost": 2 / rmse**2 * fine_variance * N0 * 2.0**L,
+        "alpha": a,
+        "beta": b,
+        "converged": converged,
+    }
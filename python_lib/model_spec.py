@@ -0,0 +1,455 @@
+"""
+Declarative model specification compiled to fast right-hand side kernels
+
+A model is declared once, as equations (strings or SymPy expressions), parameters with their
+default values and an additive noise structure:
+
+    spec = ModelSpec(
+        "fitzhugh_nagumo", states=("v", "w"),
+        equations={"v": "v - v**3/3 - w + I", "w": "eps*(v + a - b*w)"},
+        parameters={"I": 0.5, "a": 0.7, "b": 0.8, "eps": 0.08, "sigma": 0.1},
+        noise={"v": "sigma"},
+    )
+    model = compile_model(spec)
+
+and compile_model generates, with SymPy (common subexpressions eliminated), the source of
+    drift(X, p)           vectorized NumPy right-hand side, X of shape (..., n);
+    jacobian(X, p)        analytic Jacobian matrix, of shape (..., n, n);
+    diffusion(p)          constant diffusion matrix, of shape (n, m);
+    drift_batch, euler_maruyama
+                          Numba kernels (one row of X per thread, numba.prange), when the
+                          optional package numba is installed.
+The source is written to `cache_dir` in a file named after a hash of the equations, imported
+as a module and reused by the next sessions (the Numba kernels are compiled with cache=True,
+so their machine code is cached next to it).
+
+The compiled model plugs into the existing integrators: CompiledModel.solve (solve_ivp with
+the analytic Jacobian, as hr_model.HRModel.solve) and CompiledModel.simulate (Euler-Maruyama,
+sde.sde_vectorized or the Numba kernel). HINDMARSH_ROSE reproduces hr_model.hr_drift and
+hr_sde.hr_diffusion_matrix; FITZHUGH_NAGUMO and MORRIS_LECAR are given as other examples.
+
+Usage:
+    model = compile_model(MORRIS_LECAR)
+    t_vals, X = model.simulate((-20.0, 0.1), T=1000, N=100000, R=1000, record_every=100,
+                               backend="numba", seed=1)
+"""
+
+import hashlib
+import importlib.util
+import keyword
+import os
+import sys
+import types
+
+import numpy as np
+import sympy
+from scipy.integrate import solve_ivp
+from sympy.printing.numpy import NumPyPrinter
+
+from .hr_model import HR_DEFAULTS, REGIMES
+from .recording import StridedRecorder
+from .sde import _initial_state, sde_vectorized
+
+try:
+    import numba
+except ImportError:   # optional, only needed by backend="numba"
+    numba = None
+
+BACKENDS = ("numpy", "numba")
+
+GENERATOR_VERSION = 1   # part of the hash: changing the generated code invalidates the cache
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                                 "pepyna", "models")
+
+
+# ___ specification _______________________________________________________________________________
+
+class ModelSpec:
+    """
+    Declarative definition of an SDE dX = f(X; p) dt + G(p) dW with additive noise.
+
+    Parameters:
+        name: str, name of the model (a valid identifier).
+        states: sequence of the names of the state components, in the order of X[..., i].
+        equations: dict mapping each state to its right-hand side (str or SymPy expression).
+        parameters: dict mapping the parameter names to their default values.
+        noise: dict mapping states to the coefficient of a Brownian motion (str or expression)
+            or to a sequence of coefficients, one per Brownian motion; the coefficients may
+            only depend on the parameters (None: no noise).
+        definitions: dict of auxiliary expressions (e.g. gating functions), usable in the
+            equations, the noise and the next definitions.
+    """
+
+    def __init__(self, name, states, equations, parameters, noise=None, definitions=None):
+        self.name = name
+        self.states = tuple(states)
+        self.parameters = dict(parameters)
+        names = (name,) + self.states + tuple(self.parameters) + tuple(definitions or {})
+        invalid = [item for item in names if not item.isidentifier() or keyword.iskeyword(item)
+                   or item.startswith("_") or item in ("numpy", "out")]
+        if invalid:
+            raise ValueError(f"Invalid names {invalid}: expected identifiers not starting with '_' (nor numpy, out).")
+        if len(set(self.states + tuple(self.parameters))) != len(self.states) + len(self.parameters):
+            raise ValueError("The states and the parameters must have distinct names.")
+
+        self.state_symbols = tuple(sympy.Symbol(state) for state in self.states)
+        self.parameter_symbols = tuple(sympy.Symbol(parameter) for parameter in self.parameters)
+        namespace = {symbol.name: symbol for symbol in self.state_symbols + self.parameter_symbols}
+        for key, expression in (definitions or {}).items():
+            namespace[key] = self._parse(expression, namespace, key)
+
+        missing = [state for state in self.states if state not in equations]
+        unknown = [state for state in equations if state not in self.states]
+        if missing or unknown:
+            raise ValueError(f"equations must give the right-hand side of each of {self.states}, "
+                             f"missing {missing}, unknown {unknown}.")
+        self.equations = tuple(self._parse(equations[state], namespace, state) for state in self.states)
+
+        noise = {state: (value,) if isinstance(value, (str, sympy.Basic, int, float)) else tuple(value)
+                 for state, value in (noise or {}).items()}
+        unknown = [state for state in noise if state not in self.states]
+        if unknown:
+            raise ValueError(f"Unknown noisy states {unknown}, expected a subset of {self.states}.")
+        m = max((len(value) for value in noise.values()), default=0)
+        self.noise = sympy.zeros(len(self.states), m)
+        for state, coefficients in noise.items():
+            for j, coefficient in enumerate(coefficients):
+                self.noise[self.states.index(state), j] = self._parse(coefficient, namespace, f"noise of {state}")
+        if self.noise.free_symbols & set(self.state_symbols):
+            raise ValueError("The noise coefficients may only depend on the parameters (additive noise).")
+
+    def _parse(self, expression, namespace, what):
+        expression = sympy.sympify(expression, locals=namespace)
+        unknown = expression.free_symbols - set(self.state_symbols + self.parameter_symbols)
+        if unknown:
+            raise ValueError(f"Unknown symbols {sorted(map(str, unknown))} in {what}.")
+        return expression
+
+    @property
+    def noise_dimension(self):
+        """
+        Number of Brownian motions.
+        """
+        return self.noise.shape[1]
+
+    @property
+    def key(self):
+        """
+        Hash of the equations, names and noise structure (not of the default values).
+        """
+        text = repr((GENERATOR_VERSION, self.name, self.states, tuple(self.parameters),
+                     tuple(map(sympy.srepr, self.equations)), sympy.srepr(self.noise)))
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+# ___ code generation _____________________________________________________________________________
+
+def _assignments(expressions, targets, indent, skip_zeros=False):
+    """
+    Lines computing the expressions (common subexpressions first) into the targets.
+    """
+    printer = NumPyPrinter()
+    temporaries, reduced = sympy.cse(list(expressions), symbols=sympy.numbered_symbols("_t"))
+    lines = [f"{symbol} = {printer.doprint(value)}" for symbol, value in temporaries]
+    lines += [f"{target} = {printer.doprint(value)}" for target, value in zip(targets, reduced)
+              if not (skip_zeros and value == 0)]
+    return "".join(" " * indent + line + "\n" for line in lines)
+
+
+def _unpack(names, source, indent, vector):
+    template = "{name} = {source}[..., {i}]" if vector else "{name} = {source}[{i}]"
+    return "".join(" " * indent + template.format(name=name, source=source, i=i) + "\n"
+                   for i, name in enumerate(names))
+
+
+def generate_source(spec, cache=True):
+    """
+    Source of the module of the compiled model (see the module docstring).
+
+    Parameters:
+        spec: ModelSpec.
+        cache: compile the Numba kernels with cache=True (needs a file on disk).
+
+    Returns:
+        str.
+    """
+    n, m = len(spec.states), spec.noise_dimension
+    parameters = tuple(spec.parameters)
+    jacobian = sympy.Matrix(spec.equations).jacobian(spec.state_symbols)
+    entries = [(i, j) for i in range(n) for j in range(n)]
+
+    unpack_p = "".join(f'    {name} = _p["{name}"]\n' for name in parameters)
+    return (
+        f'"""\nCompiled model {spec.name} (generated by python_lib.model_spec, do not edit).\n"""\n\n'
+        "import numpy\n\n"
+        "try:\n"
+        "    import numba\n"
+        f"    _jit = numba.njit(cache={cache})\n"
+        f"    _jit_parallel = numba.njit(parallel=True, cache={cache})\n"
+        "    _prange = numba.prange\n"
+        "except ImportError:\n"
+        "    numba = None\n\n"
+        "    def _jit(function):\n"
+        "        return function\n"
+        "    _jit_parallel = _jit\n"
+        "    _prange = range\n\n"
+        f"STATES = {spec.states!r}\n"
+        f"PARAMETERS = {parameters!r}\n\n\n"
+        # --- NumPy
+        "def drift(_X, _p, out=None):\n"
+        + _unpack(spec.states, "_X", 4, vector=True) + unpack_p +
+        "    if out is None:\n"
+        "        _shape = numpy.broadcast_shapes(_X.shape[:-1], *(numpy.shape(_p[_name]) for _name in PARAMETERS))\n"
+        f"        out = numpy.empty(_shape + ({n},))\n"
+        + _assignments(spec.equations, [f"out[..., {i}]" for i in range(n)], 4) +
+        "    return out\n\n\n"
+        "def jacobian(_X, _p, out=None):\n"
+        + _unpack(spec.states, "_X", 4, vector=True) + unpack_p +
+        "    if out is None:\n"
+        "        _shape = numpy.broadcast_shapes(_X.shape[:-1], *(numpy.shape(_p[_name]) for _name in PARAMETERS))\n"
+        f"        out = numpy.empty(_shape + ({n}, {n}))\n"
+        "    out[...] = 0.0\n"
+        + _assignments([jacobian[i, j] for i, j in entries], [f"out[..., {i}, {j}]" for i, j in entries], 4,
+                       skip_zeros=True) +
+        "    return out\n\n\n"
+        "def diffusion(_p):\n"
+        + unpack_p +
+        f"    out = numpy.zeros(({n}, {m}))\n"
+        + _assignments(list(spec.noise), [f"out[{i}, {j}]" for i in range(n) for j in range(m)], 4,
+                       skip_zeros=True) +
+        "    return out\n\n\n"
+        # --- Numba
+        "@_jit\n"
+        "def drift_scalar(_P, _S, out):\n"
+        + _unpack(spec.states, "_S", 4, vector=False) + _unpack(parameters, "_P", 4, vector=False)
+        + _assignments(spec.equations, [f"out[{i}]" for i in range(n)], 4) +
+        "\n\n"
+        "@_jit_parallel\n"
+        "def drift_batch(_P, _X, out):\n"
+        "    for _r in _prange(_X.shape[0]):\n"
+        "        drift_scalar(_P[_r], _X[_r], out[_r])\n\n\n"
+        "@_jit_parallel\n"
+        "def euler_maruyama(_P, _X, h, dW, G):\n"
+        "    for _r in _prange(_X.shape[0]):\n"
+        "        _p = _P[_r]\n"
+        f"        _s = _X[_r].copy()\n"
+        f"        _f = numpy.empty({n})\n"
+        "        for _k in range(dW.shape[0]):\n"
+        "            drift_scalar(_p, _s, _f)\n"
+        f"            for _i in range({n}):\n"
+        "                _value = _s[_i] + h * _f[_i]\n"
+        f"                for _j in range({m}):\n"
+        "                    _value += G[_i, _j] * dW[_k, _r, _j]\n"
+        "                _s[_i] = _value\n"
+        "        _X[_r] = _s\n"
+    )
+
+
+def _load(spec, cache_dir):
+    """
+    Imports the generated module from cache_dir (written if needed), or executes it in memory.
+    """
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, f"{spec.name}_{spec.key}.py")
+        try:
+            if not os.path.exists(path):
+                os.makedirs(cache_dir, exist_ok=True)
+                temporary = f"{path}.{os.getpid()}.tmp"
+                with open(temporary, "w") as file:
+                    file.write(generate_source(spec, cache=True))
+                os.replace(temporary, path)
+            module_spec = importlib.util.spec_from_file_location(f"_pepyna_model_{spec.name}_{spec.key}", path)
+            module = importlib.util.module_from_spec(module_spec)
+            sys.modules[module_spec.name] = module   # --- needed by the Numba cache to reload the kernels
+            module_spec.loader.exec_module(module)
+            return module
+        except OSError:   # read-only directory: no cache
+            pass
+    module = types.ModuleType(f"_pepyna_model_{spec.name}")
+    exec(compile(generate_source(spec, cache=False), f"<model {spec.name}>", "exec"), module.__dict__)
+    return module
+
+
+_compiled = {}
+
+
+def compile_model(spec, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Generates (or reloads) the kernels of a model.
+
+    Parameters:
+        spec: ModelSpec.
+        cache_dir: directory of the generated modules (None: generated in memory, nothing
+            written, the Numba kernels are compiled again in each session).
+
+    Returns:
+        CompiledModel.
+    """
+    index = (spec.key, cache_dir)
+    if index not in _compiled:
+        _compiled[index] = _load(spec, cache_dir)
+    return CompiledModel(spec, _compiled[index])
+
+
+# ___ compiled model ______________________________________________________________________________
+
+class CompiledModel:
+    """
+    Generated kernels of a ModelSpec (see compile_model).
+
+    Attributes:
+        spec: the ModelSpec.
+        drift(X, p, out=None): vectorized right-hand side, X of shape (..., n), p a complete
+            parameter dict (see params) whose values are scalars or arrays broadcastable to
+            X[..., 0].
+        jacobian(X, p, out=None): analytic Jacobian matrices, of shape (..., n, n).
+        diffusion(p): diffusion matrix, of shape (n, m).
+    """
+
+    def __init__(self, spec, module):
+        self.spec = spec
+        self.module = module
+        self.drift = module.drift
+        self.jacobian = module.jacobian
+        self.diffusion = module.diffusion
+
+    def params(self, params=None, **overrides):
+        """
+        Returns the complete parameter dict: the defaults of the spec, replaced by `params`
+        (dict) and `overrides`.
+        """
+        merged = dict(self.spec.parameters, **(params or {}), **overrides)
+        unknown = [name for name in merged if name not in self.spec.parameters]
+        if unknown:
+            raise ValueError(f"Unknown parameters {unknown}, expected a subset of {tuple(self.spec.parameters)}.")
+        return merged
+
+    def parameter_matrix(self, params=None, R=1):
+        """
+        Parameters as an ndarray of shape (R, k) in the order of the spec, as expected by the
+        Numba kernels (values: scalars or ndarrays of shape (R,)).
+        """
+        values = [np.asarray(value, dtype=float) for value in self.params(params).values()]
+        try:
+            return np.column_stack([np.broadcast_to(value, (R,)) for value in values])
+        except ValueError:
+            raise ValueError(f"The parameters should be scalars or of shape ({R},).") from None
+
+    def drift_numba(self, X, params=None):
+        """
+        Right-hand side of the states X of shape (R, n) by the parallel Numba kernel.
+        """
+        _require_numba()
+        X = np.ascontiguousarray(X, dtype=float)
+        out = np.empty_like(X)
+        self.module.drift_batch(self.parameter_matrix(params, len(X)), X, out)
+        return out
+
+    def solve(self, t_span, y0, params=None, method="LSODA", t_eval=None, rtol=1e-8, atol=1e-10, **kwargs):
+        """
+        Deterministic integration with `scipy.integrate.solve_ivp` (the noise is ignored),
+        the analytic Jacobian being passed to the implicit methods (see hr_model.HRModel.solve).
+        """
+        p = self.params(params)
+
+        def rhs(t, S):
+            return self.drift(S.T, p).T
+
+        if method in ("LSODA", "Radau", "BDF"):
+            kwargs.setdefault("jac", lambda t, S: self.jacobian(S, p))
+        return solve_ivp(rhs, t_span, np.asarray(y0, dtype=float), method=method, t_eval=t_eval, rtol=rtol,
+                         atol=atol, vectorized=True, **kwargs)
+
+    def simulate(self, X0, T, N, R=None, params=None, record_every=1, backend="numpy", seed=None):
+        """
+        Euler-Maruyama simulation of R realizations.
+
+        Parameters:
+            X0: initial condition, ndarray of shape (n,) or (R, n).
+            T, N: final time and number of time steps.
+            R: number of realizations (needed when X0 is of shape (n,), deduced from X0 when
+                of shape (R, n)).
+            params: dict of parameters replacing the defaults, values may be scalars or
+                ndarrays of shape (R,).
+            record_every: int, keep one time step out of `record_every`.
+            backend: "numpy" (sde.sde_vectorized) or "numba" (compiled kernel, parallel
+                over the realizations); both draw the same Brownian increments (time-major),
+                so the paths agree up to round-off.
+            seed: seed of the random generator.
+
+        Returns:
+            t_vals: ndarray of shape (n_rec,).
+            X_rec: ndarray of shape (R, n_rec, n).
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}, but got '{backend}'.")
+        p = self.params(params)
+        G = self.diffusion(p)
+        if G.shape[1] == 0:   # --- deterministic model
+            G = np.zeros((len(self.spec.states), 1))
+        rng = np.random.default_rng(seed)
+        # --- same checks of X0 and R for both backends
+        X = _initial_state(X0, R)
+
+        if backend == "numpy":
+            return sde_vectorized(lambda t, X: self.drift(X, p), G, X, T, N, noise="additive", rng=rng,
+                                  record=StridedRecorder(every=record_every))
+
+        _require_numba()
+        P, h = self.parameter_matrix(p, len(X)), T / N
+        recorder = StridedRecorder(every=record_every)
+        recorder.start(np.linspace(0, T, N + 1), X)
+        for k in range(0, N, record_every):
+            n_steps = min(record_every, N - k)
+            dW = np.sqrt(h) * rng.standard_normal((n_steps, X.shape[0], G.shape[1]))
+            self.module.euler_maruyama(P, X, h, dW, G)
+            recorder.record(k + n_steps, (k + n_steps) * h, X)
+        return recorder.result()
+
+
+def _require_numba():
+    if numba is None:
+        raise ImportError("backend='numba' needs the package numba (pip install numba).")
+
+
+# ___ models ______________________________________________________________________________________
+
+HINDMARSH_ROSE = ModelSpec(
+    "hindmarsh_rose",
+    states=("x", "y", "z", "b"),
+    equations={
+        "x": "c*(x - x**3/3 - y + z + I)",
+        "y": "(x**2 + d*x - b*y + a)/c",
+        "z": "eps*(-s1*(x - x1) - (b - b0))",
+        "b": "eps*(z - z0 + alpha*x)",
+    },
+    parameters=dict(HR_DEFAULTS, **REGIMES["SW"]["params"], sigma_z=0.75, sigma_b=0.75, rho=0.0),
+    noise={"z": ("eps*sigma_z", 0), "b": ("eps*rho*sigma_b", "eps*sqrt(1 - rho**2)*sigma_b")},
+)
+
+FITZHUGH_NAGUMO = ModelSpec(
+    "fitzhugh_nagumo",
+    states=("v", "w"),
+    equations={"v": "v - v**3/3 - w + I", "w": "eps*(v + a - b*w)"},
+    parameters={"I": 0.5, "a": 0.7, "b": 0.8, "eps": 0.08, "sigma": 0.1},
+    noise={"v": "sigma"},
+)
+
+# --- Morris-Lecar, Hopf regime of Rinzel and Ermentrout (1989), V in mV, t in ms
+MORRIS_LECAR = ModelSpec(
+    "morris_lecar",
+    states=("V", "w"),
+    equations={
+        "V": "(I - gL*(V - VL) - gCa*m_inf*(V - VCa) - gK*w*(V - VK))/C",
+        "w": "phi*(w_inf - w)/tau_w",
+    },
+    parameters={"I": 90.0, "C": 20.0, "gL": 2.0, "gCa": 4.4, "gK": 8.0, "VL": -60.0, "VCa": 120.0, "VK": -84.0,
+                "V1": -1.2, "V2": 18.0, "V3": 2.0, "V4": 30.0, "phi": 0.04, "sigma": 1.0},
+    noise={"V": "sigma"},
+    definitions={
+        "m_inf": "(1 + tanh((V - V1)/V2))/2",
+        "w_inf": "(1 + tanh((V - V3)/V4))/2",
+        "tau_w": "1/cosh((V - V3)/(2*V4))",
+    },
+)
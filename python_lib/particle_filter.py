@@ -0,0 +1,273 @@
+"""
+Particle filters for the hidden states of the extended HR model
+
+The membrane potential of a recording (ABF trace, in s and mV) is treated as a noisy
+observation of the x component of the extended HR SDE, and the unobserved states, in particular
+the slow variables (z, b), are estimated by sequential Monte Carlo:
+
+    X_{k}  = Phi(X_{k-1}) + G (W_{t_k} - W_{t_{k-1}}),
+    v_k    = v_offset + v_scale x_k + obs_std N(0, 1),
+
+where Phi is the deterministic flow over the time between two observations (explicit Euler
+steps of at most dt) and G the additive noise of hr_sde.py on (z, b) plus an optional
+model-error noise on x. The Brownian increment of the whole interval is added after the flow
+(Lie splitting of the Euler-Maruyama scheme): the noise only costs 3 normal variables per
+particle and observation, whatever the number of Euler steps.
+
+The model time is t / time_scale (time_scale: seconds per model time unit). The particles are
+propagated together as an array of shape (P, 4), by NumPy operations on the components
+(backend "numpy") or by a compiled loop over the particles in parallel threads (backend
+"numba", as hr_batch.py: on one core, 10^4 particles over 6 s of trace observed at 1 kHz
+take about 17 s). The weights are kept as log-weights and normalized with the log-sum-exp trick.
+
+Two filters are available:
+    "bootstrap"   propagation with the model, weighting by the likelihood, systematic
+                  resampling when the effective sample size (ESS) falls below
+                  ess_threshold * P;
+    "auxiliary"   (Pitt and Shephard) the particles are first resampled according to the
+                  likelihood of the noise-free prediction of their next state, then propagated
+                  and reweighted by the ratio of the likelihoods, which keeps more particles
+                  alive when the observations are informative (sharp spikes).
+
+Systematic resampling is O(P): the number of offspring of each particle is read from the
+cumulative weights and the ancestors are obtained with np.repeat.
+
+All the randomness of a filter can be supplied as one array of standard normal variables
+(random_numbers): the likelihood estimate is then a deterministic function of the parameters
+and of this array, which is what correlated pseudo-marginal MCMC needs (see pmmh.py). With
+sort_particles, the particles are sorted along x before each resampling, so that a small
+change of the random numbers or of the parameters only changes the resampled particles a little.
+
+Usage:
+    result = particle_filter(t, v, hr_parameters("SW"), hr_initial_condition("SW"),
+                             time_scale=0.01, v_scale=30.0, v_offset=-40.0, obs_std=2.0,
+                             obs_every=10, init_std=(0.2, 0.5, 0.1, 0.1), backend="numba", seed=1)
+    result["mean"][:, 2]   # filtered mean of z at the times result["t"]
+"""
+
+import numpy as np
+from scipy.special import ndtr
+
+from .hr_batch import BACKENDS, _jit_parallel, _prange, batch_parameters, numba
+from .hr_model import hr_drift
+from .hr_sde import noise_cholesky
+
+METHODS = ("bootstrap", "auxiliary")
+
+
+def systematic_resampling(weights, rng=None, offset=None):
+    """
+    Systematic resampling in O(P).
+
+    Parameters:
+        weights: ndarray of shape (P,), normalized weights.
+        rng: numpy.random.Generator, draws the offset when `offset` is None.
+        offset: float in [0, 1), offset of the regular grid of points (u + i) / P.
+
+    Returns:
+        ndarray of shape (P,), indices of the ancestors (sorted).
+    """
+    P = len(weights)
+    cumulative = np.cumsum(weights)
+    cumulative /= cumulative[-1]
+    # --- number of the points (u + i) / P below each cumulative weight
+    offset = rng.random() if offset is None else offset
+    below = np.clip(np.ceil(cumulative * P - offset), 0, P).astype(int)
+    below[-1] = P
+    return np.repeat(np.arange(P), np.diff(below, prepend=0))
+
+
+@_jit_parallel
+def _euler_flow_numba(p, X, h, n_steps, noise, G):
+    """
+    Explicit Euler steps of the deterministic HR model for each particle (row of X), followed
+    by the noise increment noise @ G (noise of shape (P, m) or (0, m): none), in place.
+    p: ndarray of shape (10,), parameters in the order of hr_model.PARAMETERS.
+    """
+    a, c, d, I, x1, eps, s1, alpha, z0, b0 = p
+    for i in _prange(X.shape[0]):
+        x, y, z, b = X[i, 0], X[i, 1], X[i, 2], X[i, 3]
+        for _ in range(n_steps):
+            dx = c * (x - x * x * x / 3 - y + z + I)
+            dy = (x * x + d * x - b * y + a) / c
+            dz = eps * (-s1 * (x - x1) - (b - b0))
+            db = eps * (z - z0 + alpha * x)
+            x, y, z, b = x + h * dx, y + h * dy, z + h * dz, b + h * db
+        X[i, 0], X[i, 1], X[i, 2], X[i, 3] = x, y, z, b
+        if noise.shape[0] > 0:
+            for j in range(4):
+                for l in range(G.shape[0]):
+                    X[i, j] += noise[i, l] * G[l, j]
+
+
+def _euler_flow_numpy(params, X, h, n_steps):
+    """
+    Explicit Euler steps of the deterministic HR model, on the components stored contiguously.
+    """
+    S = np.array(X.T, order="C")   # a copy, X is left unchanged
+    D = np.empty_like(S)
+    for _ in range(n_steps):
+        hr_drift(S.T, params, out=D.T)
+        S += h * D
+    return S.T
+
+
+def _log_normalize(log_weights):
+    """
+    Returns the normalized weights and the log of the sum of the weights.
+    """
+    top = np.max(log_weights)
+    weights = np.exp(log_weights - top)
+    total = weights.sum()
+    return weights / total, top + np.log(total)
+
+
+def particle_filter(t, v, params, X0, n_particles=10000, method="bootstrap", obs_every=1, time_scale=1.0,
+                    v_scale=1.0, v_offset=0.0, obs_std=0.1, dt=0.01, sigma_x=0.05, sigma_z=0.75, sigma_b=0.75,
+                    rho=0.0, init_std=0.0, ess_threshold=0.5, backend="numpy", seed=None, random_numbers=None,
+                    sort_particles=False):
+    """
+    Filters the states of the extended HR model from a voltage trace.
+
+    Parameters:
+        t: ndarray of shape (N,), regular sampling times of the trace (e.g. in s).
+        v: ndarray of shape (N,), membrane potential (e.g. in mV).
+        params: dict of model parameters (see hr_model.hr_parameters).
+        X0: initial state, ndarray of shape (4,) or (n_particles, 4).
+        n_particles: number of particles P.
+        method: "bootstrap" or "auxiliary".
+        obs_every: int, one sample of the trace out of `obs_every` is used.
+        time_scale: duration of one model time unit, in the unit of t.
+        v_scale, v_offset: observation of x, v = v_offset + v_scale x.
+        obs_std: standard deviation of the observation noise (unit of v).
+        dt: maximal time step of the propagation (model time).
+        sigma_x: intensity of the model-error noise on x (0: none).
+        sigma_z, sigma_b, rho: noise on (z, b) (see hr_sde.simulate_hr_ensemble).
+        init_std: float or ndarray of shape (4,), Gaussian spread of the initial particles.
+        ess_threshold: bootstrap filter, resampling when ESS < ess_threshold * P.
+        backend: "numpy" or "numba" (numba threads, see numba.set_num_threads).
+        seed: seed of the random generator.
+        random_numbers: ndarray of shape (n_obs + 1, n_particles, 4), standard normal variables
+            replacing the random generator: [0] spreads the initial particles, [k + 1, :, :3] is
+            the noise of the propagation to the observation k and ndtr([k + 1, 0, 3]) the
+            offset of the resampling at the observation k (independent of the initial spread).
+        sort_particles: sort the particles along x before resampling.
+
+    Returns:
+        dict with
+            "t": ndarray of shape (n_obs,), observation times;
+            "mean", "std": ndarrays of shape (n_obs, 4), filtered means and standard
+                deviations of (x, y, z, b);
+            "ess": ndarray of shape (n_obs,), effective sample size after weighting;
+            "log_likelihood": float, estimate of the log-likelihood of the observations;
+            "n_resampling": int, number of resampling steps.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, but got '{method}'.")
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, but got '{backend}'.")
+    if backend == "numba" and numba is None:
+        raise ImportError("backend='numba' needs the package numba (pip install numba).")
+    t = np.asarray(t, dtype=float)[::obs_every]
+    v = np.asarray(v, dtype=float)[::obs_every]
+    if len(t) != len(v):
+        raise ValueError(f"t and v must have the same length, but got {len(t)} and {len(v)}.")
+    interval = (t[-1] - t[0]) / (len(t) - 1) / time_scale if len(t) > 1 else 0.0
+    if len(t) > 2 and not np.allclose(np.diff(t) / time_scale, interval, rtol=1e-6, atol=0):
+        raise ValueError("The sampling times of the trace must be regular.")
+
+    rng = np.random.default_rng(seed)
+    P = n_particles
+    if random_numbers is not None and np.shape(random_numbers) != (len(t) + 1, P, 4):
+        raise ValueError(f"random_numbers must be of shape ({len(t) + 1}, {P}, 4), "
+                         f"but got {np.shape(random_numbers)}.")
+
+    def normals(k):
+        return rng.standard_normal((P, 3)) if random_numbers is None else random_numbers[k + 1, :, :3]
+
+    def resample(k, X, weights, *others):
+        offset = None if random_numbers is None else ndtr(random_numbers[k + 1, 0, 3])
+        if sort_particles:
+            order = np.argsort(X[:, 0], kind="stable")
+            X, weights, others = X[order], weights[order], [other[order] for other in others]
+        ancestors = systematic_resampling(weights, rng, offset)
+        return (X[ancestors], *(other[ancestors] for other in others))
+
+    n_sub = max(int(np.ceil(interval / dt)), 1)
+    h = interval / n_sub
+
+    # --- additive noise: model error on x, correlated noise on (z, b)
+    G = np.zeros((4, 3))
+    G[0, 0] = sigma_x
+    G[2:, 1:] = params["eps"] * noise_cholesky(sigma_z, sigma_b, rho)
+    G_interval = np.sqrt(interval) * G.T
+    p_vector = batch_parameters(params, np.zeros(4))[0][0]
+
+    X = np.array(np.broadcast_to(np.asarray(X0, dtype=float), (P, 4)))
+    X += np.asarray(init_std, dtype=float) * (rng.standard_normal((P, 4)) if random_numbers is None
+                                              else random_numbers[0])
+
+    no_noise = np.empty((0, 3))
+
+    def propagate(X, noise=None):
+        if backend == "numba":
+            X = np.array(X)
+            _euler_flow_numba(p_vector, X, h, n_sub, no_noise if noise is None else noise, G_interval)
+            return X
+        X = _euler_flow_numpy(params, X, h, n_sub)
+        if noise is not None:
+            X += noise @ G_interval
+        return X
+
+    log_norm = -np.log(obs_std * np.sqrt(2 * np.pi))
+
+    def log_likelihood(k, X):
+        return log_norm - 0.5 * ((v[k] - v_offset - v_scale * X[:, 0]) / obs_std) ** 2
+
+    n_obs = len(t)
+    mean = np.empty((n_obs, 4))
+    std = np.empty((n_obs, 4))
+    ess = np.empty(n_obs)
+    total_log_likelihood = 0.0
+    n_resampling = 0
+    log_weights = np.full(P, -np.log(P))
+
+    for k in range(n_obs):
+        if k > 0 and method == "auxiliary":
+            # --- first stage: resampling on the likelihood of the noise-free predictions
+            first = log_likelihood(k, propagate(X))
+            weights, log_first = _log_normalize(log_weights + first)
+            total_log_likelihood += log_first
+            X, first = resample(k, X, weights, first)
+            n_resampling += 1
+            X = propagate(X, normals(k))
+            log_weights = log_likelihood(k, X) - first
+            weights, log_second = _log_normalize(log_weights)
+            total_log_likelihood += log_second - np.log(P)
+            log_weights -= log_second
+        else:
+            if k > 0:
+                X = propagate(X, normals(k))
+            log_weights = log_weights + log_likelihood(k, X)
+            weights, log_total = _log_normalize(log_weights)
+            total_log_likelihood += log_total
+            log_weights -= log_total
+
+        # --- filtered moments, before any resampling
+        ess[k] = 1.0 / np.sum(weights**2)
+        mean[k] = weights @ X
+        std[k] = np.sqrt(np.maximum(weights @ (X - mean[k]) ** 2, 0.0))
+
+        if method == "bootstrap" and ess[k] < ess_threshold * P:
+            X, = resample(k, X, weights)
+            log_weights = np.full(P, -np.log(P))
+            n_resampling += 1
+
+    return {
+        "t": t,
+        "mean": mean,
+        "std": std,
+        "ess": ess,
+        "log_likelihood": float(total_log_likelihood),
+        "n_resampling": n_resampling,
+    }
@@ -0,0 +1,264 @@
+"""
+Particle marginal Metropolis-Hastings for the parameters of the extended HR SDE
+
+The parameters (e.g. s1, alpha, z0, b0 and the noise intensities sigma_z, sigma_b) are
+estimated from a voltage trace by a random-walk Metropolis-Hastings algorithm in which the
+likelihood is replaced by its particle filter estimate (particle_filter.py, Andrieu, Doucet
+and Holenstein, 2010). The prior is uniform in a box.
+
+Correlated pseudo-marginal (Deligiannidis, Doucet and Pitt, 2018): all the random numbers of
+the particle filter form one array u of standard normal variables, proposed together with
+the parameters as
+    u' = correlation u + sqrt(1 - correlation^2) N(0, I),
+which leaves N(0, I) invariant, so that the acceptance ratio is still the ratio of the
+likelihood estimates. With a correlation close to 1 the estimates at the current and proposed
+parameters share most of their noise and the chain mixes with far fewer particles
+(correlation = 0: standard PMMH, fresh random numbers at each proposal). The particles are
+sorted along x before resampling to keep the estimate continuous in u. The normal variables
+are drawn from a seed per chain and per iteration, so that u is never stored: it is rebuilt
+from the seeds of the accepted proposals when the chains are resumed.
+
+Several chains are run together: at each iteration the proposals of all the chains are
+evaluated in parallel worker processes, which receive the trace once. The chains (samples,
+log-likelihoods, seeds of the random numbers and states of the random generators) are checkpointed in a
+directory every `checkpoint_every` iterations, and run_pmmh called again with the same
+arguments resumes from the last checkpoint (and continues up to a larger n_iterations).
+
+Usage:
+    bounds = {"s1": (0.01, 0.2), "b0": (0.3, 1.0), "sigma_z": (0.1, 2.0)}
+    chains = run_pmmh(t, v, bounds, "pmmh/cell_209", filter_options={"time_scale": 0.01,
+                      "v_scale": 30.0, "v_offset": -40.0, "obs_std": 2.0, "obs_every": 20},
+                      n_chains=4, n_jobs=4, seed=1)
+    chains["samples"][:, 500:].reshape(-1, 3)   # posterior sample after burn-in
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .hr_model import PARAMETERS, hr_initial_condition, hr_parameters
+from .hr_sweep import save_npz
+from .particle_filter import particle_filter
+
+NOISE_PARAMETERS = ("sigma_x", "sigma_z", "sigma_b", "obs_std")
+INITIAL_DRAWS = 100   # maximal number of initial points drawn until a finite log-likelihood
+
+# ___ likelihood evaluations ______________________________________________________________________
+
+_data = {}
+
+
+def _init_worker(t, v):
+    """
+    Stores the trace in the worker process.
+    """
+    _data["t"], _data["v"] = t, v
+
+
+def _log_likelihood(theta, names, params, filter_options, u):
+    """
+    Particle filter estimate of the log-likelihood of the trace stored by _init_worker.
+    """
+    params, options = dict(params), dict(filter_options)
+    for name, value in zip(names, theta):
+        (options if name in NOISE_PARAMETERS else params)[name] = value
+    result = particle_filter(_data["t"], _data["v"], params, random_numbers=u, sort_particles=True, **options)
+    value = result["log_likelihood"]
+    return value if np.isfinite(value) else -np.inf
+
+
+# ___ random numbers of the filter _______________________________________________________________
+
+def _random_numbers(seed, shape):
+    """
+    Standard normal variables of the particle filter, drawn from their seed.
+    """
+    return np.random.default_rng(seed).standard_normal(shape, dtype=np.float32)
+
+
+def _correlated(u, seed, correlation):
+    """
+    Proposal correlation u + sqrt(1 - correlation^2) N(0, I), the innovation being drawn from its seed.
+    """
+    innovation = _random_numbers(seed, u.shape)
+    return (correlation * u + np.sqrt(1 - correlation**2) * innovation).astype(np.float32)
+
+
+# ___ checkpoints _________________________________________________________________________________
+
+def _save_checkpoint(path, settings, iteration, samples, log_likelihoods, accepted, seeds, theta, log_likelihood,
+                     initial_seeds, rngs):
+    states = json.dumps([rng.bit_generator.state for rng in rngs])
+    save_npz(path, settings=np.array(settings), iteration=iteration, samples=samples[:, :iteration],
+              log_likelihoods=log_likelihoods[:, :iteration], accepted=accepted[:, :iteration],
+              seeds=seeds[:, :iteration], theta=theta, log_likelihood=log_likelihood, initial_seeds=initial_seeds,
+              states=np.array(states))
+
+
+def _load_checkpoint(path, settings):
+    with np.load(path) as saved:
+        if str(saved["settings"]) != settings:
+            raise ValueError(f"{os.path.dirname(path)} contains other chains, use another directory.")
+        checkpoint = {name: saved[name] for name in saved.files if name not in ("settings", "states")}
+        checkpoint["states"] = json.loads(str(saved["states"]))
+    return checkpoint
+
+
+# ___ sampler _____________________________________________________________________________________
+
+def run_pmmh(t, v, bounds, directory, regime="SW", params=None, X0=None, n_iterations=1000, n_chains=4,
+             step=None, correlation=0.99, n_particles=256, filter_options=None, theta0=None, checkpoint_every=10,
+             n_jobs=1, seed=None):
+    """
+    Runs (or resumes) correlated pseudo-marginal Metropolis-Hastings chains.
+
+    Parameters:
+        t, v: ndarrays of shape (N,), the trace (see particle_filter.particle_filter).
+        bounds: dict mapping the estimated parameters (HR parameters or NOISE_PARAMETERS) to
+            (low, high), support of the uniform prior.
+        directory: str, directory of the checkpoints, created if needed.
+        regime, params: values of the parameters that are not estimated (see
+            hr_model.hr_parameters).
+        X0: initial state of the filter (None: that of the regime).
+        n_iterations: total number of iterations of each chain.
+        n_chains: number of chains.
+        step: float, dict or ndarray of shape (d,), standard deviations of the random walk
+            (None: 2% of the width of the prior).
+        correlation: correlation of the random numbers of successive proposals (0: standard PMMH).
+        n_particles: number of particles of the filter.
+        filter_options: other arguments of particle_filter.particle_filter (method,
+            obs_every, time_scale, v_scale, v_offset, obs_std, dt, sigma_x, ...).
+        theta0: ndarray of shape (d,) or (n_chains, d), initial parameters (None: drawn from
+            the prior). The initial random numbers (and parameters, when drawn from the prior)
+            are drawn again, up to INITIAL_DRAWS times, while the log-likelihood estimate is
+            not finite.
+        checkpoint_every: number of iterations between two checkpoints.
+        n_jobs: number of worker processes (1: no multiprocessing).
+        seed: seed of the root SeedSequence.
+
+    Returns:
+        dict with
+            "names": estimated parameters;
+            "samples": ndarray of shape (n_chains, n_iterations, d);
+            "log_likelihoods": ndarray of shape (n_chains, n_iterations), estimates at the samples;
+            "accepted": boolean ndarray of shape (n_chains, n_iterations);
+            "acceptance_rate": ndarray of shape (n_chains,).
+    """
+    names = list(bounds)
+    unknown = [name for name in names if name not in PARAMETERS + NOISE_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Unknown parameters {unknown}, expected a subset of {PARAMETERS + NOISE_PARAMETERS}.")
+    if not 0 <= correlation < 1:
+        raise ValueError(f"correlation must be in [0, 1), but got {correlation}.")
+    low, high = np.array(list(bounds.values()), dtype=float).T
+    d = len(names)
+    if step is None:
+        step = 0.02 * (high - low)
+    elif isinstance(step, dict):
+        step = np.array([step[name] for name in names], dtype=float)
+    step = np.broadcast_to(np.asarray(step, dtype=float), (d,))
+
+    t, v = np.asarray(t, dtype=float), np.asarray(v, dtype=float)
+    params = hr_parameters(regime, **(params or {}))
+    X0 = hr_initial_condition(regime) if X0 is None else np.asarray(X0, dtype=float)
+    filter_options = dict(filter_options or {}, X0=X0, n_particles=n_particles)
+    n_obs = len(t[::filter_options.get("obs_every", 1)])
+    shape = (n_chains, n_obs + 1, n_particles, 4)
+
+    fingerprint = hashlib.sha1(t.tobytes() + v.tobytes()).hexdigest()
+    settings = repr((names, low.tolist(), high.tolist(), sorted(params.items()), step.tolist(), correlation,
+                     sorted((name, np.asarray(value).tolist()) for name, value in filter_options.items()),
+                     n_chains, None if theta0 is None else np.asarray(theta0).tolist(), seed, fingerprint))
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "pmmh.npz")
+    samples = np.empty((n_chains, n_iterations, d))
+    log_likelihoods = np.empty((n_chains, n_iterations))
+    accepted = np.zeros((n_chains, n_iterations), dtype=bool)
+    seeds = np.zeros((n_chains, n_iterations), dtype=np.int64)
+    rngs = [np.random.default_rng(seed_seq) for seed_seq in np.random.SeedSequence(seed).spawn(n_chains)]
+
+    executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(t, v)) if n_jobs > 1 else None
+    if executor is None:
+        _init_worker(t, v)
+
+    def evaluate(thetas, us, chains):
+        tasks = [(thetas[c], names, params, filter_options, us[c]) for c in chains]
+        if executor is None:
+            return [_log_likelihood(*task) for task in tasks]
+        return list(executor.map(_log_likelihood, *zip(*tasks)))
+
+    try:
+        if os.path.exists(path):
+            checkpoint = _load_checkpoint(path, settings)
+            start = min(int(checkpoint["iteration"]), n_iterations)
+            samples[:, :start] = checkpoint["samples"][:, :start]
+            log_likelihoods[:, :start] = checkpoint["log_likelihoods"][:, :start]
+            accepted[:, :start] = checkpoint["accepted"][:, :start]
+            seeds[:, :start] = checkpoint["seeds"][:, :start]
+            theta, log_likelihood = checkpoint["theta"], checkpoint["log_likelihood"]
+            initial_seeds = checkpoint["initial_seeds"]
+            for rng, state in zip(rngs, checkpoint["states"]):
+                rng.bit_generator.state = state
+
+            # --- random numbers of the current states, rebuilt from the accepted proposals
+            u = np.array([_random_numbers(seed, shape[1:]) for seed in initial_seeds])
+            for i in range(start):
+                for c in np.flatnonzero(accepted[:, i]):
+                    u[c] = _correlated(u[c], seeds[c, i], correlation)
+        else:
+            start = 0
+            theta = np.empty((n_chains, d))
+            if theta0 is not None:
+                theta[:] = np.broadcast_to(np.asarray(theta0, dtype=float), (n_chains, d))
+            initial_seeds = np.zeros(n_chains, dtype=np.int64)
+            u = np.empty(shape, dtype=np.float32)
+            log_likelihood = np.full(n_chains, -np.inf)
+            for _ in range(INITIAL_DRAWS):
+                redraw = np.flatnonzero(~np.isfinite(log_likelihood))
+                if len(redraw) == 0:
+                    break
+                for c in redraw:
+                    if theta0 is None:
+                        theta[c] = low + (high - low) * rngs[c].random(d)
+                    initial_seeds[c] = rngs[c].integers(2**63)
+                    u[c] = _random_numbers(initial_seeds[c], shape[1:])
+                log_likelihood[redraw] = evaluate(theta, u, redraw)
+            if not np.all(np.isfinite(log_likelihood)):
+                raise ValueError(f"No finite log-likelihood in {INITIAL_DRAWS} initial draws of the chains "
+                                 f"{np.flatnonzero(~np.isfinite(log_likelihood)).tolist()}, check theta0 and "
+                                 f"filter_options.")
+
+        for i in range(start, n_iterations):
+            # --- joint proposal of the parameters and of the random numbers
+            proposal = theta + step * np.array([rng.standard_normal(d) for rng in rngs])
+            seeds[:, i] = [rng.integers(2**63) for rng in rngs]
+            u_proposal = np.array([_correlated(u[c], seeds[c, i], correlation) for c in range(n_chains)])
+            log_uniform = np.log([rng.random() for rng in rngs])
+
+            inside = np.flatnonzero(np.all((proposal >= low) & (proposal <= high), axis=1))
+            proposal_log_likelihood = np.full(n_chains, -np.inf)
+            proposal_log_likelihood[inside] = evaluate(proposal, u_proposal, inside)
+
+            accept = log_uniform < proposal_log_likelihood - log_likelihood
+            theta[accept], log_likelihood[accept], u[accept] = (proposal[accept], proposal_log_likelihood[accept],
+                                                                u_proposal[accept])
+            samples[:, i], log_likelihoods[:, i], accepted[:, i] = theta, log_likelihood, accept
+
+            if (i + 1) % checkpoint_every == 0 or i + 1 == n_iterations:
+                _save_checkpoint(path, settings, i + 1, samples, log_likelihoods, accepted, seeds, theta,
+                                 log_likelihood, initial_seeds, rngs)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return {
+        "names": names,
+        "samples": samples,
+        "log_likelihoods": log_likelihoods,
+        "accepted": accepted,
+        "acceptance_rate": accepted.mean(axis=1),
+    }
@@ -0,0 +1,378 @@
+"""
+Rare-event estimation for the extended HR SDE by adaptive multilevel splitting
+
+Small probabilities of noise-induced transitions (e.g. a PARB trajectory pushed across a
+bifurcation branch in the (z, b) plane) and the corresponding mean escape times are out of
+reach of plain Monte Carlo. Adaptive multilevel splitting (AMS, Cerou and Guyader, 2007)
+estimates
+
+    p = P(xi(X_t) reaches level_b before level_a and before T_max | X_0),
+
+where xi is a user-defined reaction coordinate (a function of the state, typically of (z, b),
+e.g. LinearCoordinate or RadialCoordinate), level_a delimits the starting set A (None: only
+the time horizon T_max) and level_b the target set B.
+
+n_replicas trajectories are simulated from X_0 until they reach A or B (or T_max). At each
+iteration, the replicas whose maximum of xi is among the k lowest are killed, and each is
+replaced by a copy of a surviving replica, branched at the first time the survivor exceeded
+that level and continued with fresh noise. After Q iterations,
+
+    p_hat = prod_q (1 - K_q / n_replicas) * (fraction of the replicas that reached B),
+
+with K_q >= k the number of killed replicas (ties included), an unbiased estimator (Brehier,
+Lelievre and Rousset, 2016). Only the states at which the running maximum of xi increases
+are stored (the branching points), not the whole paths.
+
+The killed replicas of an iteration are continued together, as one array advanced by
+Euler-Maruyama steps (noise eps L dW on (z, b), see hr_sde.py), in chunks of at most
+`chunk_size` replicas that may be distributed over several processes; each chunk draws its
+noise from its own SeedSequence stream, so the result does not depend on n_jobs. Killing k
+replicas per iteration (default 10%) keeps these batches large.
+
+With a starting set A, the mean escape time from A to B is estimated by
+    E[T_AB] = (1 / p - 1) E[T_loop] + E[T_reactive]
+(Lelievre and Lopes, 2019), with T_loop the duration of the excursions from X_0 back to A
+(first generation of replicas) and T_reactive that of the successful replicas; X_0 should
+then be a typical point of the boundary of A.
+
+splitting_efficiency compares AMS with brute-force Monte Carlo at equal cost (number of
+simulated time steps).
+
+Usage:
+    params = hr_parameters("PARB")
+    score = LinearCoordinate(weights=(0.0, -1.0), origin=(0.0, 1.369))   # decrease of b
+    result = ams_probability(params, hr_initial_condition("PARB"), score, level_b=0.15,
+                             T_max=100.0, sigma_z=0.5, sigma_b=0.5, n_replicas=200, seed=1)
+    result["probability"]   # about 1.5e-3, at about 1/50 of the cost of brute force
+                            # for the same variance (splitting_efficiency)
+
+References:
+    Cerou, F., & Guyader, A. Adaptive multilevel splitting for rare event analysis. Stoch.
+    Anal. Appl. 25(2): 417-443, 2007.
+    Brehier, C.-E., Lelievre, T., & Rousset, M. Analysis of adaptive multilevel splitting
+    algorithms in an idealized setting. ESAIM: PS 19: 361-394, 2015.
+    Lopes, L. J. S., & Lelievre, T. Analysis of the adaptive multilevel splitting method on
+    the isomerization of alanine dipeptide. J. Comput. Chem. 40(11): 1198-1208, 2019.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .hr_model import hr_drift
+from .hr_sde import noise_cholesky
+
+RUNNING, SUCCESS, FAILURE, TIMEOUT = 0, 1, 2, 3   # reached B / returned to A / reached T_max
+
+
+# ___ reaction coordinates ________________________________________________________________________
+
+class LinearCoordinate:
+    """
+    Reaction coordinate wz (z - z_origin) + wb (b - b_origin).
+
+    Parameters:
+        weights: (wz, wb).
+        origin: (z_origin, b_origin).
+    """
+
+    def __init__(self, weights=(1.0, 0.0), origin=(0.0, 0.0)):
+        self.weights = np.asarray(weights, dtype=float)
+        self.origin = np.asarray(origin, dtype=float)
+
+    def __call__(self, X):
+        return (X[..., 2:] - self.origin) @ self.weights
+
+
+class RadialCoordinate:
+    """
+    Reaction coordinate: distance of (z, b) to a center, ((z - zc)^2 / sz^2 + (b - bc)^2 / sb^2)^(1/2).
+
+    Parameters:
+        center: (zc, bc).
+        scales: (sz, sb).
+    """
+
+    def __init__(self, center, scales=(1.0, 1.0)):
+        self.center = np.asarray(center, dtype=float)
+        self.scales = np.asarray(scales, dtype=float)
+
+    def __call__(self, X):
+        return np.sqrt((((X[..., 2:] - self.center) / self.scales)**2).sum(axis=-1))
+
+
+# ___ simulation of replicas ______________________________________________________________________
+
+def _run(params, X0, t0, score, level_a, level_b, T_max, h, L, block_steps, seed_seq):
+    """
+    Euler-Maruyama simulation of replicas until they reach A, B or T_max.
+
+    Parameters:
+        X0: ndarray of shape (n, 4), initial states.
+        t0: ndarray of shape (n,), initial times.
+        L: ndarray of shape (2, 2), eps times the Cholesky factor of the noise of (z, b).
+
+    Returns:
+        records: list of n triples (times, states, scores), the states at which the running
+            maximum of the score increases (excluding the initial state).
+        status: int ndarray of shape (n,), SUCCESS, FAILURE or TIMEOUT.
+        t_end: ndarray of shape (n,), stopping times.
+        n_steps: total number of simulated time steps.
+    """
+    rng = np.random.default_rng(seed_seq)
+    n = len(X0)
+    X, t = np.array(X0, dtype=float), np.array(t0, dtype=float)
+    maximum = score(X)
+    status = np.full(n, RUNNING)
+    parts = [[] for _ in range(n)]
+    low = -np.inf if level_a is None else level_a
+    n_steps = 0
+
+    while True:
+        idx = np.flatnonzero(status == RUNNING)
+        if len(idx) == 0:
+            break
+        m = len(idx)
+        # --- a whole block for all the running replicas, the steps after a stop are discarded
+        dZ = np.sqrt(h) * rng.standard_normal((block_steps, m, 2)) @ L.T
+        states = np.empty((block_steps, m, 4))
+        S, time = X[idx], t[idx]
+        for k in range(block_steps):
+            S = S + h * hr_drift(S, params)
+            S[:, 2:] += dZ[k]
+            states[k] = S
+        times = time + h * np.arange(1, block_steps + 1)[:, None]   # (block_steps, m)
+        scores = score(states)
+
+        stop = (scores >= level_b) | (scores <= low) | (times >= T_max - 0.5 * h)
+        stopped = stop.any(axis=0)
+        last = np.where(stopped, stop.argmax(axis=0), block_steps - 1)
+        valid = np.arange(block_steps)[:, None] <= last
+        n_steps += int(valid.sum())
+
+        # --- new maxima of the score (branching points), grouped by replica in time order
+        previous = np.maximum.accumulate(np.vstack([maximum[idx], scores]), axis=0)[:-1]
+        k_new, j_new = np.nonzero((scores > previous) & valid)
+        order = np.lexsort((k_new, j_new))
+        k_new, j_new = k_new[order], j_new[order]
+        splits = np.searchsorted(j_new, np.arange(1, m))
+        for j, ks in zip(range(m), np.split(k_new, splits)):
+            if len(ks):
+                parts[idx[j]].append((times[ks, j], states[ks, j], scores[ks, j]))
+
+        columns = np.arange(m)
+        X[idx], t[idx] = states[last, columns], times[last, columns]
+        maximum[idx] = np.maximum(maximum[idx], np.where(valid, scores, -np.inf).max(axis=0))
+        end = scores[last, columns]
+        status[idx[stopped]] = np.where(end[stopped] >= level_b, SUCCESS,
+                                        np.where(end[stopped] <= low, FAILURE, TIMEOUT))
+
+    records = []
+    for replica in parts:
+        if replica:
+            records.append(tuple(np.concatenate(values) for values in zip(*replica)))
+        else:
+            records.append((np.empty(0), np.empty((0, 4)), np.empty(0)))
+    return records, status, t, n_steps
+
+
+def _run_chunks(executor, params, X0, t0, score, level_a, level_b, T_max, h, L, block_steps, chunk_size,
+                seed_seq):
+    """
+    Splits the replicas in chunks (one random stream each), simulates them and gathers the results.
+    """
+    bounds = list(range(0, len(X0), chunk_size)) + [len(X0)]
+    tasks = [(params, X0[start:stop], t0[start:stop], score, level_a, level_b, T_max, h, L, block_steps, child)
+             for start, stop, child in zip(bounds[:-1], bounds[1:], seed_seq.spawn(len(bounds) - 1))]
+    if executor is None or len(tasks) == 1:
+        chunks = [_run(*task) for task in tasks]
+    else:
+        chunks = list(executor.map(_run, *zip(*tasks)))
+    records = [record for chunk in chunks for record in chunk[0]]
+    return (records, np.concatenate([chunk[1] for chunk in chunks]), np.concatenate([chunk[2] for chunk in chunks]),
+            sum(chunk[3] for chunk in chunks))
+
+
+def _check_levels(score, X0, level_a, level_b):
+    s0 = float(score(np.asarray(X0, dtype=float)))
+    if level_a is not None and not level_a < s0:
+        raise ValueError(f"The initial score {s0} must be above level_a = {level_a}.")
+    if not s0 < level_b:
+        raise ValueError(f"The initial score {s0} must be below level_b = {level_b}.")
+    return s0
+
+
+# ___ estimators __________________________________________________________________________________
+
+def ams_probability(params, X0, score, level_b, level_a=None, T_max=np.inf, dt=0.005, sigma_z=0.75,
+                    sigma_b=0.75, rho=0.0, n_replicas=1000, k=None, block_steps=100, max_iterations=100000,
+                    chunk_size=1000, n_jobs=1, seed=None):
+    """
+    Adaptive multilevel splitting estimate of the probability that the reaction coordinate
+    reaches level_b before level_a and before T_max.
+
+    Parameters:
+        params: dict of model parameters (see hr_model.hr_parameters).
+        X0: ndarray of shape (4,), initial state.
+        score: reaction coordinate, callable mapping states of shape (..., 4) to scores of
+            shape (...) (picklable if n_jobs > 1, e.g. LinearCoordinate or RadialCoordinate).
+        level_b: level defining the target set B = {score >= level_b}.
+        level_a: level defining the starting set A = {score <= level_a} (None: no starting set,
+            T_max must then be finite).
+        T_max: time horizon.
+        dt: time step of the Euler-Maruyama scheme.
+        sigma_z, sigma_b, rho: noise of (z, b) (see hr_sde.simulate_hr_ensemble).
+        n_replicas: number of replicas.
+        k: minimal number of replicas killed per iteration (None: 10% of n_replicas).
+        block_steps: number of time steps per block of noise.
+        max_iterations: maximal number of iterations.
+        chunk_size: maximal number of replicas simulated together.
+        n_jobs: number of worker processes (1: no multiprocessing).
+        seed: seed of the root SeedSequence.
+
+    Returns:
+        dict with
+            "probability": estimate of p;
+            "n_iterations": number of iterations;
+            "levels": ndarray of shape (n_iterations,), successive killing levels;
+            "n_steps": total number of simulated time steps (cost);
+            "reactive_times": ndarray, hitting times of B of the successful final replicas;
+            "mean_loop_time": mean duration of the first-generation excursions back to A
+                (nan without starting set);
+            "mean_escape_time": estimate of the mean escape time from A to B (nan without
+                starting set or if p = 0).
+    """
+    if level_a is None and not np.isfinite(T_max):
+        raise ValueError("Without starting set (level_a=None), T_max must be finite.")
+    k = max(1, n_replicas // 10) if k is None else k
+    if not 1 <= k < n_replicas:
+        raise ValueError(f"k must be in [1, {n_replicas - 1}], but got {k}.")
+    _check_levels(score, X0, level_a, level_b)
+
+    L = params["eps"] * noise_cholesky(sigma_z, sigma_b, rho)
+    seed_seq = np.random.SeedSequence(seed)
+    rng = np.random.default_rng(seed_seq.spawn(1)[0])
+    X0 = np.tile(np.asarray(X0, dtype=float), (n_replicas, 1))
+    start_score = float(score(X0[0]))
+    options = (score, level_a, level_b, T_max, dt, L, block_steps, chunk_size)
+
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    try:
+        records, status, t_end, n_steps = _run_chunks(executor, params, X0, np.zeros(n_replicas), *options,
+                                                      seed_seq.spawn(1)[0])
+        loops = t_end[status == FAILURE]
+        weight, levels = 1.0, []
+        while True:
+            maxima = np.array([scores[-1] if len(scores) else start_score for _, _, scores in records])
+            level = np.partition(maxima, k - 1)[k - 1]
+            if level >= level_b:
+                break
+            killed, survivors = np.flatnonzero(maxima <= level), np.flatnonzero(maxima > level)
+            if len(survivors) == 0 or len(levels) >= max_iterations:
+                weight = 0.0 if len(survivors) == 0 else weight
+                break
+            weight *= 1 - len(killed) / n_replicas
+            levels.append(level)
+
+            # --- branch each killed replica from a survivor, at its first score above the level
+            parents = rng.choice(survivors, len(killed))
+            branch = [np.searchsorted(records[p][2], level, side="right") for p in parents]
+            starts = np.array([records[p][1][j] for p, j in zip(parents, branch)])
+            t0 = np.array([records[p][0][j] for p, j in zip(parents, branch)])
+            new_records, new_status, new_t_end, steps = _run_chunks(executor, params, starts, t0, *options,
+                                                                    seed_seq.spawn(1)[0])
+            n_steps += steps
+            for i, p, j, record in zip(killed, parents, branch, new_records):
+                records[i] = tuple(np.concatenate([old[:j + 1], new]) for old, new in zip(records[p], record))
+            status[killed], t_end[killed] = new_status, new_t_end
+        if len(levels) >= max_iterations:
+            raise RuntimeError(f"AMS did not reach level_b in {max_iterations} iterations.")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    success = status == SUCCESS
+    probability = weight * success.mean()
+    mean_loop_time = loops.mean() if level_a is not None and len(loops) else np.nan
+    reactive_times = t_end[success]
+    if probability > 0 and np.isfinite(mean_loop_time):
+        mean_escape_time = (1 / probability - 1) * mean_loop_time + reactive_times.mean()
+    else:
+        mean_escape_time = np.nan
+    return {
+        "probability": probability,
+        "n_iterations": len(levels),
+        "levels": np.array(levels),
+        "n_steps": n_steps,
+        "reactive_times": reactive_times,
+        "mean_loop_time": mean_loop_time,
+        "mean_escape_time": mean_escape_time,
+    }
+
+
+def brute_force_probability(params, X0, score, level_b, level_a=None, T_max=np.inf, dt=0.005, sigma_z=0.75,
+                            sigma_b=0.75, rho=0.0, n_samples=1000, block_steps=100, chunk_size=1000, n_jobs=1,
+                            seed=None):
+    """
+    Plain Monte Carlo estimate of the probability of ams_probability (same parameters).
+
+    Returns:
+        dict with "probability", "std" (standard error), "n_steps" (cost) and "hitting_times"
+        (hitting times of B of the successful samples).
+    """
+    if level_a is None and not np.isfinite(T_max):
+        raise ValueError("Without starting set (level_a=None), T_max must be finite.")
+    _check_levels(score, X0, level_a, level_b)
+    L = params["eps"] * noise_cholesky(sigma_z, sigma_b, rho)
+    X0 = np.tile(np.asarray(X0, dtype=float), (n_samples, 1))
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    try:
+        _, status, t_end, n_steps = _run_chunks(executor, params, X0, np.zeros(n_samples), score, level_a, level_b,
+                                                T_max, dt, L, block_steps, chunk_size, np.random.SeedSequence(seed))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    success = status == SUCCESS
+    p = success.mean()
+    return {"probability": p, "std": np.sqrt(p * (1 - p) / n_samples), "n_steps": n_steps,
+            "hitting_times": t_end[success]}
+
+
+def splitting_efficiency(params, X0, score, level_b, n_runs=10, n_brute=1000, seed=None, **options):
+    """
+    Compares AMS with brute-force Monte Carlo at equal cost.
+
+    The variance of the brute-force estimator per simulated time step is p (1 - p) times the
+    mean cost of one sample (measured on n_brute samples, p from AMS), that of AMS is
+    estimated from n_runs independent runs.
+
+    Parameters:
+        params, X0, score, level_b: see ams_probability.
+        n_runs: number of independent AMS runs.
+        n_brute: number of brute-force samples (cost per sample).
+        seed: seed of the root SeedSequence.
+        options: other arguments of ams_probability (those not accepted by
+            brute_force_probability are ignored for it).
+
+    Returns:
+        dict with "probability" (mean of the AMS estimates), "relative_std" (of one AMS run),
+        "ams_steps" (mean cost of one AMS run), "brute_force_steps" (number of time steps
+        for brute force to reach the same variance) and "variance_reduction" (ratio of the
+        costs at equal variance).
+    """
+    seeds = np.random.SeedSequence(seed).spawn(n_runs + 1)
+    runs = [ams_probability(params, X0, score, level_b, seed=child, **options) for child in seeds[:n_runs]]
+    estimates = np.array([run["probability"] for run in runs])
+    cost = np.mean([run["n_steps"] for run in runs])
+    brute_options = {name: value for name, value in options.items() if name not in ("n_replicas", "k", "max_iterations")}
+    brute = brute_force_probability(params, X0, score, level_b, n_samples=n_brute, seed=seeds[-1], **brute_options)
+
+    p, variance = estimates.mean(), estimates.var(ddof=1)
+    brute_steps = p * (1 - p) / variance * brute["n_steps"] / n_brute if variance > 0 else np.inf
+    return {
+        "probability": p,
+        "relative_std": np.sqrt(variance) / p if p > 0 else np.nan,
+        "ams_steps": cost,
+        "brute_force_steps": brute_steps,
+        "variance_reduction": brute_steps / cost,
+    }
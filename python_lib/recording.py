@@ -0,0 +1,474 @@
+"""
+Recording policies for the SDE integrators
+
+The integrators step at a fine time step dt but only hand the state to a recorder, so that
+the memory scales with the output resolution instead of the number of time steps (for
+R = 1000, N = 1e6 and n = 4, storing every step takes 32 GB).
+
+A recorder is called as:
+    recorder.start(t_vals, X0)    once, with the time grid (N+1,) and the initial state (R, n)
+    recorder.record(k, t, X)      after each time step k = 1:N, with the state (R, n)
+    recorder.result()             at the end, returns a pair (times, data)
+
+Ensembles simulated in chunks of realizations (hr_sde.simulate_hr_ensemble) run one copy of
+the recorder per chunk and gather the results of the chunks with
+    recorder.merge(results)       list of the (times, data) of the chunks, in order
+and, for recorders with shared output (MemmapRecorder), prepare the copies with
+    recorder.split(t_vals, X0, bounds)    one recorder per chunk bounds[i]:bounds[i+1]
+
+Available policies:
+    FullRecorder       every time step (default of sde.sde_vectorized)
+    StridedRecorder    every k-th time step, optionally only some components
+    SummaryRecorder    running summaries only (per-path and ensemble statistics)
+    MemmapRecorder     every k-th time step, streamed to a .npy file on disk
+    BurstRecorder      online spike and burst statistics of one component (no trajectory)
+"""
+
+import copy
+
+import numpy as np
+
+from .spikes import OTHER, PARABOLIC, SQUARE_WAVE
+
+
+class StridedRecorder:
+    """
+    Stores the time steps 0, every, 2*every, ... of the selected components.
+
+    Parameters:
+        every: int, keep one time step out of `every`.
+        components: indices of the state components to keep (None: all).
+
+    Result:
+        times: ndarray of shape (n_rec,).
+        X_rec: ndarray of shape (R, n_rec, m), m = number of kept components.
+    """
+
+    def __init__(self, every=1, components=None):
+        if every < 1:
+            raise ValueError(f"every must be a positive integer, but got {every}.")
+        self.every = int(every)
+        self.components = components
+
+    def _select(self, X):
+        return X if self.components is None else X[:, self.components]
+
+    def start(self, t_vals, X0):
+        self.times = t_vals[::self.every]
+        first = self._select(X0)
+        self.data = np.empty((first.shape[0], len(self.times), first.shape[1]))
+        self.data[:, 0, :] = first
+
+    def record(self, k, t, X):
+        if k % self.every == 0:
+            self.data[:, k // self.every, :] = self._select(X)
+
+    def result(self):
+        return self.times, self.data
+
+    @staticmethod
+    def merge(results):
+        """
+        Concatenates the results of consecutive chunks of realizations.
+
+        Parameters:
+            results: list of pairs (times, data), data being an ndarray or a dict of ndarrays
+                whose first dimension is the realization.
+
+        Returns:
+            the pair (times, data) of the whole ensemble.
+        """
+        times, data = results[0][0], [part for _, part in results]
+        if isinstance(data[0], dict):
+            return times, {name: np.concatenate([part[name] for part in data]) for name in data[0]}
+        return times, np.concatenate(data)
+
+
+class FullRecorder(StridedRecorder):
+    """
+    Stores every time step of the selected components.
+    """
+
+    def __init__(self, components=None):
+        super().__init__(every=1, components=components)
+
+
+class SummaryRecorder(StridedRecorder):
+    """
+    Keeps running summaries only, computed in a single pass.
+
+    Parameters:
+        every: int, time steps between two ensemble statistics.
+        components: indices of the state components to summarize (None: all).
+
+    Result:
+        times: ndarray of shape (n_rec,), times of the ensemble statistics.
+        summary: dict with
+            "path_mean", "path_std", "path_min", "path_max": ndarrays of shape (R, m),
+                statistics along time of each realization (all time steps);
+            "ensemble_mean", "ensemble_std": ndarrays of shape (n_rec, m),
+                statistics across realizations at the recorded times.
+    """
+
+    def start(self, t_vals, X0):
+        self.times = t_vals[::self.every]
+        first = self._select(X0)
+        m = first.shape[1]
+
+        # --- per-path statistics (Welford's algorithm)
+        self.count = 1
+        self.mean = first.copy()
+        self.m2 = np.zeros_like(first)
+        self.min = first.copy()
+        self.max = first.copy()
+
+        # --- ensemble statistics
+        self.ensemble_mean = np.empty((len(self.times), m))
+        self.ensemble_std = np.empty((len(self.times), m))
+        self._ensemble(0, first)
+
+    def _ensemble(self, j, values):
+        self.ensemble_mean[j] = values.mean(axis=0)
+        self.ensemble_std[j] = values.std(axis=0)
+
+    def record(self, k, t, X):
+        values = self._select(X)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+        if k % self.every == 0:
+            self._ensemble(k // self.every, values)
+
+    def result(self):
+        summary = {
+            "path_mean": self.mean,
+            "path_std": np.sqrt(self.m2 / self.count),
+            "path_min": self.min,
+            "path_max": self.max,
+            "ensemble_mean": self.ensemble_mean,
+            "ensemble_std": self.ensemble_std,
+        }
+        return self.times, summary
+
+    @staticmethod
+    def merge(results):
+        """
+        Combines the summaries of consecutive chunks of realizations: the per-path statistics
+        are concatenated, the ensemble statistics are pooled from the sizes, means and sums of
+        squares of the chunks.
+
+        Parameters:
+            results: list of pairs (times, summary) of the chunks.
+
+        Returns:
+            the pair (times, summary) of the whole ensemble.
+        """
+        times, parts = results[0][0], [summary for _, summary in results]
+        summary = {name: np.concatenate([part[name] for part in parts])
+                   for name in ("path_mean", "path_std", "path_min", "path_max")}
+
+        n = np.array([len(part["path_mean"]) for part in parts], dtype=float)[:, None, None]
+        means = np.stack([part["ensemble_mean"] for part in parts])
+        stds = np.stack([part["ensemble_std"] for part in parts])
+        mean = (n * means).sum(axis=0) / n.sum()
+        # --- sums of squares about the pooled mean (population std, as in _ensemble)
+        squares = (n * (stds ** 2 + (means - mean) ** 2)).sum(axis=0)
+        summary["ensemble_mean"] = mean
+        summary["ensemble_std"] = np.sqrt(squares / n.sum())
+        return times, summary
+
+
+class MemmapRecorder(StridedRecorder):
+    """
+    Streams the time steps 0, every, 2*every, ... to a .npy file through a memory map.
+
+    The recorded time steps are buffered in memory by blocks of `block` steps, so that each
+    realization is written contiguously on disk. The file can be reopened later with
+    `np.load(path, mmap_mode="r")`.
+
+    In a chunked ensemble, `split` preallocates the file for all the realizations and each
+    chunk writes its own rows of it.
+
+    Parameters:
+        path: str, output .npy file.
+        every: int, keep one time step out of `every`.
+        components: indices of the state components to keep (None: all).
+        block: int, number of recorded time steps buffered before writing.
+        dtype: data type on disk (default: float32).
+
+    Result:
+        times: ndarray of shape (n_rec,).
+        X_rec: read-only numpy.memmap of shape (R, n_rec, m) (for a recorder returned by
+            `split`: the pair (start, stop) of its rows).
+    """
+
+    def __init__(self, path, every=1, components=None, block=1024, dtype=np.float32):
+        super().__init__(every=every, components=components)
+        self.path = path
+        self.block = int(block)
+        self.dtype = dtype
+        self.rows = None
+
+    def split(self, t_vals, X0, bounds):
+        """
+        Preallocates the file for the whole ensemble and returns one recorder per chunk.
+
+        Parameters:
+            t_vals: ndarray of shape (N+1,), time grid.
+            X0: ndarray of shape (R, n), initial states of the whole ensemble.
+            bounds: list of ints, chunk i holds the realizations bounds[i]:bounds[i+1].
+
+        Returns:
+            list of MemmapRecorder, writing the rows of their chunk.
+        """
+        R, m = self._select(X0).shape
+        np.lib.format.open_memmap(self.path, mode="w+", dtype=self.dtype,
+                                  shape=(R, len(t_vals[::self.every]), m)).flush()
+        recorders = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            recorder = copy.copy(self)
+            recorder.rows = (start, stop)
+            recorders.append(recorder)
+        return recorders
+
+    def merge(self, results):
+        """
+        Returns the file written by the chunks prepared by `split`.
+        """
+        return results[0][0], np.load(self.path, mmap_mode="r")
+
+    def start(self, t_vals, X0):
+        self.times = t_vals[::self.every]
+        first = self._select(X0)
+        R, m = first.shape
+        if self.rows is None:
+            self.data = np.lib.format.open_memmap(self.path, mode="w+", dtype=self.dtype,
+                                                  shape=(R, len(self.times), m))
+        else:
+            # --- rows of the file preallocated by `split`
+            self.data = np.lib.format.open_memmap(self.path, mode="r+")[self.rows[0]:self.rows[1]]
+            if self.data.shape != (R, len(self.times), m):
+                raise ValueError(f"The chunk {self.rows} of {self.path} has shape {self.data.shape}, "
+                                 f"but got {(R, len(self.times), m)}.")
+        self.buffer = np.empty((R, self.block, m), dtype=self.dtype)
+        self.buffer_start = 0
+        self.buffer_size = 0
+        self._push(first)
+
+    def _push(self, values):
+        self.buffer[:, self.buffer_size, :] = values
+        self.buffer_size += 1
+        if self.buffer_size == self.block:
+            self._flush()
+
+    def _flush(self):
+        stop = self.buffer_start + self.buffer_size
+        self.data[:, self.buffer_start:stop, :] = self.buffer[:, :self.buffer_size, :]
+        self.buffer_start = stop
+        self.buffer_size = 0
+
+    def record(self, k, t, X):
+        if k % self.every == 0:
+            self._push(self._select(X))
+
+    def result(self):
+        self._flush()
+        self.data.flush()
+        del self.data
+        if self.rows is not None:
+            return self.times, self.rows
+        return self.times, np.load(self.path, mmap_mode="r")
+
+
+class BurstRecorder(StridedRecorder):
+    """
+    Accumulates spike and burst statistics of one component on the fly, without storing it.
+
+    The analysis is that of spikes.ensemble_bursts applied to the time steps 0, every,
+    2*every, ... after `t_transient`, carried out one step at a time: a spike is detected when
+    the component, above `height`, starts decreasing (local maximum), the spikes are grouped
+    into bursts on the ISI threshold and each burst is classified when the next one ends (or
+    at the end of the integration) from its minimum and the mean of the neighbouring
+    inter-burst intervals. The state is a fixed number of arrays of shape (R,) and the
+    histograms, so that the memory is O(R x bins) whatever the number of time steps.
+
+    Parameters:
+        every: int, analyse one time step out of `every`.
+        component: index of the analysed component (0: x).
+        height, isi_threshold, min_spikes: spike and burst detection (see spikes.ensemble_bursts).
+        t_transient: time steps before `t_transient` are ignored.
+        max_spikes: spikes per burst histogram bins 0, 1, ..., max_spikes (the last one
+            gathers the bursts of at least `max_spikes` spikes).
+        period_edges: ndarray of shape (n_bins+1,), bin edges of the histogram of the intervals
+            between the starts of consecutive bursts (values outside are counted in the end bins).
+
+    Result:
+        times: ndarray of shape (2,), start and end of the analysed time window.
+        stats: dict with the keys of spikes.ensemble_burst_statistics (ndarrays of shape (R,))
+            and
+                "spikes_per_burst_hist": ndarray of shape (R, max_spikes+1);
+                "burst_period_hist": ndarray of shape (R, n_bins);
+                "burst_types": ndarray of shape (R, 3), number of bursts of each type
+                    (OTHER, SQUARE_WAVE, PARABOLIC).
+    """
+
+    def __init__(self, every=1, component=0, height=0.0, isi_threshold=80.0, min_spikes=2, t_transient=0.0,
+                 max_spikes=50, period_edges=None):
+        super().__init__(every=every, components=[component])
+        self.height = height
+        self.isi_threshold = isi_threshold
+        self.min_spikes = min_spikes
+        self.t_transient = t_transient
+        self.max_spikes = int(max_spikes)
+        self.period_edges = np.linspace(0.0, 2000.0, 101) if period_edges is None else np.asarray(period_edges)
+
+    def start(self, t_vals, X0):
+        R = X0.shape[0]
+        self.t_window = [np.nan, np.nan]
+        self.n_seen = 0
+        self.previous = np.zeros((2, R))   # values at the two previous analysed steps
+        self.t_previous = np.nan
+
+        # --- current group of spikes
+        self.last_spike = np.full(R, -np.inf)
+        self.group_n = np.zeros(R, dtype=int)
+        self.group_start = np.zeros(R)
+        self.group_end = np.zeros(R)
+        self.group_min = np.zeros(R)
+        self.group_gap = np.full(R, np.nan)   # mean of the interval before the group
+        self.running_min = np.zeros(R)
+
+        # --- sums since the end of the last burst and since the last spike
+        self.gap_sum, self.gap_count = np.zeros(R), np.zeros(R)
+        self.tail_sum, self.tail_count = np.zeros(R), np.zeros(R)
+
+        # --- last burst, classified when the next one ends
+        self.has_burst = np.zeros(R, dtype=bool)
+        self.last_start = np.zeros(R)
+        self.last_min = np.zeros(R)
+        self.last_gap = np.full(R, np.nan)
+
+        # --- accumulated statistics
+        self.n_spikes = np.zeros(R)
+        self.n_bursts = np.zeros(R)
+        self.spikes_sum = np.zeros(R)
+        self.duration_sum = np.zeros(R)
+        self.period_sum, self.period_count = np.zeros(R), np.zeros(R)
+        self.spikes_hist = np.zeros((R, self.max_spikes + 1), dtype=np.int64)
+        self.period_hist = np.zeros((R, len(self.period_edges) - 1), dtype=np.int64)
+        self.burst_types = np.zeros((R, 3), dtype=np.int64)
+
+        self.record(0, t_vals[0], X0)
+
+    def record(self, k, t, X):
+        if k % self.every != 0 or t < self.t_transient:
+            return
+        value = self._select(X)[:, 0]
+        if self.n_seen == 0:
+            self.t_window[0] = t
+        self.t_window[1] = t
+        if self.n_seen >= 2:
+            before, current = self.previous
+            spike = (current > before) & (current >= value) & (current >= self.height)
+            self._analyse(self.t_previous, current, spike)
+        elif self.n_seen == 1:
+            self._analyse(self.t_previous, self.previous[1], np.zeros(len(value), dtype=bool))
+        self.previous[0] = self.previous[1]
+        self.previous[1] = value
+        self.t_previous = t
+        self.n_seen += 1
+
+    def _analyse(self, t, value, spike):
+        """
+        Updates the state with the value at time t, which is a spike where `spike` is True.
+        """
+        # --- spikes ending a group: the group ends, a new one starts
+        new = spike & ((self.group_n == 0) | (t - self.last_spike >= self.isi_threshold))
+        ended = new & (self.group_n >= self.min_spikes)
+        if np.any(ended):
+            self.gap_sum[ended], self.gap_count[ended] = self.tail_sum[ended], self.tail_count[ended]
+            self._end_bursts(ended)
+        if np.any(new):
+            self.group_gap[new] = np.where(self.has_burst[new],
+                                           self.gap_sum[new] / np.maximum(self.gap_count[new], 1), np.nan)
+            self.group_n[new] = 0
+            self.group_start[new] = t
+            self.running_min[new] = value[new]
+
+        # --- every time step
+        np.minimum(self.running_min, value, out=self.running_min)
+        self.gap_sum += value
+        self.gap_count += 1
+
+        # --- spikes
+        self.group_n[spike] += 1
+        self.group_end[spike] = t
+        self.group_min[spike] = self.running_min[spike]
+        self.last_spike[spike] = t
+        self.n_spikes[spike] += 1
+        self.tail_sum = np.where(spike, 0.0, self.tail_sum + value)
+        self.tail_count = np.where(spike, 0, self.tail_count + 1)
+
+    def _end_bursts(self, ended):
+        """
+        Accounts for the bursts made of the current groups of the realizations `ended`.
+        """
+        rows = np.flatnonzero(ended)
+        n = self.group_n[rows]
+        start = self.group_start[rows]
+        self.n_bursts[rows] += 1
+        self.spikes_sum[rows] += n
+        self.duration_sum[rows] += self.group_end[rows] - start
+        self.spikes_hist[rows, np.minimum(n, self.max_spikes)] += 1
+
+        # --- interval since the previous burst, which can now be classified
+        previous = rows[self.has_burst[rows]]
+        period = self.group_start[previous] - self.last_start[previous]
+        self.period_sum[previous] += period
+        self.period_count[previous] += 1
+        bins = np.clip(np.searchsorted(self.period_edges, period, side="right") - 1, 0, self.period_hist.shape[1] - 1)
+        self.period_hist[previous, bins] += 1
+        self._classify(previous, self.group_gap[previous])
+
+        self.has_burst[rows] = True
+        self.last_start[rows] = start
+        self.last_min[rows] = self.group_min[rows]
+        self.last_gap[rows] = self.group_gap[rows]
+
+    def _classify(self, rows, next_gap):
+        """
+        Classifies the last bursts of the realizations `rows`, followed by intervals of mean `next_gap`.
+        """
+        neighbours = np.stack([self.last_gap[rows], next_gap])
+        count = np.sum(~np.isnan(neighbours), axis=0)
+        inter_mean = np.where(count > 0, np.nansum(neighbours, axis=0) / np.maximum(count, 1), np.nan)
+        labels = np.full(len(rows), OTHER)
+        labels[self.last_min[rows] > inter_mean] = SQUARE_WAVE
+        labels[self.last_min[rows] < inter_mean] = PARABOLIC
+        np.add.at(self.burst_types, (rows, labels), 1)
+
+    def result(self):
+        # --- the last group and the last burst (no interval after it)
+        self._end_bursts(self.group_n >= self.min_spikes)
+        self.group_n[:] = 0
+        rows = np.flatnonzero(self.has_burst)
+        self._classify(rows, np.full(len(rows), np.nan))
+        self.has_burst[:] = False
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats = {
+                "n_spikes": self.n_spikes,
+                "n_bursts": self.n_bursts,
+                "spikes_per_burst": self.spikes_sum / self.n_bursts,
+                "burst_duration": self.duration_sum / self.n_bursts,
+                "burst_period": self.period_sum / self.period_count,
+                "square_wave": self.burst_types[:, SQUARE_WAVE] / self.n_bursts,
+                "parabolic": self.burst_types[:, PARABOLIC] / self.n_bursts,
+                "spikes_per_burst_hist": self.spikes_hist,
+                "burst_period_hist": self.period_hist,
+                "burst_types": self.burst_types,
+            }
+        return np.array(self.t_window), stats
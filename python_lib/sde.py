@@ -0,0 +1,368 @@
+"""
+Vectorized simulation of R independent realizations of a vector SDE
+
+    dX_t = f(t, X_t) dt + g(t, X_t) dW_t,   t in [0, T]
+
+where X_t is of dimension n and W_t is a standard Brownian motion of dimension d.
+
+Understand:
+    n state space dimension                              i=1:n
+    d noise dimension                                    j=1:d
+    r realization index                                  r=1:R
+    k time index, t_k = k * dt = k * T/N for k=0:N
+
+Shape contracts (all realizations are processed at once):
+    f(t, X): (R, n) -> (R, n)
+    g(t, X): (R, n) -> (R, n, d)    noise="general"
+    g(t, X): (R, n) -> (R, n)       noise="diagonal"  (d = n, g_ij = 0 for i != j)
+    g:       ndarray (n, d)         noise="additive"  (or g(t) -> (n, d) when time-dependent)
+
+The general case needs an `einsum` per time step, which dominates the cost; the diagonal
+and additive cases avoid it (elementwise product, resp. one small matrix product).
+
+The Brownian increments are not drawn up front (an (R, N, d) array would double or triple the
+memory): they are generated by blocks of time steps inside the stepping loop. The blocks are
+drawn time-major from a single `numpy.random.Generator`, so the paths only depend on the
+seed, not on the block size.
+
+What is stored is delegated to a recorder (see recording.py): every time step by default,
+every k-th step, selected components, running summaries only, or a memory map on disk.
+
+Sampling of the Brownian increments (variance reduction, see also variance_reduction.py):
+    "mc"          independent pseudo-random paths.
+    "antithetic"  realizations r and r + R/2 are driven by opposite increments (R even).
+    "sobol"       scrambled Sobol points drive the Brownian bridge construction of W on a
+                  coarse grid of `bridge_points` (a power of 2) intervals, the coarse values
+                  W(T), W(T/2), ... taking the first Sobol coordinates; the increments inside
+                  each coarse interval are pseudo-random, conditioned on its endpoints (hybrid
+                  randomized QMC, the Sobol dimension is bridge_points * d instead of N * d).
+                  R should be a power of 2.
+
+Schemes:
+    "em"    Euler-Maruyama, strong order 0.5 (order 1 for additive noise), any noise type.
+    "sra1"  stochastic Runge-Kutta SRA1 of Roessler (2010), strong order 1.5 for additive
+            noise, two drift evaluations per step. Needs a constant additive diffusion.
+            An adaptive-step version is given in sde_adaptive.py.
+
+Reference:
+    Roessler, A. Runge-Kutta methods for the strong approximation of solutions of stochastic
+    differential equations. SIAM J. Numer. Anal. 48(3): 922-952, 2010.
+"""
+
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import qmc
+
+from .recording import FullRecorder
+
+NOISE_TYPES = ("general", "diagonal", "additive")
+SCHEMES = ("em", "sra1")
+SAMPLINGS = ("mc", "antithetic", "sobol")
+
+BLOCK_NUMBERS = 2**20   # default number of random numbers drawn per block
+
+
+def _initial_state(X0, R):
+    """
+    Returns the initial state as an ndarray of shape (R, n), from X0 of shape (n,) or (R, n).
+    """
+    X0 = np.asarray(X0, dtype=float)
+    if X0.ndim == 1:
+        if R is None:
+            raise ValueError("R must be given when X0 is of shape (n,).")
+        return np.tile(X0, (R, 1))
+    if X0.ndim == 2:
+        if R is not None and X0.shape[0] != R:
+            raise ValueError(f"X0 must be of shape (n,) or (R, n) = ({R}, n), but got {X0.shape}.")
+        return X0.copy()
+    raise ValueError(f"X0 must be of shape (n,) or (R, n), but got {X0.shape}.")
+
+
+def iterated_integrals(xi, dt):
+    """
+    Returns the Brownian increment dW and the iterated integral dZ = int_t^{t+dt} (W_s - W_t) ds
+    of a time step dt, from standard normal variables xi of shape (..., 2, d).
+
+    (dW, dZ) is Gaussian with Var(dW) = dt, Cov(dW, dZ) = dt^2/2 and Var(dZ) = dt^3/3.
+    """
+    dW = np.sqrt(dt) * xi[..., 0, :]
+    dZ = 0.5 * dt * (dW + np.sqrt(dt / 3) * xi[..., 1, :])
+    return dW, dZ
+
+
+def _standard_normals(rng, shape, antithetic=False):
+    """
+    Standard normal variables of shape (b, R, ...), opposite for r and r + R/2 if antithetic.
+    """
+    if not antithetic:
+        return rng.standard_normal(shape)
+    half = rng.standard_normal((shape[0], shape[1] // 2) + shape[2:])
+    return np.concatenate([half, -half], axis=1)
+
+
+def sobol_brownian_bridge(rng, n_intervals, R, d, times):
+    """
+    Brownian paths at coarse times, built by the Brownian bridge from scrambled Sobol points.
+
+    Parameters:
+        rng: numpy.random.Generator (scrambling).
+        n_intervals: number of coarse intervals, a power of 2.
+        R: number of realizations (Sobol points, preferably a power of 2).
+        d: noise dimension.
+        times: ndarray of shape (n_intervals + 1,), coarse times (times[0] = 0).
+
+    Returns:
+        ndarray of shape (n_intervals + 1, R, d), W at the coarse times.
+    """
+    if n_intervals < 1 or n_intervals & (n_intervals - 1):
+        raise ValueError(f"The number of bridge intervals must be a power of 2, but got {n_intervals}.")
+    u = qmc.Sobol(d=n_intervals * d, scramble=True, seed=rng).random(R)
+    xi = ndtri(np.clip(u, 1e-12, 1 - 1e-12)).reshape(R, n_intervals, d)
+    W = np.zeros((n_intervals + 1, R, d))
+    W[-1] = np.sqrt(times[-1]) * xi[:, 0]
+    # --- midpoints, level by level: the first Sobol coordinates go to the coarsest scales
+    node, width = 1, n_intervals
+    while width > 1:
+        left = np.arange(0, n_intervals, width)
+        mid, right = left + width // 2, left + width
+        t_l, t_m, t_r = times[left, None, None], times[mid, None, None], times[right, None, None]
+        mean = ((t_r - t_m) * W[left] + (t_m - t_l) * W[right]) / (t_r - t_l)
+        std = np.sqrt((t_m - t_l) * (t_r - t_m) / (t_r - t_l))
+        W[mid] = mean + std * np.moveaxis(xi[:, node:node + len(left)], 1, 0)
+        node, width = node + len(left), width // 2
+    return W
+
+
+def _sobol_normals(rng, N, R, d, dt, m, bridge_points):
+    """
+    Normal variables of sampling="sobol", of shape (b, R, m, d), [:, :, 0] being the
+    increments divided by sqrt(dt) (see brownian_increments).
+
+    Each coarse interval of the bridge is drawn in sub-intervals of about BLOCK_NUMBERS
+    numbers, whose sums are drawn from their bridge conditional given the remaining
+    increment of the coarse interval; the sub-intervals do not depend on the block size.
+    """
+    sqrt_dt = np.sqrt(dt)
+    size = max(1, BLOCK_NUMBERS // (m * R * d))
+    n_intervals = min(bridge_points, 2**int(np.log2(N)))
+    steps = np.round(np.linspace(0, N, n_intervals + 1)).astype(int)
+    W = sobol_brownian_bridge(rng, n_intervals, R, d, steps * dt)
+    for j in range(n_intervals):
+        remaining, n_remaining = (W[j + 1] - W[j]) / sqrt_dt, steps[j + 1] - steps[j]
+        while n_remaining > 0:
+            b = min(size, n_remaining)
+            # --- sum of the b steps given the remaining increment of the coarse interval
+            total = remaining * (b / n_remaining)
+            if b < n_remaining:
+                total += np.sqrt(b * (n_remaining - b) / n_remaining) * rng.standard_normal((R, d))
+            remaining, n_remaining = remaining - total, n_remaining - b
+            # --- pseudo-random increments conditioned on their sum
+            xi = rng.standard_normal((b, R, m, d))
+            xi[:, :, 0] += (total - xi[:, :, 0].sum(axis=0)) / b
+            yield xi
+
+
+def _reblock(blocks, block_size):
+    """
+    Regroups consecutive arrays along their first axis in blocks of `block_size` (the last
+    one may be shorter).
+    """
+    pending, n_pending = [], 0
+    for block in blocks:
+        pending.append(block)
+        n_pending += len(block)
+        while n_pending >= block_size:
+            joined = np.concatenate(pending)
+            yield joined[:block_size]
+            pending, n_pending = [joined[block_size:]], n_pending - block_size
+    if n_pending:
+        yield np.concatenate(pending)
+
+
+def brownian_increments(rng, N, R, d, dt, block_size=None, iterated=False, sampling="mc", bridge_points=64):
+    """
+    Generates the Brownian increments of N time steps by blocks of time steps.
+
+    The standard normal variables are drawn time-major, so that concatenating the blocks
+    gives the same array of shape (N, R, d) whatever the block size.
+
+    Parameters:
+        rng: numpy.random.Generator.
+        N: number of time steps.
+        R: number of independent realizations.
+        d: noise dimension.
+        dt: time step.
+        block_size: number of time steps per block (None: about BLOCK_NUMBERS numbers per block).
+        iterated: also generate the iterated integrals dZ (see iterated_integrals).
+        sampling: "mc", "antithetic" (R even) or "sobol" (see the module documentation).
+        bridge_points: number of coarse intervals of the Brownian bridge (sampling="sobol"),
+            a power of 2, reduced to N if larger.
+
+    Yields:
+        ndarray of shape (b, R, d), increments of b consecutive time steps (b <= block_size),
+        or the pair (dW, dZ) of such arrays when `iterated` is True.
+    """
+    if sampling not in SAMPLINGS:
+        raise ValueError(f"sampling must be one of {SAMPLINGS}, but got '{sampling}'.")
+    if sampling == "antithetic" and R % 2:
+        raise ValueError(f"Antithetic sampling needs an even number of realizations, but got R = {R}.")
+    m = 2 if iterated else 1
+    sqrt_dt = np.sqrt(dt)
+
+    if block_size is None:
+        block_size = max(1, BLOCK_NUMBERS // (m * R * d))
+
+    if sampling == "sobol":
+        for xi in _reblock(_sobol_normals(rng, N, R, d, dt, m, bridge_points), block_size):
+            yield iterated_integrals(xi, dt) if iterated else sqrt_dt * xi[:, :, 0]
+        return
+
+    antithetic = sampling == "antithetic"
+    for start in range(0, N, block_size):
+        b = min(block_size, N - start)
+        if iterated:
+            yield iterated_integrals(_standard_normals(rng, (b, R, 2, d), antithetic), dt)
+        else:
+            block = _standard_normals(rng, (b, R, d), antithetic)
+            block *= sqrt_dt
+            yield block
+
+
+def _diffusion_term(g, noise, t, X):
+    """
+    Evaluates the diffusion coefficient according to the noise type.
+    """
+    if noise == "additive":
+        return g(t) if callable(g) else g
+    return g(t, X)
+
+
+def _check_shapes(f, g, noise, t0, X):
+    """
+    Checks the shape contracts of f and g on the initial state and returns the noise dimension d.
+    """
+    if noise not in NOISE_TYPES:
+        raise ValueError(f"noise must be one of {NOISE_TYPES}, but got '{noise}'.")
+
+    R, n = X.shape
+    f_result = np.asarray(f(t0, X))
+    if f_result.shape != (R, n):
+        raise ValueError(f"f(t, X) should return an array of shape (R, n) = {(R, n)}, but got {f_result.shape}.")
+
+    g_result = np.asarray(_diffusion_term(g, noise, t0, X))
+    if noise == "general":
+        if g_result.ndim != 3 or g_result.shape[:2] != (R, n):
+            raise ValueError(f"g(t, X) should return an array of shape (R, n, d) = ({R}, {n}, d), "
+                             f"but got {g_result.shape}.")
+        return g_result.shape[2]
+    if noise == "diagonal":
+        if g_result.shape != (R, n):
+            raise ValueError(f"g(t, X) should return an array of shape (R, n) = {(R, n)}, but got {g_result.shape}.")
+        return n
+    if g_result.ndim != 2 or g_result.shape[0] != n:
+        raise ValueError(f"g should be an array of shape (n, d) = ({n}, d), but got {g_result.shape}.")
+    return g_result.shape[1]
+
+
+def sde_vectorized(f, g, X0, T, N, R=None, noise="general", rng=None, record=None, block_size=None,
+                   scheme="em", sampling="mc", bridge_points=64):
+    """
+    Vectorized simulation of an SDE using the Euler-Maruyama (or SRA1) scheme.
+
+    Parameters:
+        f: drift, function f(t, X) -> ndarray of shape (R, n).
+        g: diffusion, see the shape contracts of the module according to `noise`.
+        X0: initial condition, ndarray of shape (n,) (same for all realizations) or (R, n).
+        T: final time.
+        N: number of time steps (N+1: number of time instants).
+        R: number of independent realizations (deduced from X0 when of shape (R, n)).
+        noise: "general", "diagonal" or "additive".
+        rng: numpy.random.Generator or seed (None: fresh entropy).
+        record: recorder (see recording.py), None: every time step (FullRecorder).
+        block_size: number of time steps of Brownian increments drawn at once
+            (None: automatic), has no influence on the result.
+        scheme: "em" (Euler-Maruyama) or "sra1" (constant additive noise only).
+        sampling: "mc", "antithetic" or "sobol", sampling of the Brownian increments (see the
+            module documentation).
+        bridge_points: number of coarse intervals of the Brownian bridge (sampling="sobol").
+
+    Returns:
+        the pair (times, data) of the recorder, by default:
+        t_vals: ndarray of shape (N+1,), time points.
+        X_vals: ndarray of shape (R, N+1, n), simulated paths of X_t.
+    """
+    X = _initial_state(X0, R)
+    R, n = X.shape
+    rng = np.random.default_rng(rng)
+
+    dt = T / N
+    t_vals = np.linspace(0, T, N + 1)
+    d = _check_shapes(f, g, noise, t_vals[0], X)
+    if noise == "additive" and not callable(g):
+        g = np.asarray(g, dtype=float)
+    if scheme not in SCHEMES:
+        raise ValueError(f"scheme must be one of {SCHEMES}, but got '{scheme}'.")
+    if scheme == "sra1" and (noise != "additive" or callable(g)):
+        raise ValueError("The SRA1 scheme needs a constant additive diffusion (noise='additive', g an array).")
+
+    # --- recording
+    recorder = FullRecorder() if record is None else record
+    recorder.start(t_vals, X)
+
+    if scheme == "sra1":
+        return _sra1(f, g, X, t_vals, dt, rng, recorder, block_size, sampling, bridge_points)
+
+    # --- time iterations
+    k = 0
+    for dW_block in brownian_increments(rng, N, R, d, dt, block_size, sampling=sampling, bridge_points=bridge_points):
+        if noise == "additive" and not callable(g):
+            dW_block = dW_block @ g.T                    # (b, R, d) x (d, n), whole block at once
+        for dW in dW_block:
+            t = t_vals[k]
+            if noise == "additive":
+                diffusion = dW if not callable(g) else dW @ g(t).T
+            elif noise == "diagonal":
+                diffusion = g(t, X) * dW                 # elementwise, d = n
+            else:
+                diffusion = np.einsum("rij,rj->ri", g(t, X), dW)   # summation along the j-index
+            X = X + f(t, X) * dt + diffusion
+            k += 1
+            recorder.record(k, t_vals[k], X)
+
+    return recorder.result()
+
+
+def sra1_step(f, t, X, dt, GdW, GdZ):
+    """
+    One step of the SRA1 scheme for a constant additive diffusion G.
+
+    Parameters:
+        GdW, GdZ: ndarrays of shape (R, n), G dW and G dZ (see iterated_integrals).
+
+    Returns:
+        X_new: ndarray of shape (R, n), state after the step.
+        f1, f2: drift at the two stages (f1 = f(t, X)), copied.
+    """
+    f1 = np.array(f(t, X))
+    H2 = X + (0.75 * dt) * f1 + (1.5 / dt) * GdZ
+    f2 = np.array(f(t + 0.75 * dt, H2))
+    X_new = X + dt * (f1 / 3 + 2 * f2 / 3) + GdW
+    return X_new, f1, f2
+
+
+def _sra1(f, G, X, t_vals, dt, rng, recorder, block_size, sampling="mc", bridge_points=64):
+    """
+    Time iterations of the SRA1 scheme (constant additive diffusion G of shape (n, d)).
+    """
+    R, d = X.shape[0], G.shape[1]
+    k = 0
+    for dW_block, dZ_block in brownian_increments(rng, len(t_vals) - 1, R, d, dt, block_size, iterated=True,
+                                                  sampling=sampling, bridge_points=bridge_points):
+        GdW_block = dW_block @ G.T
+        GdZ_block = dZ_block @ G.T
+        for GdW, GdZ in zip(GdW_block, GdZ_block):
+            X, _, _ = sra1_step(f, t_vals[k], X, dt, GdW, GdZ)
+            k += 1
+            recorder.record(k, t_vals[k], X)
+
+    return recorder.result()
@@ -0,0 +1,161 @@
+"""
+Adaptive-step simulation of SDEs with constant additive noise
+
+    dX_t = f(t, X_t) dt + G dW_t,   G ndarray of shape (n, d)
+
+The steps use the SRA1 scheme (strong order 1.5, see sde.py). The local error is estimated
+by the difference with the embedded Euler-Maruyama step, which only involves the drift:
+
+    err = (2/3) dt |f(t + 3/4 dt, H2) - f(t, X)|
+
+and the step size is controlled as for ODEs. The R realizations share the same time steps
+(the error is the maximum over the ensemble), so that they are still advanced together.
+
+A rejected step is not redrawn, which would bias the paths: the Brownian increment dW and
+the iterated integral dZ of the rejected interval are split at mid-point conditionally on
+their values (Brownian bridge, in the spirit of the RSwM algorithms of Rackauckas & Nie),
+and the future intervals are kept in a stack until they are used.
+
+Reference:
+    Rackauckas, C., & Nie, Q. Adaptive methods for stochastic differential equations via
+    natural embeddings and rejection sampling with memory. Discrete Contin. Dyn. Syst.
+    Ser. B 22(7): 2731-2761, 2017.
+"""
+
+import numpy as np
+
+from .recording import FullRecorder
+from .sde import _initial_state, iterated_integrals, sra1_step
+
+
+def _increment_covariance(h):
+    """
+    Covariance matrix of (dW, dZ) over a time step h, for one noise component.
+    """
+    return np.array([[h, h**2 / 2], [h**2 / 2, h**3 / 3]])
+
+
+def split_increment(rng, h, dW, dZ, theta):
+    """
+    Splits the Brownian increment and the iterated integral of an interval of length h
+    at the fraction theta, conditionally on their values.
+
+    With h1 = theta h, h2 = h - h1, the sub-interval quantities satisfy
+        dW = dW1 + dW2,    dZ = dZ1 + dZ2 + h2 dW1,
+    and are sampled from their conditional distribution by Matheron's rule: an unconditional
+    sample u is corrected by K (y - A u), K = S A^T (A S A^T)^-1.
+
+    Parameters:
+        rng: numpy.random.Generator.
+        h: float, length of the interval.
+        dW, dZ: ndarrays of shape (..., d), values on the interval.
+        theta: float in (0, 1).
+
+    Returns:
+        (h1, dW1, dZ1), (h2, dW2, dZ2): the two sub-intervals.
+    """
+    h1 = theta * h
+    h2 = h - h1
+    S = np.zeros((4, 4))
+    S[:2, :2] = _increment_covariance(h1)
+    S[2:, 2:] = _increment_covariance(h2)
+    A = np.array([[1.0, 0.0, 1.0, 0.0],
+                  [h2, 1.0, 0.0, 1.0]])
+    K = S @ A.T @ np.linalg.inv(A @ S @ A.T)
+
+    # --- unconditional samples of (dW1, dZ1, dW2, dZ2)
+    u = np.empty(dW.shape + (4,))
+    u[..., 0], u[..., 1] = iterated_integrals(rng.standard_normal(dW.shape[:-1] + (2, dW.shape[-1])), h1)
+    u[..., 2], u[..., 3] = iterated_integrals(rng.standard_normal(dW.shape[:-1] + (2, dW.shape[-1])), h2)
+
+    # --- conditioning on (dW, dZ)
+    y = np.stack([dW, dZ], axis=-1)
+    v = u + (y - u @ A.T) @ K.T
+    return (h1, v[..., 0], v[..., 1]), (h2, v[..., 2], v[..., 3])
+
+
+def sde_adaptive(f, G, X0, T, R=None, t_eval=None, rng=None, record=None, rtol=1e-3, atol=1e-3,
+                 h0=None, h_min=1e-8, h_max=np.inf, safety=0.9, fac_min=0.2, fac_max=5.0):
+    """
+    Adaptive-step SRA1 simulation of an SDE with constant additive noise.
+
+    Parameters:
+        f: drift, function f(t, X) -> ndarray of shape (R, n).
+        G: constant diffusion matrix, ndarray of shape (n, d).
+        X0: initial condition, ndarray of shape (n,) or (R, n).
+        T: final time.
+        R: number of independent realizations (deduced from X0 when of shape (R, n)).
+        t_eval: output times, increasing, from 0 to at most T (None: 101 evenly spaced times);
+            the steps are cut so as to hit them exactly.
+        rng: numpy.random.Generator or seed (None: fresh entropy).
+        record: recorder (see recording.py) called at the output times, None: FullRecorder.
+        rtol, atol: relative and absolute tolerances on the local error.
+        h0: initial step (None: 1e-2 T / (len(t_eval) - 1)).
+        h_min, h_max: bounds of the step size.
+        safety, fac_min, fac_max: parameters of the step size controller.
+
+    Returns:
+        times, data: the pair returned by the recorder, by default the output times and
+            an ndarray of shape (R, len(t_eval), n).
+        stats: dict with the numbers of accepted and rejected steps and drift evaluations.
+    """
+    X = _initial_state(X0, R)
+    R, n = X.shape
+    G = np.asarray(G, dtype=float)
+    if G.ndim != 2 or G.shape[0] != n:
+        raise ValueError(f"G should be an array of shape (n, d) = ({n}, d), but got {G.shape}.")
+    d = G.shape[1]
+    rng = np.random.default_rng(rng)
+
+    t_eval = np.linspace(0, T, 101) if t_eval is None else np.asarray(t_eval, dtype=float)
+    if t_eval[0] != 0 or t_eval[-1] > T or np.any(np.diff(t_eval) <= 0):
+        raise ValueError("t_eval must be increasing, from 0 to at most T.")
+    h = 1e-2 * T / max(1, len(t_eval) - 1) if h0 is None else h0
+
+    recorder = FullRecorder() if record is None else record
+    recorder.start(t_eval, X)
+    stats = {"n_accepted": 0, "n_rejected": 0, "nfev": 0}
+
+    # --- stack of future intervals (length, dW, dZ), the next one on top
+    stack = []
+    t = 0.0
+    j = 1
+    while j < len(t_eval):
+        h = min(max(h, h_min), h_max, t_eval[j] - t)
+
+        # --- Brownian increments of the proposed step
+        if not stack:
+            stack.append((h,) + iterated_integrals(rng.standard_normal((R, 2, d)), h))
+        h_step, dW, dZ = stack[-1]
+        if h_step > h * (1 + 1e-12):
+            stack.pop()
+            first, second = split_increment(rng, h_step, dW, dZ, h / h_step)
+            stack.extend([second, first])
+            h_step, dW, dZ = first
+
+        # --- SRA1 step and embedded error estimate
+        X_new, f1, f2 = sra1_step(f, t, X, h_step, dW @ G.T, dZ @ G.T)
+        stats["nfev"] += 2
+        scale = atol + rtol * np.maximum(np.abs(X), np.abs(X_new))
+        err = np.max(np.sqrt(np.mean(((2 / 3) * h_step * (f2 - f1) / scale) ** 2, axis=1)))
+
+        if err <= 1 or h_step <= h_min:
+            stack.pop()
+            t += h_step
+            X = X_new
+            stats["n_accepted"] += 1
+            if np.isclose(t, t_eval[j], rtol=0, atol=1e-12 * max(1.0, T)):
+                t = t_eval[j]
+                recorder.record(j, t, X)
+                j += 1
+            h = h_step * min(fac_max, max(fac_min, safety * err ** -0.5)) if err > 0 else h_step * fac_max
+        else:
+            # --- rejection: split the interval at mid-point and retry on the first half
+            stack.pop()
+            first, second = split_increment(rng, h_step, dW, dZ, 0.5)
+            stack.extend([second, first])
+            stats["n_rejected"] += 1
+            h = first[0]
+
+    times, data = recorder.result()
+    return times, data, stats
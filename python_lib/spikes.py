@@ -0,0 +1,277 @@
+"""
+Spike and burst analysis of voltage traces
+
+The functions implement the analysis of the ABF recordings of `data/MD/cell_209.ipynb` so that
+recordings and simulated traces (the x component of the HR model) are processed the same way:
+
+    1. spikes: peaks of the voltage above a height (scipy.signal.find_peaks);
+    2. bursts: groups of consecutive spikes whose inter-spike intervals (ISI) are below a
+       threshold, with at least `min_spikes` spikes;
+    3. classification of each burst by comparing the minimum voltage during the burst with the
+       mean voltage of the neighbouring inter-burst intervals:
+           above: square-wave burst (the spikes ride on a depolarized plateau),
+           below: parabolic burst (the spikes undershoot the resting level).
+
+The defaults (height -30 mV, ISI threshold 0.3 s) are those of the recordings; the HR traces
+need their own values (see hr_sweep.py).
+
+Ensembles of traces, an array of shape (R, N), are analysed in one vectorized pass
+(ensemble_bursts, ensemble_burst_statistics): the spikes are the local maxima above the
+height (find_peaks with `height` only, up to flat peaks) and the bursts of all the
+realizations are segmented and classified together. simulation_statistics is the entry point
+for the output of the simulators, in model units or converted to the units of the recordings.
+"""
+
+import numpy as np
+from scipy.signal import find_peaks
+
+# ___ burst types _________________________________________________________________________________
+
+OTHER = 0
+SQUARE_WAVE = 1
+PARABOLIC = 2
+
+BURST_TYPES = {OTHER: "other", SQUARE_WAVE: "square wave", PARABOLIC: "parabolic"}
+
+
+def detect_spikes(v, height=-30.0, **kwargs):
+    """
+    Returns the indices of the spikes of a voltage trace.
+
+    Parameters:
+        v: ndarray of shape (N,), voltage.
+        height: minimal height of a spike.
+        kwargs: other arguments of scipy.signal.find_peaks (distance, prominence, width, ...).
+
+    Returns:
+        ndarray of shape (n_spikes,), indices of the spike peaks in v.
+    """
+    indices, _ = find_peaks(v, height=height, **kwargs)
+    return indices
+
+
+def detect_bursts(spike_times, isi_threshold=0.3, min_spikes=2):
+    """
+    Groups the spikes into bursts: a burst goes on as long as the ISI is below `isi_threshold`.
+
+    Parameters:
+        spike_times: ndarray of shape (n_spikes,), increasing spike times.
+        isi_threshold: maximal ISI within a burst.
+        min_spikes: minimal number of spikes of a burst.
+
+    Returns:
+        first, last: ndarrays of shape (n_bursts,), indices in spike_times of the first and
+            last spike of each burst.
+    """
+    spike_times = np.asarray(spike_times)
+    if spike_times.size == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    # --- a new group starts at the first spike and after each long ISI
+    starts = np.flatnonzero(np.concatenate([[True], np.diff(spike_times) >= isi_threshold]))
+    stops = np.append(starts[1:], spike_times.size) - 1
+    kept = stops - starts + 1 >= min_spikes
+    return starts[kept], stops[kept]
+
+
+def classify_bursts(t, v, burst_starts, burst_ends):
+    """
+    Classifies bursts as square-wave or parabolic.
+
+    The minimum voltage during each burst is compared with the mean voltage of the
+    preceding and following inter-burst intervals (mean of the available ones); the first
+    and last bursts only have one neighbouring interval, a single burst has none (OTHER).
+
+    Parameters:
+        t, v: ndarrays of shape (N,), time and voltage.
+        burst_starts, burst_ends: ndarrays of shape (n_bursts,), times of the first and last
+            spike of each burst (increasing, non-overlapping).
+
+    Returns:
+        ndarray of shape (n_bursts,), burst types (SQUARE_WAVE, PARABOLIC or OTHER).
+    """
+    n_bursts = len(burst_starts)
+    labels = np.full(n_bursts, OTHER)
+    if n_bursts < 2:
+        return labels
+
+    # --- segments [start_0, end_0], (end_0, start_1), [start_1, end_1], ... of the trace
+    first = np.searchsorted(t, burst_starts, side="left")
+    after = np.searchsorted(t, burst_ends, side="right")
+    bounds = np.column_stack([first, after]).ravel()
+    lengths = np.diff(bounds)
+    burst_min = np.minimum.reduceat(v, bounds)[0::2]
+    gap_mean = np.add.reduceat(v, bounds)[1:-1:2] / lengths[1::2]
+
+    # --- mean of the previous and next inter-burst intervals
+    prev_mean = np.concatenate([[np.nan], gap_mean])
+    next_mean = np.concatenate([gap_mean, [np.nan]])
+    inter_mean = np.nanmean(np.stack([prev_mean, next_mean]), axis=0)
+    labels[burst_min > inter_mean] = SQUARE_WAVE
+    labels[burst_min < inter_mean] = PARABOLIC
+    return labels
+
+
+def burst_statistics(t, v, height=-30.0, isi_threshold=0.3, min_spikes=2, **kwargs):
+    """
+    Spike and burst statistics of a voltage trace.
+
+    Parameters:
+        t, v: ndarrays of shape (N,), time and voltage.
+        height, kwargs: spike detection (see detect_spikes).
+        isi_threshold, min_spikes: burst detection (see detect_bursts).
+
+    Returns:
+        dict of floats (NaN when undefined):
+            "n_spikes", "n_bursts": numbers of spikes and bursts;
+            "spikes_per_burst": mean number of spikes per burst;
+            "burst_duration": mean time from the first to the last spike of a burst;
+            "burst_period": mean time between the starts of consecutive bursts;
+            "square_wave", "parabolic": fractions of the bursts of each type.
+    """
+    spike_times = t[detect_spikes(v, height=height, **kwargs)]
+    first, last = detect_bursts(spike_times, isi_threshold, min_spikes)
+    starts, ends = spike_times[first], spike_times[last]
+    labels = classify_bursts(t, v, starts, ends)
+
+    n_bursts = len(first)
+    return {
+        "n_spikes": float(len(spike_times)),
+        "n_bursts": float(n_bursts),
+        "spikes_per_burst": np.mean(last - first + 1) if n_bursts else np.nan,
+        "burst_duration": np.mean(ends - starts) if n_bursts else np.nan,
+        "burst_period": np.mean(np.diff(starts)) if n_bursts > 1 else np.nan,
+        "square_wave": np.mean(labels == SQUARE_WAVE) if n_bursts else np.nan,
+        "parabolic": np.mean(labels == PARABOLIC) if n_bursts else np.nan,
+    }
+
+
+# ___ ensembles of traces _________________________________________________________________________
+
+def ensemble_bursts(t, V, height=-30.0, isi_threshold=0.3, min_spikes=2):
+    """
+    Detects and classifies the bursts of R traces at once.
+
+    Parameters:
+        t: ndarray of shape (N,), time.
+        V: ndarray of shape (R, N), voltage traces.
+        height: minimal height of a spike (local maximum of a trace).
+        isi_threshold, min_spikes: burst detection (see detect_bursts).
+
+    Returns:
+        spikes: dict of ndarrays of shape (n_spikes,), "row" (realization) and "time";
+        bursts: dict of ndarrays of shape (n_bursts,), "row", "start", "end", "n_spikes" and
+            "type" (SQUARE_WAVE, PARABOLIC or OTHER), sorted by realization then time.
+    """
+    V = np.asarray(V, dtype=float)
+    R, N = V.shape
+
+    # --- spikes: local maxima above the height (the first sample of a flat peak)
+    middle = V[:, 1:-1]
+    rows, columns = np.nonzero((middle > V[:, :-2]) & (middle >= V[:, 2:]) & (middle >= height))
+    columns += 1
+    times = t[columns]
+
+    # --- groups of spikes: a new group at each new realization and after each long ISI
+    new_group = np.ones(len(rows), dtype=bool)
+    new_group[1:] = (rows[1:] != rows[:-1]) | (np.diff(times) >= isi_threshold)
+    first = np.flatnonzero(new_group)
+    last = np.append(first[1:], len(rows)) - 1
+    kept = last - first + 1 >= min_spikes
+    first, last = first[kept], last[kept]
+    burst_rows = rows[first]
+
+    # --- classification: minimum during each burst, mean of the neighbouring intervals
+    labels = np.full(len(first), OTHER)
+    if len(first) > 1:
+        flat = V.ravel()
+        begin = burst_rows * N + columns[first]
+        after = burst_rows * N + columns[last] + 1
+        bounds = np.column_stack([begin, after]).ravel()
+        burst_min = np.minimum.reduceat(flat, bounds)[0::2]
+        gap_sum = np.add.reduceat(flat, bounds)[1:-1:2]
+        same_row = burst_rows[1:] == burst_rows[:-1]
+        gap_mean = np.where(same_row, gap_sum / np.maximum(begin[1:] - after[:-1], 1), np.nan)
+        neighbours = np.stack([np.concatenate([[np.nan], gap_mean]), np.concatenate([gap_mean, [np.nan]])])
+        count = np.sum(~np.isnan(neighbours), axis=0)
+        inter_mean = np.where(count > 0, np.nansum(neighbours, axis=0) / np.maximum(count, 1), np.nan)
+        labels[burst_min > inter_mean] = SQUARE_WAVE
+        labels[burst_min < inter_mean] = PARABOLIC
+
+    spikes = {"row": rows, "time": times}
+    bursts = {"row": burst_rows, "start": times[first], "end": times[last], "n_spikes": last - first + 1,
+              "type": labels}
+    return spikes, bursts
+
+
+def ensemble_burst_statistics(t, V, height=-30.0, isi_threshold=0.3, min_spikes=2):
+    """
+    Spike and burst statistics of R traces, computed in one vectorized pass.
+
+    Parameters:
+        t: ndarray of shape (N,), time.
+        V: ndarray of shape (R, N) or (N,), voltage traces.
+        height, isi_threshold, min_spikes: see ensemble_bursts.
+
+    Returns:
+        dict of ndarrays of shape (R,) (or floats for a single trace of shape (N,)), with the
+        keys of burst_statistics.
+    """
+    V = np.asarray(V, dtype=float)
+    single = V.ndim == 1
+    V = np.atleast_2d(V)
+    R = V.shape[0]
+    spikes, bursts = ensemble_bursts(t, V, height, isi_threshold, min_spikes)
+
+    rows = bursts["row"]
+    n_bursts = np.bincount(rows, minlength=R).astype(float)
+
+    def burst_mean(values):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.bincount(rows, weights=values, minlength=R) / n_bursts
+
+    # --- intervals between the starts of consecutive bursts of the same realization
+    same_row = rows[1:] == rows[:-1]
+    period_rows = rows[1:][same_row]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        burst_period = (np.bincount(period_rows, weights=np.diff(bursts["start"])[same_row], minlength=R)
+                        / np.bincount(period_rows, minlength=R))
+
+    stats = {
+        "n_spikes": np.bincount(spikes["row"], minlength=R).astype(float),
+        "n_bursts": n_bursts,
+        "spikes_per_burst": burst_mean(bursts["n_spikes"]),
+        "burst_duration": burst_mean(bursts["end"] - bursts["start"]),
+        "burst_period": burst_period,
+        "square_wave": burst_mean(bursts["type"] == SQUARE_WAVE),
+        "parabolic": burst_mean(bursts["type"] == PARABOLIC),
+    }
+    return {name: float(values[0]) for name, values in stats.items()} if single else stats
+
+
+def simulation_statistics(t_vals, paths, component="x", time_scale=1.0, voltage_scale=1.0, voltage_offset=0.0,
+                          height=0.0, isi_threshold=80.0, min_spikes=2):
+    """
+    Spike and burst statistics of simulated HR traces.
+
+    The model time and x are converted to the units of the analysis by
+        t = time_scale * t_model,    v = voltage_offset + voltage_scale * x,
+    and `height` and `isi_threshold` are expressed in these units. The defaults keep the model
+    units (the spikes of x cross 0, the intra-burst ISIs of the three reference regimes are
+    below 60 and the inter-burst intervals above 150).
+
+    Parameters:
+        t_vals: ndarray of shape (n_rec,), recorded times.
+        paths: output of the simulators, either the dict of hr_sde.simulate_hr_ensemble
+            (the `component` entry, of shape (R, n_rec), is used), an ndarray of shape
+            (R, n_rec) or a single trace of shape (n_rec,).
+        component: key of `paths` when it is a dict.
+        time_scale, voltage_scale, voltage_offset: unit conversion.
+        height, isi_threshold, min_spikes: see ensemble_bursts.
+
+    Returns:
+        dict of ndarrays of shape (R,) (floats for a single trace), see burst_statistics.
+    """
+    x = paths[component] if isinstance(paths, dict) else paths
+    t = time_scale * np.asarray(t_vals, dtype=float)
+    V = voltage_offset + voltage_scale * np.asarray(x, dtype=float)
+    return ensemble_burst_statistics(t, V, height, isi_threshold, min_spikes)
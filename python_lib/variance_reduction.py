@@ -0,0 +1,139 @@
+"""
+Monte Carlo estimators for the variance-reduced SDE ensembles
+
+Each estimator takes per-realization values of a quantity of interest (e.g. the mean of b
+over a path, a burst count, the final z), of shape (R,) or (R, ...) (the statistics are
+computed along the first axis), and returns a dict with
+
+    "mean"                the estimate,
+    "std_error"           its standard error,
+    "variance_reduction"  variance of the plain Monte Carlo estimate with the same number of
+                          paths divided by the variance achieved,
+    "effective_size"      number of independent paths giving the same variance
+                          (R * variance_reduction),
+
+so that the number of realizations needed for a target confidence can be read directly.
+
+Estimators:
+    plain_estimate              independent paths (sampling="mc").
+    antithetic_estimate         paths r and r + R/2 driven by opposite noises
+                                (sampling="antithetic", in each chunk of chunk_size paths).
+    randomized_qmc_estimate     groups of paths driven by independent scramblings of the
+                                same Sobol sequence (sampling="sobol", one group per chunk).
+    paired_difference           difference between two configurations driven by common
+                                random numbers (hr_sde.simulate_hr_rho_sweep or
+                                simulate_hr_parameter_sweep, or calls with the same seed).
+
+The plain Monte Carlo variance is estimated from the spread of the individual paths, whose
+marginal distribution is the same with all the samplings.
+
+Usage:
+    t_vals, paths = simulate_hr_ensemble(params, X0, T=2000, N=400000, R=1024, chunk_size=256,
+                                         record_every=100, sampling="sobol", seed=1)
+    randomized_qmc_estimate(paths["b"].mean(axis=1), group_size=256)["variance_reduction"]
+"""
+
+import numpy as np
+
+
+def _result(mean, variance, plain_variance, R):
+    """
+    Packs an estimate, from its variance and that of plain Monte Carlo with R paths.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        reduction = np.where(variance > 0, plain_variance / variance, np.inf)[()]
+    return {
+        "mean": mean,
+        "std_error": np.sqrt(variance),
+        "variance_reduction": reduction,
+        "effective_size": R * reduction,
+    }
+
+
+def plain_estimate(values):
+    """
+    Plain Monte Carlo estimate from independent paths.
+
+    Parameters:
+        values: ndarray of shape (R, ...), values of the quantity of interest.
+
+    Returns:
+        dict (see the module documentation), variance_reduction = 1.
+    """
+    values = np.asarray(values, dtype=float)
+    R = len(values)
+    variance = values.var(axis=0, ddof=1) / R
+    return _result(values.mean(axis=0), variance, variance, R)
+
+
+def antithetic_estimate(values, chunk_size=None):
+    """
+    Estimate from antithetic pairs (hr_sde.simulate_hr_ensemble with sampling="antithetic").
+
+    Parameters:
+        values: ndarray of shape (R, ...), values of the quantity of interest.
+        chunk_size: chunk size of the simulation (paths r and r + chunk/2 of each chunk are
+            paired, None: one chunk of R paths).
+
+    Returns:
+        dict (see the module documentation).
+    """
+    values = np.asarray(values, dtype=float)
+    R = len(values)
+    chunk_size = R if chunk_size is None else chunk_size
+    pairs = []
+    for start in range(0, R, chunk_size):
+        chunk = values[start:start + chunk_size]
+        half = len(chunk) // 2
+        if 2 * half != len(chunk):
+            raise ValueError(f"The chunks must have an even number of paths, but got {len(chunk)}.")
+        pairs.append(0.5 * (chunk[:half] + chunk[half:]))
+    pairs = np.concatenate(pairs)
+    variance = pairs.var(axis=0, ddof=1) / len(pairs)
+    return _result(pairs.mean(axis=0), variance, values.var(axis=0, ddof=1) / R, R)
+
+
+def randomized_qmc_estimate(values, group_size):
+    """
+    Randomized quasi-Monte Carlo estimate from independently scrambled groups
+    (hr_sde.simulate_hr_ensemble with sampling="sobol", group_size = chunk_size).
+
+    The standard error is that of the mean of the group means, which are independent.
+
+    Parameters:
+        values: ndarray of shape (R, ...), values of the quantity of interest.
+        group_size: number of paths per scrambling (R must be a multiple, at least 2 groups).
+
+    Returns:
+        dict (see the module documentation).
+    """
+    values = np.asarray(values, dtype=float)
+    R = len(values)
+    n_groups = R // group_size
+    if n_groups < 2 or n_groups * group_size != R:
+        raise ValueError(f"R = {R} must be a multiple of group_size = {group_size}, with at least 2 groups.")
+    means = values.reshape((n_groups, group_size) + values.shape[1:]).mean(axis=1)
+    variance = means.var(axis=0, ddof=1) / n_groups
+    return _result(means.mean(axis=0), variance, values.var(axis=0, ddof=1) / R, R)
+
+
+def paired_difference(values_a, values_b):
+    """
+    Estimate of the difference of the means of two configurations driven by common random
+    numbers (path r of both configurations shares its noise).
+
+    The reference variance is that of the difference of two independent ensembles of R paths.
+
+    Parameters:
+        values_a, values_b: ndarrays of shape (R, ...), values of the quantity of interest.
+
+    Returns:
+        dict (see the module documentation), for the difference mean(a) - mean(b).
+    """
+    values_a, values_b = np.asarray(values_a, dtype=float), np.asarray(values_b, dtype=float)
+    if values_a.shape != values_b.shape:
+        raise ValueError(f"The values must have the same shape, but got {values_a.shape} and {values_b.shape}.")
+    R = len(values_a)
+    difference = values_a - values_b
+    independent = (values_a.var(axis=0, ddof=1) + values_b.var(axis=0, ddof=1)) / R
+    return _result(difference.mean(axis=0), difference.var(axis=0, ddof=1) / R, independent, R)